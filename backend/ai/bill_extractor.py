@@ -4,6 +4,7 @@ import json
 import re
 import requests
 from flask import current_app
+from storage.file_manager import FileManager
 import logging
 
 logger = logging.getLogger(__name__)
@@ -29,12 +30,12 @@ class BillExtractor:
     
     @staticmethod
     def extract_text_from_image(image_path: str) -> str:
-        if not os.path.exists(image_path):
+        if not FileManager.file_exists(image_path):
             logger.error(f"Image not found: {image_path}")
             return ""
         
         try:
-            with open(image_path, "rb") as image_file:
+            with FileManager.open_file(image_path) as image_file:
                 image_data = image_file.read()
                 image_base64 = base64.b64encode(image_data).decode('utf-8')
             
@@ -44,6 +45,8 @@ class BillExtractor:
                 mime_type = "image/png"
             elif image_ext in [".jpg", ".jpeg"]:
                 mime_type = "image/jpeg"
+            elif image_ext == ".webp":
+                mime_type = "image/webp"
             
             api_key = current_app.config.get('OPENAI_API_KEY')
             endpoint = current_app.config.get('OPENAI_ENDPOINT')
@@ -232,23 +235,29 @@ Expected JSON Output:
     
     @staticmethod
     def extract_bill_data(image_path: str) -> dict:
+        structured_data, _ = BillExtractor.extract_bill_data_with_text(image_path)
+        return structured_data
+    
+    @staticmethod
+    def extract_bill_data_with_text(image_path: str) -> tuple:
+        """Returns (structured_data, extracted_text); structured_data is {} on failure."""
         try:
             extracted_text = BillExtractor.extract_text_from_image(image_path)
             
             if not extracted_text:
                 logger.warning(f"No text extracted from {image_path}")
-                return {}
+                return {}, ""
             
             structured_data = BillExtractor.process_text_with_openai(extracted_text)
             
             if not structured_data:
                 logger.warning(f"No structured data extracted from {image_path}")
-                return {}
+                return {}, extracted_text
             
             logger.info(f"Successfully extracted bill data from {image_path}")
-            return structured_data
+            return structured_data, extracted_text
             
         except Exception as e:
             logger.error(f"Error in bill extraction pipeline: {str(e)}", exc_info=True)
-            return {}
+            return {}, ""
 
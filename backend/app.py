@@ -2,17 +2,24 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from flask import Flask, send_file, render_template, send_from_directory, request
+from flask import Flask, render_template, send_from_directory, send_file, request
 from flask_cors import CORS
 from config import Config
 from extensions.mongodb import mongodb
 from utils.logger import setup_logger
 from utils.responses import error_response
+from utils.json_provider import init_json_provider
+from utils.compression import init_compression
+from storage.backends import init_storage
+from storage.file_manager import FileManager
+from storage.previews import PreviewService, PREVIEW_SIZES, PREVIEW_MAX_AGE
 from auth.routes import auth_bp
 from expenses.routes import expenses_bp
 from hr.routes import hr_bp
 from users.routes import users_bp
+from jobs.cli import jobs_cli
 import os
+import gzip
 import logging
 
 logger = logging.getLogger(__name__)
@@ -28,6 +35,7 @@ def create_app():
     )
     
     app.config.from_object(Config)
+    init_json_provider(app)
     
     try:
         Config.validate()
@@ -38,13 +46,17 @@ def create_app():
     CORS(app, 
          resources={r"/*": {"origins": "*"}},
          supports_credentials=True,
-         allow_headers=["Content-Type", "Authorization"],
+         allow_headers=["Content-Type", "Authorization", "Upload-Offset", "Upload-Checksum"],
          methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
     logger.info("CORS enabled for all origins")
     
+    init_compression(app)
+    
     mongodb.init_app(app)
     logger.info("MongoDB initialized")
     
+    init_storage(app)
+    
     setup_logger(app)
     
     app.register_blueprint(auth_bp)
@@ -59,6 +71,8 @@ def create_app():
     app.register_blueprint(users_bp)
     logger.info("Users blueprint registered")
     
+    app.cli.add_command(jobs_cli)
+    
     upload_folder = app.config.get('UPLOAD_FOLDER', 'uploads/expenses')
     os.makedirs(upload_folder, exist_ok=True)
     logger.info(f"Upload folder: {upload_folder}")
@@ -105,13 +119,33 @@ def create_app():
             upload_folder_abs = os.path.abspath(upload_folder)
             full_path_abs = os.path.abspath(full_path)
             
-            if not full_path_abs.startswith(upload_folder_abs):
+            if not full_path_abs.startswith(upload_folder_abs + os.sep):
                 return error_response("Invalid file path", 403)
             
-            if not os.path.exists(full_path_abs):
+            # .reports/, .quarantine/ and .tmp/ are internal; reports are
+            # downloaded through /hr/report-jobs with HR authorization
+            if os.path.relpath(full_path_abs, upload_folder_abs).startswith('.'):
                 return error_response("File not found", 404)
             
-            return send_file(full_path_abs)
+            if not FileManager.file_exists(full_path):
+                return error_response("File not found", 404)
+            
+            size = request.args.get('size')
+            if size:
+                if size not in PREVIEW_SIZES:
+                    return error_response(f"size must be one of: {', '.join(PREVIEW_SIZES)}", 400)
+                preview_path = PreviewService.get_preview_path(full_path, size)
+                if preview_path:
+                    return FileManager.send_stored_file(preview_path, max_age=PREVIEW_MAX_AGE)
+            
+            if full_path.endswith('.gz'):
+                # Archived receipts may be stored gzip-compressed
+                return send_file(
+                    gzip.open(full_path, 'rb'),
+                    download_name=os.path.basename(full_path)[:-len('.gz')]
+                )
+            
+            return FileManager.send_stored_file(full_path)
             
         except Exception as e:
             logger.error(f"Error serving file: {str(e)}")
@@ -0,0 +1,76 @@
+"""
+Measure CPU cost against bytes saved for each compression level on
+expense list JSON and CSV export payloads.
+
+Run from the backend directory:
+    python benchmarks/bench_compression.py --rows 20000
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from expenses.models import ExpenseModel
+from expenses.service import ExpenseService
+from utils.compression import compress_bytes, brotli
+from utils.json_provider import BSONJSONProvider
+from bench_serialization import make_expenses
+import argparse
+import time
+
+GZIP_LEVELS = (1, 6, 9)
+BROTLI_LEVELS = (1, 4, 6, 11)
+
+def build_payloads(rows: int) -> dict:
+    app = Flask(__name__)
+    expenses = make_expenses(rows)
+    list_json = BSONJSONProvider(app).dumps(
+        {'expenses': ExpenseModel.format_expense_list(expenses)}
+    )
+    
+    export_rows = [{
+        'Date': exp['extracted_data']['Date'],
+        'Vendor': exp['extracted_data']['Details'],
+        'Bill Type': exp['extracted_data']['Bill Type'],
+        'Amount (INR)': ExpenseModel.get_amount_inr(exp),
+        'Status': exp['status'],
+        'HR Notes': '',
+        'Created At': exp['created_at'].strftime('%Y-%m-%d %H:%M:%S'),
+        'Updated At': exp['updated_at'].strftime('%Y-%m-%d %H:%M:%S'),
+    } for exp in expenses]
+    export_csv = ''.join(ExpenseService._stream_csv(export_rows))
+    
+    return {'list json': list_json.encode('utf-8'), 'export csv': export_csv.encode('utf-8')}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    
+    settings = [('gzip', level) for level in GZIP_LEVELS]
+    if brotli is not None:
+        settings += [('br', level) for level in BROTLI_LEVELS]
+    
+    for label, payload in build_payloads(args.rows).items():
+        print(f"-- {label}: {len(payload) / 1024:.0f} KiB")
+        print(
+            f"{'encoding':<10} {'cpu ms':>9} {'size KiB':>10} {'ratio':>7} "
+            f"{'ms per MiB saved':>18}"
+        )
+        for encoding, level in settings:
+            best = float('inf')
+            for _ in range(args.repeat):
+                started = time.process_time()
+                compressed = compress_bytes(payload, encoding, level)
+                best = min(best, time.process_time() - started)
+            
+            saved_mib = (len(payload) - len(compressed)) / 1024 / 1024
+            print(
+                f"{encoding + ':' + str(level):<10} {best * 1000:>9.1f} "
+                f"{len(compressed) / 1024:>10.0f} {len(payload) / len(compressed):>6.1f}x "
+                f"{best * 1000 / saved_mib:>18.2f}"
+            )
+
+if __name__ == '__main__':
+    main()
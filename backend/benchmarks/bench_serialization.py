@@ -0,0 +1,106 @@
+"""
+Compare expense list serialization: per-row formatting with Flask's default
+JSON provider versus format_expense_list with the orjson provider.
+
+Run from the backend directory:
+    python benchmarks/bench_serialization.py --rows 20000
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from bson import ObjectId
+from datetime import datetime, timedelta
+from expenses.models import ExpenseModel, LIST_FIELDS
+from utils.json_provider import OrjsonProvider, BSONJSONProvider, orjson
+import argparse
+import random
+import time
+import tracemalloc
+
+def make_expenses(count: int) -> list:
+    random.seed(42)
+    user_ids = [ObjectId() for _ in range(50)]
+    start = datetime(2023, 1, 1)
+    expenses = []
+    for i in range(count):
+        amount = f"₹{random.randint(50, 50000):,}.{random.randint(0, 99):02d}"
+        extracted = {
+            'Date': (start + timedelta(days=i % 700)).strftime('%d-%m-%Y'),
+            'Time': '03:45',
+            'Time (AM/PM)': 'PM',
+            'Bill Type': random.choice(['food', 'cab', 'flight']),
+            'Currency Name': 'INR',
+            'Bill Amount': amount,
+            'Bill Amount (INR)': amount,
+            'Details': f"Vendor {i % 300}"
+        }
+        expense = ExpenseModel.create_expense(
+            str(random.choice(user_ids)), f"uploads/expenses/{i}.jpg", extracted
+        )
+        expense['_id'] = ObjectId()
+        expense['user_email'] = f"user{i % 50}@example.com"
+        expenses.append(expense)
+    return expenses
+
+def measure(label: str, run, repeat: int) -> None:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+    
+    tracemalloc.start()
+    payload = run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    print(
+        f"{label:<42} {best * 1000:>9.1f} ms {peak / 1024 / 1024:>9.1f} MiB peak "
+        f"{len(payload) / 1024:>9.0f} KiB"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    
+    app = Flask(__name__)
+    default_provider = DefaultJSONProvider(app)
+    bson_provider = BSONJSONProvider(app)
+    expenses = make_expenses(args.rows)
+    
+    print(f"{args.rows} expenses, best of {args.repeat}")
+    print(f"{'path':<42} {'time':>12} {'allocations':>15} {'size':>13}")
+    
+    for label, fields in (('full documents', None), ('list fields', LIST_FIELDS)):
+        print(f"-- {label}")
+        measure(
+            'format_expense_response + default json',
+            lambda: default_provider.dumps({'expenses': [
+                ExpenseModel.format_expense_response(exp, fields) for exp in expenses
+            ]}),
+            args.repeat
+        )
+        measure(
+            'format_expense_list + stdlib json',
+            lambda: bson_provider.dumps(
+                {'expenses': ExpenseModel.format_expense_list(expenses, fields)}
+            ),
+            args.repeat
+        )
+        if orjson is not None:
+            orjson_provider = OrjsonProvider(app)
+            measure(
+                'format_expense_list + orjson',
+                lambda: orjson_provider.dumps(
+                    {'expenses': ExpenseModel.format_expense_list(expenses, fields)}
+                ),
+                args.repeat
+            )
+
+if __name__ == '__main__':
+    main()
@@ -25,11 +25,77 @@ class Config:
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
     MAX_FILE_SIZE = 10 * 1024 * 1024
     
+    # Resumable uploads (/expenses/uploads) for files too large to send in one request
+    RESUMABLE_MAX_FILE_SIZE = int(os.getenv('RESUMABLE_MAX_FILE_SIZE', str(100 * 1024 * 1024)))
+    UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(4 * 1024 * 1024)))
+    UPLOAD_CHUNK_MAX_SIZE = int(os.getenv('UPLOAD_CHUNK_MAX_SIZE', str(16 * 1024 * 1024)))
+    UPLOAD_SESSION_FOLDER = os.getenv('UPLOAD_SESSION_FOLDER', 'uploads/sessions')
+    UPLOAD_SESSION_TTL_HOURS = int(os.getenv('UPLOAD_SESSION_TTL_HOURS', '24'))
+    
+    # local (UPLOAD_FOLDER) or s3 (any S3-compatible store, e.g. MinIO)
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+    S3_BUCKET = os.getenv('S3_BUCKET')
+    S3_PREFIX = os.getenv('S3_PREFIX', '')
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')
+    S3_REGION = os.getenv('S3_REGION')
+    S3_ACCESS_KEY_ID = os.getenv('S3_ACCESS_KEY_ID')
+    S3_SECRET_ACCESS_KEY = os.getenv('S3_SECRET_ACCESS_KEY')
+    STORAGE_PRESIGN_DOWNLOADS = os.getenv('STORAGE_PRESIGN_DOWNLOADS', 'true').lower() == 'true'
+    STORAGE_PRESIGN_EXPIRES = int(os.getenv('STORAGE_PRESIGN_EXPIRES', '300'))
+    
+    # Hand file bodies to the front proxy: '' (serve from Python),
+    # 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache mod_xsendfile, lighttpd)
+    FILE_OFFLOAD = os.getenv('FILE_OFFLOAD', '').lower()
+    FILE_OFFLOAD_PREFIX = os.getenv('FILE_OFFLOAD_PREFIX', '/protected-files')
+    USE_X_SENDFILE = FILE_OFFLOAD == 'x-sendfile'
+    FILE_CACHE_MAX_AGE = int(os.getenv('FILE_CACHE_MAX_AGE', str(365 * 24 * 3600)))
+    
+    PREVIEW_ON_UPLOAD = os.getenv('PREVIEW_ON_UPLOAD', 'true').lower() == 'true'
+    PREVIEW_WORKERS = int(os.getenv('PREVIEW_WORKERS', '2'))
+    PREVIEW_WAIT_SECONDS = float(os.getenv('PREVIEW_WAIT_SECONDS', '10'))
+    
+    # Storage reconciliation: unreferenced files younger than this are left
+    # alone; quarantined files are deleted after GC_QUARANTINE_DAYS
+    GC_MIN_AGE_HOURS = float(os.getenv('GC_MIN_AGE_HOURS', '24'))
+    GC_QUARANTINE_DAYS = float(os.getenv('GC_QUARANTINE_DAYS', '7'))
+    
+    # At-rest recompression of receipt photos (jobs recompress-receipts)
+    RECOMPRESS_FORMAT = os.getenv('RECOMPRESS_FORMAT', 'webp').lower()
+    RECOMPRESS_MAX_EDGE = int(os.getenv('RECOMPRESS_MAX_EDGE', '2400'))
+    RECOMPRESS_QUALITY = int(os.getenv('RECOMPRESS_QUALITY', '85'))
+    RECOMPRESS_MIN_SAVING = float(os.getenv('RECOMPRESS_MIN_SAVING', '0.2'))
+    RECOMPRESS_WORKERS = int(os.getenv('RECOMPRESS_WORKERS', '2'))
+    RECOMPRESS_KEEP_PENDING_ORIGINALS = (
+        os.getenv('RECOMPRESS_KEEP_PENDING_ORIGINALS', 'true').lower() == 'true'
+    )
+    
+    # Reimbursement pack PDFs; larger packs run as report jobs (jobs run-report-jobs)
+    PACK_IMAGE_MAX_EDGE = int(os.getenv('PACK_IMAGE_MAX_EDGE', '1600'))
+    PACK_IMAGE_QUALITY = int(os.getenv('PACK_IMAGE_QUALITY', '70'))
+    PACK_SYNC_MAX_EXPENSES = int(os.getenv('PACK_SYNC_MAX_EXPENSES', '50'))
+    REPORT_RETENTION_HOURS = int(os.getenv('REPORT_RETENTION_HOURS', '72'))
+    REPORT_JOB_TIMEOUT_MINUTES = int(os.getenv('REPORT_JOB_TIMEOUT_MINUTES', '60'))
+    
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+    ARCHIVE_COMPRESS_FILES = os.getenv('ARCHIVE_COMPRESS_FILES', 'false').lower() == 'true'
+    
+    DUPLICATE_HASH_DISTANCE = int(os.getenv('DUPLICATE_HASH_DISTANCE', '6'))
+    
     RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
     RATE_LIMIT_PER_MINUTE = int(os.getenv('RATE_LIMIT_PER_MINUTE', '60'))
     
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     
+    QUERY_PROFILER_ENABLED = os.getenv('QUERY_PROFILER_ENABLED', 'false').lower() == 'true'
+    SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', '100'))
+    
+    JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'auto')
+    
+    COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+    COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+    COMPRESSION_BROTLI_LEVEL = int(os.getenv('COMPRESSION_BROTLI_LEVEL', '4'))
+    
     PORT = int(os.getenv('PORT', 8000))
     HOST = os.getenv('HOST', '0.0.0.0')
     
@@ -39,6 +105,8 @@ class Config:
     def validate():
         required_vars = ['OPENAI_API_KEY', 'JWT_SECRET', 'MONGO_URI']
         missing = [var for var in required_vars if not os.getenv(var)]
+        if os.getenv('STORAGE_BACKEND', 'local').lower() == 's3' and not os.getenv('S3_BUCKET'):
+            missing.append('S3_BUCKET')
         
         if missing:
             raise ValueError(
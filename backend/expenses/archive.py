@@ -0,0 +1,210 @@
+"""
+Hot/cold tiering of settled expenses into the expenses_archive collection.
+"""
+from extensions.mongodb import mongodb
+from expenses.models import ExpenseStatus
+from storage.file_manager import FileManager
+from storage.backends import get_storage
+from flask import current_app
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Iterable
+from pymongo import ReplaceOne
+import heapq
+import gzip
+import logging
+import os
+import shutil
+import time
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLLECTION = 'expenses_archive'
+ARCHIVE_STATE_ID = 'expense_archive'
+SETTLED_STATUSES = [ExpenseStatus.APPROVED, ExpenseStatus.REJECTED]
+# Moved receipts stay under UPLOAD_FOLDER so /files and previews still serve them
+ARCHIVE_PREFIX = 'archive/'
+
+class ArchiveService:
+    @staticmethod
+    def get_horizon() -> Optional[Dict[str, Any]]:
+        """Latest created_at/bill_date present in the archive, or None if it is empty."""
+        return mongodb.get_collection('job_state').find_one({'_id': ARCHIVE_STATE_ID})
+    
+    @staticmethod
+    def needs_archive(filters: Dict[str, Any]) -> bool:
+        """
+        Whether a listing with these filters can match archived expenses.
+        
+        Only settled expenses are archived, and the archive horizon records
+        the newest dates it holds, so recent or pending-only queries skip it.
+        """
+        status = filters.get('status')
+        if status and status not in SETTLED_STATUSES:
+            return False
+        
+        horizon = ArchiveService.get_horizon()
+        if not horizon:
+            return False
+        
+        date_from = filters.get('date_from')
+        if date_from and horizon.get('max_created_at') and date_from > horizon['max_created_at']:
+            return False
+        
+        bill_date_from = filters.get('bill_date_from')
+        max_bill_date = horizon.get('max_bill_date')
+        if bill_date_from and (not max_bill_date or bill_date_from > max_bill_date):
+            return False
+        
+        return True
+    
+    @staticmethod
+    def find_expenses(
+        query: Dict[str, Any],
+        filters: Dict[str, Any],
+        projection: Optional[Dict[str, int]] = None
+    ) -> Iterable[Dict[str, Any]]:
+        """
+        Expenses matching query, newest first, including the archive when needed.
+        
+        Both collections are read with the same sort and merged lazily, so
+        callers can stream the result.
+        """
+        live = mongodb.get_collection('expenses').find(query, projection).sort('created_at', -1)
+        if not ArchiveService.needs_archive(filters):
+            return live
+        
+        archived = (
+            mongodb.get_collection(ARCHIVE_COLLECTION)
+            .find(query, projection)
+            .sort('created_at', -1)
+        )
+        return heapq.merge(live, archived, key=lambda expense: expense['created_at'], reverse=True)
+    
+    @staticmethod
+    def find_expense(
+        query: Dict[str, Any],
+        projection: Optional[Dict[str, int]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Single expense from the live collection, falling back to the archive."""
+        expense = mongodb.get_collection('expenses').find_one(query, projection)
+        if expense is None:
+            expense = mongodb.get_collection(ARCHIVE_COLLECTION).find_one(query, projection)
+        return expense
+    
+    @staticmethod
+    def _move_file(image_path: str, compress: bool) -> Optional[str]:
+        """Move a receipt under UPLOAD_FOLDER/archive/, optionally gzip-compressed."""
+        key = FileManager.storage_key(image_path)
+        if key is not None and get_storage().local_path(key) is None:
+            # Object stores tier cold data with bucket lifecycle rules instead
+            logger.info(f"Not moving {image_path}: storage backend is not local")
+            return None
+        if not image_path or not os.path.exists(image_path):
+            return None
+        
+        upload_folder = current_app.config.get('UPLOAD_FOLDER', 'uploads/expenses')
+        
+        relative_path = os.path.relpath(image_path, upload_folder)
+        if relative_path.startswith('..'):
+            relative_path = os.path.basename(image_path)
+        destination = os.path.join(upload_folder, ARCHIVE_PREFIX, relative_path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        
+        # Content-addressed blobs may be shared with live expenses, so they are
+        # copied and the reference released instead of moving the file
+        shared = FileManager.get_blob_key(image_path) is not None
+        
+        if compress:
+            destination = f"{destination}.gz"
+            with open(image_path, 'rb') as source, gzip.open(destination, 'wb') as target:
+                shutil.copyfileobj(source, target)
+        elif shared:
+            shutil.copyfile(image_path, destination)
+        else:
+            shutil.move(image_path, destination)
+        
+        if shared:
+            FileManager.delete_file(image_path)
+        elif compress:
+            os.remove(image_path)
+        
+        return destination
+    
+    @staticmethod
+    def archive_settled_expenses(
+        older_than_days: int,
+        batch_size: int = 200,
+        pause: float = 0.5,
+        move_files: bool = False,
+        compress_files: bool = False
+    ) -> int:
+        """
+        Move approved/rejected expenses last updated before the cutoff to the archive.
+        
+        Each batch is copied, the horizon advanced, then removed from the live
+        collection with a guard on status/updated_at. Expenses that changed in
+        the meantime stay live and their archive copies are dropped. Files are
+        only moved once the expense has left the live collection.
+        
+        Returns:
+            Number of expenses archived
+        """
+        expenses_collection = mongodb.get_collection('expenses')
+        archive_collection = mongodb.get_collection(ARCHIVE_COLLECTION)
+        job_state = mongodb.get_collection('job_state')
+        
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        settled = {'status': {'$in': SETTLED_STATUSES}, 'updated_at': {'$lt': cutoff}}
+        
+        archived_total = 0
+        while True:
+            batch = list(expenses_collection.find(settled).sort('_id', 1).limit(batch_size))
+            if not batch:
+                break
+            
+            archived_at = datetime.utcnow()
+            archive_collection.bulk_write(
+                [
+                    ReplaceOne(
+                        {'_id': doc['_id']}, {**doc, 'archived_at': archived_at}, upsert=True
+                    )
+                    for doc in batch
+                ],
+                ordered=False
+            )
+            
+            horizon = {'max_created_at': max(doc['created_at'] for doc in batch)}
+            bill_dates = [doc['bill_date'] for doc in batch if doc.get('bill_date')]
+            if bill_dates:
+                horizon['max_bill_date'] = max(bill_dates)
+            job_state.update_one({'_id': ARCHIVE_STATE_ID}, {'$max': horizon}, upsert=True)
+            
+            ids = [doc['_id'] for doc in batch]
+            expenses_collection.delete_many({'_id': {'$in': ids}, **settled})
+            
+            still_live = {
+                doc['_id'] for doc in expenses_collection.find({'_id': {'$in': ids}}, {'_id': 1})
+            }
+            if still_live:
+                archive_collection.delete_many({'_id': {'$in': list(still_live)}})
+            
+            moved = [doc for doc in batch if doc['_id'] not in still_live]
+            if move_files:
+                for doc in moved:
+                    new_path = ArchiveService._move_file(doc.get('image_path'), compress_files)
+                    if new_path:
+                        archive_collection.update_one(
+                            {'_id': doc['_id']}, {'$set': {'image_path': new_path}}
+                        )
+            
+            archived_total += len(moved)
+            logger.info(
+                f"Archive: {archived_total} expenses archived (cutoff {cutoff.isoformat()})"
+            )
+            
+            if len(batch) < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+        
+        return archived_total
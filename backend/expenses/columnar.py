@@ -0,0 +1,189 @@
+from extensions.mongodb import mongodb
+from expenses.models import ExpenseModel
+from bson import Decimal128
+from decimal import Decimal
+from typing import Iterable, Dict, Any, Optional
+import tempfile
+import logging
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.ipc as ipc
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+COLUMNAR_FORMATS = {
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrows', 'application/vnd.apache.arrow.stream')
+}
+
+ROW_GROUP_SIZE = 10000
+
+# Only the fields written to the columnar file are read from Mongo
+EXPORT_PROJECTION = {
+    'user_id': 1,
+    'status': 1,
+    'hr_notes': 1,
+    'amount_inr': 1,
+    'amount_original': 1,
+    'currency': 1,
+    'category': 1,
+    'bill_date': 1,
+    'created_at': 1,
+    'updated_at': 1,
+    'extracted_data.Date': 1,
+    'extracted_data.Details': 1,
+    'extracted_data.Bill Type': 1,
+    'extracted_data.Bill Amount': 1,
+    'extracted_data.Bill Amount (INR)': 1,
+    'extracted_data.Currency Name': 1,
+    'extracted_data.total': 1
+}
+
+def _schema(include_user_email: bool):
+    amount = pa.decimal128(14, 2)
+    category = pa.dictionary(pa.int32(), pa.string())
+    fields = [
+        pa.field('expense_id', pa.string(), nullable=False),
+        pa.field('user_id', pa.string(), nullable=False),
+        pa.field('bill_date', pa.timestamp('ms', tz='UTC')),
+        pa.field('vendor', pa.string()),
+        pa.field('bill_type', pa.string()),
+        pa.field('category', category),
+        pa.field('status', category),
+        pa.field('currency', category),
+        pa.field('amount_original', amount),
+        pa.field('amount_inr', amount),
+        pa.field('hr_notes', pa.string()),
+        pa.field('created_at', pa.timestamp('ms', tz='UTC')),
+        pa.field('updated_at', pa.timestamp('ms', tz='UTC'))
+    ]
+    if include_user_email:
+        fields.insert(2, pa.field('user_email', pa.string()))
+    return pa.schema(fields)
+
+def _decimal(value: Any) -> Optional[Decimal]:
+    return value.to_decimal() if isinstance(value, Decimal128) else None
+
+class ColumnarExporter:
+    """Write expense exports as typed Parquet files or Arrow IPC streams."""
+    
+    @staticmethod
+    def is_available() -> bool:
+        return pa is not None
+    
+    @staticmethod
+    def _typed_fields(expense: Dict[str, Any]) -> Dict[str, Any]:
+        """Typed fields, derived from extracted_data for documents not backfilled yet."""
+        if 'amount_inr' in expense and 'bill_date' in expense:
+            return expense
+        normalized = ExpenseModel.normalize_extracted_data(expense.get('extracted_data') or {})
+        return {**normalized, **expense}
+    
+    @staticmethod
+    def _columns(expenses: list, user_emails: Optional[Dict[Any, str]]) -> Dict[str, list]:
+        columns = {
+            'expense_id': [], 'user_id': [], 'bill_date': [], 'vendor': [], 'bill_type': [],
+            'category': [], 'status': [], 'currency': [], 'amount_original': [], 'amount_inr': [],
+            'hr_notes': [], 'created_at': [], 'updated_at': []
+        }
+        if user_emails is not None:
+            columns['user_email'] = []
+        
+        for exp in expenses:
+            typed = ColumnarExporter._typed_fields(exp)
+            extracted = exp.get('extracted_data') or {}
+            
+            columns['expense_id'].append(str(exp['_id']))
+            columns['user_id'].append(str(exp['user_id']))
+            if user_emails is not None:
+                columns['user_email'].append(user_emails.get(exp['user_id'], 'Unknown'))
+            columns['bill_date'].append(typed.get('bill_date'))
+            columns['vendor'].append(extracted.get('Details'))
+            columns['bill_type'].append(extracted.get('Bill Type'))
+            columns['category'].append(typed.get('category'))
+            columns['status'].append(exp.get('status'))
+            columns['currency'].append(typed.get('currency'))
+            columns['amount_original'].append(_decimal(typed.get('amount_original')))
+            columns['amount_inr'].append(_decimal(typed.get('amount_inr')))
+            columns['hr_notes'].append(exp.get('hr_notes') or None)
+            columns['created_at'].append(exp.get('created_at'))
+            columns['updated_at'].append(exp.get('updated_at'))
+        
+        return columns
+    
+    @staticmethod
+    def _lookup_emails(expenses: list, user_emails: Dict[Any, str]) -> None:
+        """Add emails for users in this batch that have not been seen yet."""
+        missing = {exp['user_id'] for exp in expenses} - user_emails.keys()
+        if not missing:
+            return
+        
+        users = mongodb.get_collection('users').find({'_id': {'$in': list(missing)}}, {'email': 1})
+        for user in users:
+            user_emails[user['_id']] = user['email']
+    
+    @staticmethod
+    def write(
+        expenses: Iterable[Dict[str, Any]],
+        format_type: str,
+        include_user_email: bool = False,
+        row_group_size: int = ROW_GROUP_SIZE
+    ):
+        """
+        Write expenses to a temporary file in row groups of row_group_size.
+        
+        The cursor is consumed one row group at a time, so memory stays
+        bounded by the row group rather than the export.
+        
+        Returns:
+            (file, row_count); the file is positioned at the start
+        """
+        schema = _schema(include_user_email)
+        user_emails = {} if include_user_email else None
+        output = tempfile.TemporaryFile()
+        
+        if format_type == 'parquet':
+            writer = pq.ParquetWriter(output, schema, compression='zstd')
+        else:
+            # The stream format allows each batch to carry its own dictionaries
+            writer = ipc.new_stream(output, schema, options=ipc.IpcWriteOptions(compression='zstd'))
+        
+        row_count = 0
+        try:
+            batch = []
+            for expense in expenses:
+                batch.append(expense)
+                if len(batch) >= row_group_size:
+                    ColumnarExporter._write_batch(writer, schema, batch, user_emails)
+                    row_count += len(batch)
+                    batch = []
+            
+            if batch:
+                ColumnarExporter._write_batch(writer, schema, batch, user_emails)
+                row_count += len(batch)
+            
+            writer.close()
+        except Exception:
+            output.close()
+            raise
+        
+        output.seek(0)
+        logger.info(f"Wrote {row_count} expenses as {format_type}")
+        return output, row_count
+    
+    @staticmethod
+    def _write_batch(writer, schema, batch: list, user_emails: Optional[Dict[Any, str]]) -> None:
+        if user_emails is not None:
+            ColumnarExporter._lookup_emails(batch, user_emails)
+        
+        columns = ColumnarExporter._columns(batch, user_emails)
+        record_batch = pa.RecordBatch.from_pydict(columns, schema=schema)
+        
+        if isinstance(writer, pq.ParquetWriter):
+            writer.write_table(pa.Table.from_batches([record_batch]), row_group_size=len(batch))
+        else:
+            writer.write_batch(record_batch)
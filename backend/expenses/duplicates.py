@@ -0,0 +1,256 @@
+"""
+Duplicate and near-duplicate receipt detection.
+
+Receipts are fingerprinted with a 64-bit pHash and dHash. Each hash is split
+into HASH_BANDS bands stored in the multikey hash_bands field; two hashes
+within Hamming distance d share, in at least one band, values that differ by
+at most d // HASH_BANDS bits (pigeonhole). A lookup therefore queries the
+band values within that radius and only compares full hashes for the few
+candidates returned, instead of scanning every expense.
+
+Both hashes are indexed because they fail differently on photographed
+receipts: blur and slight rotation move the pHash, while exposure changes
+on a mostly white page move the dHash.
+"""
+from extensions.mongodb import mongodb
+from expenses.archive import ARCHIVE_COLLECTION
+from storage.file_manager import FileManager
+from flask import current_app
+from pymongo import UpdateOne
+from itertools import combinations
+from typing import Optional, Dict, Any, List
+import math
+import logging
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+HASH_BANDS = 4
+BAND_BITS = HASH_BITS // HASH_BANDS
+# Band values within this radius are queried; larger radii grow the $in list quickly
+MAX_BAND_RADIUS = 2
+MAX_CANDIDATES = 200
+
+HASHABLE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+DUPLICATE_COLLECTIONS = ('expenses', ARCHIVE_COLLECTION)
+
+# 1-D DCT-II basis for the 8 lowest frequencies of a 32-sample signal
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+_DCT_BASIS = [
+    [math.cos(math.pi * (2 * n + 1) * k / (2 * _DCT_SIZE)) for n in range(_DCT_SIZE)]
+    for k in range(_DCT_KEEP)
+]
+
+def _grayscale_pixels(image_path: str, sizes: List[tuple]) -> List[list]:
+    """Grayscale pixel values of the image resized to each of sizes."""
+    with FileManager.open_file(image_path) as source, Image.open(source) as image:
+        # Lets the JPEG decoder downscale while decoding
+        image.draft('L', (_DCT_SIZE * 4, _DCT_SIZE * 4))
+        image = ImageOps.exif_transpose(image).convert('L')
+        return [list(image.resize(size, Image.LANCZOS).getdata()) for size in sizes]
+
+def dhash(pixels: list, width: int = 9) -> int:
+    """Difference hash: one bit per horizontally adjacent pixel pair of a 9x8 image."""
+    value = 0
+    for row in range(8):
+        offset = row * width
+        for col in range(8):
+            value = (value << 1) | int(pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+def phash(pixels: list) -> int:
+    """DCT hash: low 8x8 frequencies of a 32x32 image compared with their median."""
+    rows = [pixels[i * _DCT_SIZE:(i + 1) * _DCT_SIZE] for i in range(_DCT_SIZE)]
+    # Separable 2-D DCT restricted to the kept frequencies
+    row_coefficients = [
+        [sum(b * p for b, p in zip(basis, row)) for basis in _DCT_BASIS] for row in rows
+    ]
+    coefficients = [
+        sum(_DCT_BASIS[k][n] * row_coefficients[n][l] for n in range(_DCT_SIZE))
+        for k in range(_DCT_KEEP) for l in range(_DCT_KEEP)
+    ]
+    # The DC term reflects overall brightness, not structure
+    median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | int(coefficient > median)
+    return value
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+def hash_bands(kind: str, value: int) -> List[str]:
+    """Band keys ("<kind><band>:<hex>") for a 64-bit hash."""
+    mask = (1 << BAND_BITS) - 1
+    return [
+        f"{kind}{band}:{(value >> (band * BAND_BITS)) & mask:04x}"
+        for band in range(HASH_BANDS)
+    ]
+
+def neighbour_bands(kind: str, value: int, radius: int) -> List[str]:
+    """Band keys within radius bits of each of value's bands."""
+    mask = (1 << BAND_BITS) - 1
+    keys = []
+    for band in range(HASH_BANDS):
+        band_value = (value >> (band * BAND_BITS)) & mask
+        for distance in range(radius + 1):
+            for bits in combinations(range(BAND_BITS), distance):
+                flipped = band_value
+                for bit in bits:
+                    flipped ^= 1 << bit
+                keys.append(f"{kind}{band}:{flipped:04x}")
+    return keys
+
+class DuplicateDetector:
+    """Fingerprint receipts and find probable duplicate claims."""
+    
+    @staticmethod
+    def fingerprint(image_path: str) -> Dict[str, Any]:
+        """
+        Perceptual hash fields for an expense document.
+        
+        PDFs and unreadable images get image_hash None, so backfills do not
+        retry them.
+        """
+        if Image is None or not image_path or not image_path.lower().endswith(HASHABLE_EXTENSIONS):
+            return {'image_hash': None, 'hash_bands': []}
+        
+        try:
+            dct_pixels, diff_pixels = _grayscale_pixels(
+                image_path, [(_DCT_SIZE, _DCT_SIZE), (9, 8)]
+            )
+            phash_value = phash(dct_pixels)
+            dhash_value = dhash(diff_pixels)
+        except Exception as e:
+            logger.warning(f"Could not hash {image_path}: {str(e)}")
+            return {'image_hash': None, 'hash_bands': []}
+        
+        return {
+            'image_hash': {'phash': f"{phash_value:016x}", 'dhash': f"{dhash_value:016x}"},
+            'hash_bands': hash_bands('p', phash_value) + hash_bands('d', dhash_value)
+        }
+    
+    @staticmethod
+    def find_duplicates(
+        expense: Dict[str, Any],
+        max_distance: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Expenses that are probably the same claim as expense.
+        
+        Matches are either the same bill (amount_inr, bill_date and
+        vendor_key all equal) or a near-identical image (pHash or dHash
+        within max_distance bits).
+        
+        Returns:
+            List of {'expense_id', 'reason', 'distance'} entries
+        """
+        if max_distance is None:
+            max_distance = current_app.config.get('DUPLICATE_HASH_DISTANCE', 6)
+        
+        matches = {}
+        own_id = expense.get('_id')
+        
+        bill_query = None
+        bill_fields = ('amount_inr', 'bill_date', 'vendor_key')
+        if all(expense.get(field) is not None for field in bill_fields):
+            bill_query = {
+                'amount_inr': expense['amount_inr'],
+                'bill_date': expense['bill_date'],
+                'vendor_key': expense['vendor_key']
+            }
+        
+        image_hash = expense.get('image_hash')
+        band_passes = []
+        if image_hash:
+            own_phash = int(image_hash['phash'], 16)
+            own_dhash = int(image_hash['dhash'], 16)
+            radius = min(max_distance // HASH_BANDS, MAX_BAND_RADIUS)
+            # Exact band values first, so common bands (mostly white receipts)
+            # cannot push the closest candidates past the limit
+            exact = hash_bands('p', own_phash) + hash_bands('d', own_dhash)
+            band_passes.append(exact)
+            if radius:
+                neighbours = (
+                    neighbour_bands('p', own_phash, radius)
+                    + neighbour_bands('d', own_dhash, radius)
+                )
+                band_passes.append([key for key in neighbours if key not in exact])
+        
+        for collection_name in DUPLICATE_COLLECTIONS:
+            collection = mongodb.get_collection(collection_name)
+            
+            if bill_query:
+                for match in collection.find(bill_query, {'_id': 1}).limit(MAX_CANDIDATES):
+                    if match['_id'] != own_id:
+                        matches[match['_id']] = {
+                            'expense_id': match['_id'], 'reason': 'same_bill', 'distance': None
+                        }
+            
+            for bands in band_passes:
+                candidates = list(
+                    collection.find({'hash_bands': {'$in': bands}}, {'image_hash': 1})
+                    .limit(MAX_CANDIDATES)
+                )
+                if len(candidates) == MAX_CANDIDATES:
+                    logger.warning(
+                        f"Duplicate lookup in {collection_name} hit the "
+                        f"{MAX_CANDIDATES} candidate limit; some matches may be missed"
+                    )
+                for candidate in candidates:
+                    if candidate['_id'] == own_id or not candidate.get('image_hash'):
+                        continue
+                    distance = min(
+                        hamming(own_phash, int(candidate['image_hash']['phash'], 16)),
+                        hamming(own_dhash, int(candidate['image_hash']['dhash'], 16))
+                    )
+                    if distance <= max_distance:
+                        # An image match is stronger evidence than matching bill fields
+                        matches[candidate['_id']] = {
+                            'expense_id': candidate['_id'],
+                            'reason': 'similar_image',
+                            'distance': distance
+                        }
+        
+        return list(matches.values())
+    
+    @staticmethod
+    def link_duplicates(expense_id, duplicates: List[Dict[str, Any]]) -> None:
+        """Record expense_id on each matched expense so both sides of a pair are flagged."""
+        if not duplicates:
+            return
+        
+        for collection_name in DUPLICATE_COLLECTIONS:
+            operations = [
+                UpdateOne(
+                    {'_id': duplicate['expense_id'], 'duplicates.expense_id': {'$ne': expense_id}},
+                    {'$push': {'duplicates': {**duplicate, 'expense_id': expense_id}}}
+                )
+                for duplicate in duplicates
+            ]
+            mongodb.get_collection(collection_name).bulk_write(operations, ordered=False)
+    
+    @staticmethod
+    def record_duplicates(expense_id, duplicates: List[Dict[str, Any]]) -> None:
+        """Add duplicates to an existing expense and link back from each match."""
+        if not duplicates:
+            return
+        
+        for collection_name in DUPLICATE_COLLECTIONS:
+            operations = [
+                UpdateOne(
+                    {'_id': expense_id, 'duplicates.expense_id': {'$ne': duplicate['expense_id']}},
+                    {'$push': {'duplicates': duplicate}}
+                )
+                for duplicate in duplicates
+            ]
+            mongodb.get_collection(collection_name).bulk_write(operations, ordered=False)
+        
+        DuplicateDetector.link_duplicates(expense_id, duplicates)
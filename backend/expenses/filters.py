@@ -0,0 +1,210 @@
+"""
+Query building for expense list, export and summary endpoints.
+"""
+from bson import ObjectId, Decimal128
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Optional, Dict, Any, Tuple, List
+from expenses.models import ExpenseModel
+import re
+
+MAX_SEARCH_TERMS = 10
+
+# Keys read by parse_filter_args
+FILTER_KEYS = (
+    'user_id', 'status', 'bill_type', 'date_from', 'date_to',
+    'bill_date_from', 'bill_date_to', 'min_amount', 'max_amount'
+)
+
+def parse_date_param(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse an ISO date query parameter.
+    
+    Raises:
+        ValueError: If the value is not a valid ISO date
+    """
+    if not value:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid date: {value}")
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def parse_amount_param(value: Any) -> Optional[Decimal]:
+    """
+    Parse an amount filter value.
+    
+    Raises:
+        ValueError: If the value is not a number
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid amount: {value}")
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {value}")
+    if not amount.is_finite():
+        raise ValueError(f"Invalid amount: {value}")
+    return amount
+
+def build_expense_query(
+    user_id: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    bill_type: Optional[str] = None,
+    min_amount: Optional[Decimal] = None,
+    max_amount: Optional[Decimal] = None,
+    bill_date_from: Optional[datetime] = None,
+    bill_date_to: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """
+    Build the MongoDB filter shared by every expense listing.
+    
+    Returns:
+        Query dictionary for the expenses collection
+    """
+    query = {}
+    
+    if user_id:
+        query['user_id'] = ObjectId(user_id)
+    
+    if status:
+        query['status'] = status
+    
+    if date_from or date_to:
+        query['created_at'] = {}
+        if date_from:
+            query['created_at']['$gte'] = date_from
+        if date_to:
+            query['created_at']['$lte'] = date_to
+    
+    if bill_date_from or bill_date_to:
+        query['bill_date'] = {}
+        if bill_date_from:
+            query['bill_date']['$gte'] = bill_date_from
+        if bill_date_to:
+            query['bill_date']['$lte'] = bill_date_to
+    
+    if bill_type:
+        query['category'] = bill_type.strip().lower()
+    
+    if min_amount is not None or max_amount is not None:
+        query['amount_inr'] = {}
+        if min_amount is not None:
+            query['amount_inr']['$gte'] = Decimal128(min_amount)
+        if max_amount is not None:
+            query['amount_inr']['$lte'] = Decimal128(max_amount)
+    
+    return query
+
+def parse_filter_args(args, strict: bool = True) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    Read list filters from request query parameters.
+    
+    Args:
+        args: Request args or JSON object with the filter keys
+        strict: Report invalid values instead of ignoring them
+        
+    Returns:
+        (filters, error_message) where filters are keyword arguments for
+        build_expense_query
+    """
+    filters = {
+        'user_id': args.get('user_id'),
+        'status': args.get('status'),
+        'date_from': None,
+        'date_to': None,
+        'bill_date_from': None,
+        'bill_date_to': None,
+        'bill_type': args.get('bill_type'),
+        'min_amount': None,
+        'max_amount': None
+    }
+    
+    for param in ('user_id', 'status', 'bill_type'):
+        if filters[param] is not None and not isinstance(filters[param], str):
+            if strict:
+                return filters, f"{param} must be a string"
+            filters[param] = None
+    if strict and filters['user_id'] and not ObjectId.is_valid(filters['user_id']):
+        return filters, "Invalid user_id"
+    
+    for param in ('date_from', 'date_to', 'bill_date_from', 'bill_date_to'):
+        try:
+            filters[param] = parse_date_param(args.get(param))
+        except ValueError:
+            if strict:
+                return filters, f"Invalid {param} format. Use ISO format (YYYY-MM-DDTHH:MM:SS)"
+    
+    for param in ('min_amount', 'max_amount'):
+        try:
+            filters[param] = parse_amount_param(args.get(param))
+        except ValueError:
+            if strict:
+                return filters, f"Invalid {param}. Must be a number"
+    
+    return filters, None
+
+def parse_search_query(q: Optional[str]) -> Tuple[List[str], List[str]]:
+    """
+    Split a search string into whole-word terms and prefixes.
+    
+    A word ending in '*' is a prefix ("ub*" matches "uber"); other words are
+    matched through the text index, with stemming.
+    
+    Raises:
+        ValueError: If the query has no searchable terms
+    """
+    terms, prefixes = [], []
+    for word in (q or '').split():
+        tokens = ExpenseModel.tokenize(word)
+        if not tokens:
+            continue
+        if word.endswith('*'):
+            terms.extend(tokens[:-1])
+            prefixes.append(tokens[-1])
+        else:
+            terms.extend(tokens)
+    
+    if not terms and not prefixes:
+        raise ValueError("Search query must contain at least one word of two or more characters")
+    if len(terms) + len(prefixes) > MAX_SEARCH_TERMS:
+        raise ValueError(f"Search query is limited to {MAX_SEARCH_TERMS} words")
+    
+    return terms, prefixes
+
+def build_search_query(terms: List[str], prefixes: List[str]) -> Dict[str, Any]:
+    """
+    MongoDB filter for parsed search terms, to combine with build_expense_query.
+    
+    Prefixes are anchored regexes on search_tokens, which the multikey index
+    answers as a key range.
+    """
+    query = {}
+    if terms:
+        query['$text'] = {'$search': ' '.join(terms)}
+    if prefixes:
+        query['$and'] = [
+            {'search_tokens': {'$regex': f'^{re.escape(prefix)}'}} for prefix in prefixes
+        ]
+    return query
+
+def parse_page_args(
+    args,
+    default_per_page: int = 50,
+    max_per_page: int = 200
+) -> Tuple[int, int, Optional[str]]:
+    """
+    Read page and per_page query parameters.
+    
+    Returns:
+        (page, per_page, error_message)
+    """
+    try:
+        page = max(int(args.get('page', 1)), 1)
+        per_page = min(max(int(args.get('per_page', default_per_page)), 1), max_per_page)
+    except ValueError:
+        return 1, default_per_page, "page and per_page must be integers"
+    return page, per_page, None
@@ -2,8 +2,21 @@
 Expense data models and validation.
 """
 from datetime import datetime
-from bson import ObjectId
-from typing import Optional, Dict, Any
+from decimal import Decimal, InvalidOperation
+from bson import ObjectId, Decimal128
+from typing import Optional, Dict, Any, Iterable, List
+import re
+
+CURRENCY_SYMBOLS = {'₹': 'INR', '$': 'USD', '€': 'EUR'}
+
+# The extraction prompt asks for DD-MM-YYYY; the rest are seen in practice
+BILL_DATE_FORMATS = ('%d-%m-%Y', '%d/%m/%Y', '%d.%m.%Y', '%Y-%m-%d')
+
+# Search tokens back prefix matching on a multikey index; the text index
+# covers whole-word, stemmed matches
+SEARCH_TOKEN_PATTERN = re.compile(r'\w+')
+MIN_SEARCH_TOKEN_LENGTH = 2
+MAX_SEARCH_TOKENS = 500
 
 class ExpenseStatus:
     """Expense status constants."""
@@ -11,6 +24,19 @@ class ExpenseStatus:
     APPROVED = "approved"
     REJECTED = "rejected"
 
+EXPENSE_FIELDS = (
+    'user_id', 'image_path', 'extracted_data', 'status', 'hr_notes', 'version',
+    'amount_inr', 'currency', 'category', 'bill_date', 'duplicates', 'created_at', 'updated_at'
+)
+
+# Columns shown by the list views; the detail endpoint returns everything
+LIST_FIELDS = (
+    'user_id', 'status', 'hr_notes', 'version', 'amount_inr', 'currency', 'category',
+    'bill_date', 'duplicates', 'created_at', 'updated_at',
+    'extracted_data.Date', 'extracted_data.Details', 'extracted_data.Bill Type',
+    'extracted_data.Bill Amount', 'extracted_data.Bill Amount (INR)'
+)
+
 class ExpenseModel:
     """Expense model with validation."""
     
@@ -19,7 +45,8 @@ class ExpenseModel:
         user_id: str,
         image_path: str,
         extracted_data: Dict[str, Any],
-        status: str = ExpenseStatus.PENDING
+        status: str = ExpenseStatus.PENDING,
+        ocr_text: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Create expense document structure.
@@ -29,19 +56,190 @@ class ExpenseModel:
             image_path: Path to uploaded image
             extracted_data: Extracted bill data from OpenAI
             status: Expense status
+            ocr_text: Raw text read from the receipt, stored for search
             
         Returns:
             Expense document dictionary
         """
-        return {
+        expense = {
             'user_id': ObjectId(user_id),
             'image_path': image_path,
             'extracted_data': extracted_data,
             'status': status,
             'hr_notes': None,
+            'version': 1,
             'created_at': datetime.utcnow(),
             'updated_at': datetime.utcnow()
         }
+        expense.update(ExpenseModel.normalize_extracted_data(extracted_data))
+        if ocr_text:
+            expense['ocr_text'] = ocr_text
+        expense['search_tokens'] = ExpenseModel.search_tokens(
+            extracted_data, expense['category'], ocr_text
+        )
+        return expense
+    
+    @staticmethod
+    def tokenize(text: Any) -> List[str]:
+        """Lowercase word tokens of at least MIN_SEARCH_TOKEN_LENGTH characters."""
+        return [
+            token for token in SEARCH_TOKEN_PATTERN.findall(str(text or '').lower())
+            if len(token) >= MIN_SEARCH_TOKEN_LENGTH
+        ]
+    
+    @staticmethod
+    def search_tokens(
+        extracted_data: Dict[str, Any],
+        category: Optional[str],
+        ocr_text: Optional[str] = None
+    ) -> List[str]:
+        """
+        Distinct tokens from vendor details, category and OCR text.
+        
+        Vendor and category tokens come first so they survive the
+        MAX_SEARCH_TOKENS cap on long receipts.
+        """
+        tokens = {}
+        sources = (
+            extracted_data.get('Details'), extracted_data.get('Bill Type'), category, ocr_text
+        )
+        for source in sources:
+            for token in ExpenseModel.tokenize(source):
+                tokens.setdefault(token, None)
+        return list(tokens)[:MAX_SEARCH_TOKENS]
+    
+    @staticmethod
+    def status_update(status: str, notes: Optional[str] = None) -> list:
+        """
+        Build the update pipeline for a status transition.
+        
+        Records the outgoing status in previous_status and bumps version, so
+        the post-image alone tells callers which transition happened.
+        
+        Args:
+            status: New expense status
+            notes: HR notes; left unchanged if None
+            
+        Returns:
+            Aggregation pipeline usable with update_one/update_many
+        """
+        fields = {
+            'previous_status': '$status',
+            'status': {'$literal': status},
+            'updated_at': datetime.utcnow(),
+            'version': {'$add': [{'$ifNull': ['$version', 1]}, 1]}
+        }
+        
+        if notes is not None:
+            fields['hr_notes'] = {'$literal': notes.strip() if notes else None}
+        
+        return [{'$set': fields}]
+    
+    @staticmethod
+    def version_filter(version: int) -> Dict[str, Any]:
+        """Query clause matching an expected version; pre-versioning documents count as 1."""
+        if version == 1:
+            return {'$or': [{'version': 1}, {'version': {'$exists': False}}]}
+        return {'version': version}
+    
+    @staticmethod
+    def parse_amount(value: Any) -> Optional[Decimal]:
+        """
+        Parse an extracted amount such as "₹1,234.50" into a Decimal.
+        
+        Returns:
+            Amount rounded to two places, or None if it is not a number
+        """
+        if value is None or value == '':
+            return None
+        
+        amount_str = str(value)
+        for symbol in CURRENCY_SYMBOLS:
+            amount_str = amount_str.replace(symbol, '')
+        amount_str = amount_str.replace(',', '').strip()
+        
+        try:
+            amount = Decimal(amount_str)
+            if not amount.is_finite():
+                return None
+            # Raises InvalidOperation for amounts too large to keep cents
+            return amount.quantize(Decimal('0.01'))
+        except (InvalidOperation, ValueError):
+            return None
+    
+    @staticmethod
+    def parse_bill_date(value: Any) -> Optional[datetime]:
+        """
+        Parse the extracted bill date (normally "DD-MM-YYYY").
+        
+        Returns:
+            Bill date at midnight UTC, or None if it cannot be parsed
+        """
+        if not value:
+            return None
+        
+        date_str = str(value).strip()
+        for date_format in BILL_DATE_FORMATS:
+            try:
+                return datetime.strptime(date_str, date_format)
+            except ValueError:
+                continue
+        return None
+    
+    @staticmethod
+    def normalize_extracted_data(extracted_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Derive typed fields from the raw extracted bill data.
+        
+        Returns:
+            Dictionary with amount_inr, amount_original, currency, category,
+            bill_date and vendor_key (normalized vendor details for duplicate
+            matching)
+        """
+        raw_amount = extracted_data.get('Bill Amount') or extracted_data.get('total')
+        
+        currency = str(extracted_data.get('Currency Name') or '').strip().upper()
+        if not (len(currency) == 3 and currency.isalpha()):
+            raw_text = str(raw_amount or '')
+            currency = next(
+                (code for symbol, code in CURRENCY_SYMBOLS.items() if symbol in raw_text),
+                None
+            )
+        
+        amount_original = ExpenseModel.parse_amount(raw_amount)
+        amount_inr = ExpenseModel.parse_amount(extracted_data.get('Bill Amount (INR)'))
+        if amount_inr is None and currency in (None, 'INR'):
+            amount_inr = amount_original
+        
+        category = str(extracted_data.get('Bill Type') or '').strip().lower() or 'other'
+        
+        return {
+            'amount_inr': Decimal128(amount_inr) if amount_inr is not None else None,
+            'amount_original': Decimal128(amount_original) if amount_original is not None else None,
+            'currency': currency,
+            'category': category,
+            'bill_date': ExpenseModel.parse_bill_date(
+                extracted_data.get('Date') or extracted_data.get('date')
+            ),
+            'vendor_key': ' '.join(ExpenseModel.tokenize(extracted_data.get('Details'))) or None
+        }
+    
+    @staticmethod
+    def get_amount_inr(expense: Dict[str, Any]) -> Decimal:
+        """
+        Return the INR amount of an expense document.
+        
+        Falls back to parsing extracted_data for documents that have not been
+        backfilled with typed fields yet.
+        """
+        amount = expense.get('amount_inr')
+        if isinstance(amount, Decimal128):
+            return amount.to_decimal()
+        if 'amount_inr' not in expense:
+            normalized = ExpenseModel.normalize_extracted_data(expense.get('extracted_data') or {})
+            if normalized['amount_inr'] is not None:
+                return normalized['amount_inr'].to_decimal()
+        return Decimal('0.00')
     
     @staticmethod
     def validate_extracted_data(data: Dict[str, Any]) -> tuple[bool, Optional[str]]:
@@ -62,16 +260,9 @@ class ExpenseModel:
         
         # Validate amount is extractable (can be string with currency symbol)
         amount_fields = ['Bill Amount', 'Bill Amount (INR)', 'total']
-        amount_found = False
-        for field in amount_fields:
-            if field in data and data[field]:
-                amount_str = str(data[field]).replace('₹', '').replace('$', '').replace('€', '').replace(',', '').strip()
-                try:
-                    float(amount_str)
-                    amount_found = True
-                    break
-                except (ValueError, TypeError):
-                    continue
+        amount_found = any(
+            ExpenseModel.parse_amount(data.get(field)) is not None for field in amount_fields
+        )
         
         if not amount_found:
             return False, "Bill Amount must contain a valid number"
@@ -82,26 +273,159 @@ class ExpenseModel:
         return True, None
     
     @staticmethod
-    def format_expense_response(expense: Dict[str, Any]) -> Dict[str, Any]:
+    def decimal_to_float(value: Any) -> float:
+        """Convert a Decimal128 or numeric aggregation result to float."""
+        if isinstance(value, Decimal128):
+            return float(value.to_decimal())
+        return float(value or 0)
+    
+    @staticmethod
+    def parse_fields(fields_param: Optional[str]) -> tuple[Optional[tuple], Optional[str]]:
+        """
+        Parse a comma separated fields= parameter.
+        
+        Accepts top-level expense fields and extracted_data.<key> paths with
+        a single key (no further dots or "$"); "all" selects the full document.
+        
+        Returns:
+            (fields, error_message); fields is None for the full document
+        """
+        if not fields_param:
+            return LIST_FIELDS, None
+        if fields_param.strip() == 'all':
+            return None, None
+        
+        fields = tuple(field.strip() for field in fields_param.split(',') if field.strip())
+        for field in fields:
+            if field in EXPENSE_FIELDS:
+                continue
+            prefix, _, key = field.partition('.')
+            # Empty, nested or operator keys would make MongoDB reject the projection
+            if prefix != 'extracted_data' or not key or '.' in key or '$' in key:
+                return None, f"Unknown field: {field}"
+        return fields, None
+    
+    @staticmethod
+    def build_projection(fields: Optional[tuple]) -> Optional[Dict[str, int]]:
+        """MongoDB projection for the selected fields, or None for all."""
+        if fields is None:
+            return None
+        
+        # Ownership checks, email lookups and archive merging rely on these
+        projection = {'user_id': 1, 'created_at': 1, **{field: 1 for field in fields}}
+        # A parent path supersedes its sub-paths; Mongo rejects the overlap
+        if 'extracted_data' in projection:
+            projection = {
+                field: 1 for field in projection if not field.startswith('extracted_data.')
+            }
+        return projection
+    
+    @staticmethod
+    def _included_fields(fields: Optional[tuple]) -> set:
+        if fields is None:
+            return set(EXPENSE_FIELDS)
+        return {field.split('.', 1)[0] for field in fields}
+    
+    @staticmethod
+    def format_expense_list(
+        expenses: Iterable[Dict[str, Any]],
+        fields: Optional[tuple] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Format many expense documents for an API response.
+        
+        Produces the same JSON as format_expense_response, but leaves
+        ObjectId, Decimal128 and datetime values for the app's JSON provider
+        to encode, and resolves the field selection once per list.
+        
+        Args:
+            expenses: MongoDB expense documents
+            fields: Fields to include; all fields if None
+            
+        Returns:
+            List of formatted expense dictionaries
+        """
+        included = ExpenseModel._included_fields(fields)
+        formatted_separately = ('extracted_data', 'version', 'amount_inr', 'duplicates')
+        plain_fields = [
+            field for field in EXPENSE_FIELDS
+            if field in included and field not in formatted_separately
+        ]
+        with_extracted = 'extracted_data' in included
+        with_version = 'version' in included
+        with_amount = 'amount_inr' in included
+        with_duplicates = 'duplicates' in included
+        get_amount_inr = ExpenseModel.get_amount_inr
+        
+        formatted = []
+        append = formatted.append
+        for expense in expenses:
+            get = expense.get
+            row = {'expense_id': expense['_id']}
+            for field in plain_fields:
+                row[field] = get(field)
+            if with_extracted:
+                row['extracted_data'] = get('extracted_data', {})
+            if with_version:
+                row['version'] = get('version', 1)
+            if with_amount:
+                amount = get('amount_inr')
+                row['amount_inr'] = amount if amount is not None else get_amount_inr(expense)
+            if with_duplicates:
+                row['duplicates'] = get('duplicates') or []
+            if 'user_email' in expense:
+                row['user_email'] = expense['user_email']
+            append(row)
+        
+        return formatted
+    
+    @staticmethod
+    def format_expense_response(
+        expense: Dict[str, Any],
+        fields: Optional[tuple] = None
+    ) -> Dict[str, Any]:
         """
         Format expense document for API response.
         
         Args:
             expense: MongoDB expense document
+            fields: Fields to include; all fields if None
             
         Returns:
             Formatted expense dictionary
         """
-        formatted = {
-            'expense_id': str(expense['_id']),
-            'user_id': str(expense['user_id']),
-            'image_path': expense['image_path'],
-            'extracted_data': expense['extracted_data'],
-            'status': expense['status'],
-            'hr_notes': expense.get('hr_notes'),
-            'created_at': expense['created_at'].isoformat() if isinstance(expense['created_at'], datetime) else expense['created_at'],
-            'updated_at': expense['updated_at'].isoformat() if isinstance(expense['updated_at'], datetime) else expense['updated_at']
-        }
+        included = ExpenseModel._included_fields(fields)
+        
+        formatted = {'expense_id': str(expense['_id'])}
+        
+        if 'user_id' in included:
+            formatted['user_id'] = str(expense['user_id'])
+        if 'image_path' in included:
+            formatted['image_path'] = expense.get('image_path')
+        if 'extracted_data' in included:
+            formatted['extracted_data'] = expense.get('extracted_data', {})
+        if 'status' in included:
+            formatted['status'] = expense.get('status')
+        if 'hr_notes' in included:
+            formatted['hr_notes'] = expense.get('hr_notes')
+        if 'version' in included:
+            formatted['version'] = expense.get('version', 1)
+        if 'amount_inr' in included:
+            formatted['amount_inr'] = float(ExpenseModel.get_amount_inr(expense))
+        if 'currency' in included:
+            formatted['currency'] = expense.get('currency')
+        if 'category' in included:
+            formatted['category'] = expense.get('category')
+        if 'duplicates' in included:
+            formatted['duplicates'] = [
+                {**duplicate, 'expense_id': str(duplicate['expense_id'])}
+                for duplicate in expense.get('duplicates') or []
+            ]
+        
+        for field in ('bill_date', 'created_at', 'updated_at'):
+            if field in included:
+                value = expense.get(field)
+                formatted[field] = value.isoformat() if isinstance(value, datetime) else value
         
         if 'user_email' in expense:
             formatted['user_email'] = expense['user_email']
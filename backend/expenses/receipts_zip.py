@@ -0,0 +1,221 @@
+"""
+ZIP archives of receipt files, streamed to the client while they are built.
+
+Entries are written to a write-only sink that the response generator drains
+after every chunk, so no temporary file is used and memory holds one storage
+chunk plus the CSV manifest. Receipts are stored uncompressed (images and
+PDFs are already compressed); zipfile writes a data descriptor after each
+entry because the output is not seekable.
+"""
+from extensions.mongodb import mongodb
+from expenses.models import ExpenseModel
+from storage.file_manager import FileManager
+from storage.backends import get_storage, STREAM_CHUNK_SIZE
+from datetime import datetime
+from typing import Iterable, Iterator, Dict, Any, Optional
+import zipfile
+import gzip
+import csv
+import io
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+RECEIPTS_ZIP_PROJECTION = {
+    'user_id': 1,
+    'image_path': 1,
+    'status': 1,
+    'hr_notes': 1,
+    'amount_inr': 1,
+    'bill_date': 1,
+    'created_at': 1,
+    'extracted_data.Date': 1,
+    'extracted_data.Details': 1,
+    'extracted_data.Bill Type': 1,
+    'extracted_data.Bill Amount (INR)': 1,
+    'extracted_data.total': 1
+}
+
+MANIFEST_NAME = 'manifest.csv'
+MANIFEST_FIELDS = [
+    'File', 'Expense ID', 'User Email', 'Date', 'Vendor',
+    'Bill Type', 'Amount (INR)', 'Status', 'HR Notes', 'Note'
+]
+# Expenses whose user emails are looked up together
+EMAIL_BATCH_SIZE = 100
+# Earliest timestamp a ZIP entry can carry
+ZIP_EPOCH = datetime(1980, 1, 1)
+
+def _slug(value: Any, max_length: int = 40) -> str:
+    return re.sub(r'[^A-Za-z0-9.]+', '-', str(value or '')).strip('-.')[:max_length].rstrip('-.')
+
+class _ZipSink:
+    """Write-only file object collecting zipfile output until it is drained."""
+    
+    def __init__(self):
+        self._chunks = []
+    
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self) -> None:
+        pass
+    
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+class ReceiptZipExporter:
+    @staticmethod
+    def _bill_date(expense: Dict[str, Any]) -> Optional[datetime]:
+        if 'bill_date' in expense:
+            return expense['bill_date']
+        normalized = ExpenseModel.normalize_extracted_data(expense.get('extracted_data') or {})
+        return normalized['bill_date']
+    
+    @staticmethod
+    def entry_name(expense: Dict[str, Any], extension: str) -> str:
+        """<date>_<vendor>_<amount>.<ext>, e.g. 2024-07-15_Uber-India_1250.00.jpg"""
+        extracted = expense.get('extracted_data') or {}
+        bill_date = ReceiptZipExporter._bill_date(expense)
+        if bill_date:
+            date_part = bill_date.strftime('%Y-%m-%d')
+        else:
+            date_part = _slug(extracted.get('Date'), 20) or 'undated'
+        vendor = _slug(extracted.get('Details')) or 'unknown'
+        amount = ExpenseModel.get_amount_inr(expense)
+        return f"{date_part}_{vendor}_{amount:.2f}.{extension}"
+    
+    @staticmethod
+    def _open_receipt(image_path: str):
+        """(size or None, chunk iterator) for a receipt, or None if the file is missing."""
+        key = FileManager.storage_key(image_path)
+        compressed = bool(image_path) and image_path.endswith('.gz')
+        if key is not None and not compressed:
+            storage = get_storage()
+            size = storage.size(key)
+            return None if size is None else (size, storage.stream(key, STREAM_CHUNK_SIZE))
+        
+        # Compressed archived receipts are only written on local storage, and
+        # paths outside UPLOAD_FOLDER are plain local files
+        if not image_path or not os.path.exists(image_path):
+            return None
+        if image_path.endswith('.gz'):
+            source = gzip.open(image_path, 'rb')
+            size = None
+        else:
+            source = open(image_path, 'rb')
+            size = os.path.getsize(image_path)
+        
+        def chunks():
+            with source:
+                yield from iter(lambda: source.read(STREAM_CHUNK_SIZE), b'')
+        return size, chunks()
+    
+    @staticmethod
+    def _lookup_emails(expenses: list, user_emails: Dict[Any, str]) -> None:
+        missing = {exp['user_id'] for exp in expenses} - user_emails.keys()
+        if not missing:
+            return
+        users = mongodb.get_collection('users').find({'_id': {'$in': list(missing)}}, {'email': 1})
+        for user in users:
+            user_emails[user['_id']] = user['email']
+    
+    @staticmethod
+    def _batches(expenses: Iterable[Dict[str, Any]]) -> Iterator[list]:
+        batch = []
+        for expense in expenses:
+            batch.append(expense)
+            if len(batch) >= EMAIL_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
+    @staticmethod
+    def stream(expenses: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+        """
+        Yield a ZIP archive with one entry per receipt and a manifest.csv.
+        
+        Entry names are made unique with a numeric suffix. Expenses whose
+        file is missing are listed in the manifest without an entry.
+        """
+        sink = _ZipSink()
+        archive = zipfile.ZipFile(sink, 'w', allowZip64=True)
+        manifest = io.StringIO()
+        writer = csv.DictWriter(manifest, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        user_emails = {}
+        used_names = set()
+        count = 0
+        
+        for batch in ReceiptZipExporter._batches(expenses):
+            ReceiptZipExporter._lookup_emails(batch, user_emails)
+            
+            for expense in batch:
+                extracted = expense.get('extracted_data') or {}
+                image_path = expense.get('image_path') or ''
+                bill_date = ReceiptZipExporter._bill_date(expense)
+                row = {
+                    'File': '',
+                    'Expense ID': str(expense['_id']),
+                    'User Email': user_emails.get(expense['user_id'], 'Unknown'),
+                    'Date': (
+                        bill_date.strftime('%Y-%m-%d') if bill_date else extracted.get('Date', '')
+                    ),
+                    'Vendor': extracted.get('Details', ''),
+                    'Bill Type': extracted.get('Bill Type', ''),
+                    'Amount (INR)': ExpenseModel.get_amount_inr(expense),
+                    'Status': expense.get('status', ''),
+                    'HR Notes': expense.get('hr_notes') or '',
+                    'Note': ''
+                }
+                
+                receipt = ReceiptZipExporter._open_receipt(image_path)
+                if receipt is None:
+                    row['Note'] = 'file missing'
+                    writer.writerow(row)
+                    continue
+                size, chunks = receipt
+                
+                basename = os.path.basename(image_path)
+                if basename.endswith('.gz'):
+                    basename = basename[:-len('.gz')]
+                extension = basename.rsplit('.', 1)[1].lower() if '.' in basename else 'bin'
+                name = ReceiptZipExporter.entry_name(expense, extension)
+                stem, copy = name[:-len(extension) - 1], 2
+                while name in used_names:
+                    name = f"{stem}_{copy}.{extension}"
+                    copy += 1
+                used_names.add(name)
+                
+                modified = max(expense.get('created_at') or ZIP_EPOCH, ZIP_EPOCH)
+                info = zipfile.ZipInfo(name, modified.timetuple()[:6])
+                info.compress_type = zipfile.ZIP_STORED
+                info.file_size = size or 0
+                try:
+                    with archive.open(info, 'w') as entry:
+                        for chunk in chunks:
+                            entry.write(chunk)
+                            yield sink.drain()
+                except Exception as e:
+                    # The entry is closed with what was written so far
+                    logger.error(f"Error adding {image_path} to receipts ZIP: {str(e)}")
+                    row['Note'] = 'read error; file incomplete'
+                
+                row['File'] = name
+                writer.writerow(row)
+                count += 1
+                yield sink.drain()
+        
+        info = zipfile.ZipInfo(MANIFEST_NAME, datetime.utcnow().timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        archive.writestr(info, manifest.getvalue())
+        archive.close()
+        yield sink.drain()
+        
+        logger.info(f"Streamed receipts ZIP with {count} file(s)")
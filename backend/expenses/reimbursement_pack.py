@@ -0,0 +1,277 @@
+"""
+Reimbursement pack PDFs: a summary table followed by one page per receipt.
+
+Pages are written as the expense cursor is read: receipt pages immediately,
+summary pages whenever one is full. The page tree, written last, puts the
+summary pages first. Receipt photos are downscaled and re-encoded as JPEG,
+which PDF embeds without further decoding (DCTDecode).
+"""
+from expenses.models import ExpenseModel
+from expenses.receipts_zip import ReceiptZipExporter
+from storage.file_manager import FileManager
+from utils.pdf import PdfStreamWriter, pdf_string, fit_text, A4_WIDTH, A4_HEIGHT
+from flask import current_app
+from decimal import Decimal
+from datetime import datetime
+from typing import Iterable, Iterator, Dict, Any, Optional, Tuple
+import gzip
+import io
+import logging
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+PACK_PROJECTION = {
+    'user_id': 1,
+    'image_path': 1,
+    'status': 1,
+    'amount_inr': 1,
+    'bill_date': 1,
+    'category': 1,
+    'created_at': 1,
+    'extracted_data.Date': 1,
+    'extracted_data.Details': 1,
+    'extracted_data.Bill Type': 1,
+    'extracted_data.Bill Amount (INR)': 1,
+    'extracted_data.total': 1
+}
+
+EMBEDDABLE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+MARGIN = 40
+FONT_SIZE = 9
+ROW_HEIGHT = 14
+# (header, width in points); the last column is right-aligned
+SUMMARY_COLUMNS = [
+    ('Date', 60), ('Employee', 125), ('Vendor', 150),
+    ('Category', 70), ('Status', 50), ('Amount (INR)', 60)
+]
+SUMMARY_TOP = A4_HEIGHT - MARGIN - 60
+ROWS_PER_PAGE = int((SUMMARY_TOP - MARGIN - 2 * ROW_HEIGHT) / ROW_HEIGHT)
+# Space above a receipt image for its caption
+CAPTION_HEIGHT = 40
+
+def _text(x: float, y: float, text, font: str = 'F1', size: float = FONT_SIZE) -> str:
+    return f"BT /{font} {size} Tf {x:.1f} {y:.1f} Td {pdf_string(text)} Tj ET\n"
+
+def _right_text(x_right: float, y: float, text, font: str = 'F1', size: float = FONT_SIZE) -> str:
+    # Helvetica digits are 0.556 em wide, which amounts mostly consist of
+    return _text(x_right - len(str(text)) * size * 0.556, y, text, font, size)
+
+def _line(y: float) -> str:
+    return f"0.5 w {MARGIN} {y:.1f} m {A4_WIDTH - MARGIN} {y:.1f} l S\n"
+
+class ReimbursementPack:
+    @staticmethod
+    def _receipt_image(image_path: str) -> Tuple[Optional[tuple], Optional[str]]:
+        """((jpeg bytes, width, height, grayscale), None) or (None, reason it is not embedded)."""
+        if not image_path or not FileManager.file_exists(image_path):
+            return None, 'Receipt file is missing.'
+        name = image_path[:-len('.gz')] if image_path.endswith('.gz') else image_path
+        if not name.lower().endswith(EMBEDDABLE_EXTENSIONS):
+            return None, (
+                'Receipt is a PDF document and is not embedded; download it with the receipts ZIP.'
+            )
+        if Image is None:
+            return None, 'Receipt images cannot be embedded (Pillow is not installed).'
+        
+        max_edge = current_app.config.get('PACK_IMAGE_MAX_EDGE', 1600)
+        try:
+            if image_path.endswith('.gz'):
+                source = gzip.open(image_path, 'rb')
+            else:
+                source = FileManager.open_file(image_path)
+            with source, Image.open(source) as image:
+                image.draft('RGB', (max_edge, max_edge))
+                image = ImageOps.exif_transpose(image)
+                grayscale = image.mode in ('1', 'L', 'LA', 'I', 'I;16')
+                if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+                    rgba = image.convert('RGBA')
+                    image = Image.new('RGB', rgba.size, (255, 255, 255))
+                    image.paste(rgba, mask=rgba.getchannel('A'))
+                    grayscale = False
+                image = image.convert('L' if grayscale else 'RGB')
+                image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+                
+                output = io.BytesIO()
+                quality = current_app.config.get('PACK_IMAGE_QUALITY', 70)
+                image.save(output, 'JPEG', quality=quality, optimize=True)
+                return (output.getvalue(), image.width, image.height, grayscale), None
+        except Exception as e:
+            logger.warning(f"Could not embed {image_path} in reimbursement pack: {str(e)}")
+            return None, 'Receipt image could not be read.'
+    
+    @staticmethod
+    def _summary_row(expense: Dict[str, Any], email: str) -> tuple:
+        extracted = expense.get('extracted_data') or {}
+        bill_date = ReceiptZipExporter._bill_date(expense)
+        return (
+            bill_date.strftime('%Y-%m-%d') if bill_date else extracted.get('Date', ''),
+            email,
+            extracted.get('Details', ''),
+            expense.get('category') or extracted.get('Bill Type', ''),
+            expense.get('status', ''),
+            f"{ExpenseModel.get_amount_inr(expense):,.2f}"
+        )
+    
+    @staticmethod
+    def _summary_page(
+        rows: list,
+        title: str,
+        subtitle: str,
+        page_number: int,
+        totals: Optional[tuple] = None
+    ) -> str:
+        content = [_text(MARGIN, A4_HEIGHT - MARGIN - 14, title, 'F2', 14)]
+        content.append(_text(MARGIN, A4_HEIGHT - MARGIN - 30, subtitle, 'F1', 8))
+        content.append(_right_text(
+            A4_WIDTH - MARGIN, A4_HEIGHT - MARGIN - 30, f"Summary {page_number}", 'F1', 8
+        ))
+        
+        y = SUMMARY_TOP
+        x = MARGIN
+        for index, (header, width) in enumerate(SUMMARY_COLUMNS):
+            if index == len(SUMMARY_COLUMNS) - 1:
+                content.append(_right_text(x + width, y, header, 'F2'))
+            else:
+                content.append(_text(x, y, header, 'F2'))
+            x += width
+        content.append(_line(y - 4))
+        
+        for row in rows:
+            y -= ROW_HEIGHT
+            x = MARGIN
+            for index, (value, (_, width)) in enumerate(zip(row, SUMMARY_COLUMNS)):
+                if index == len(SUMMARY_COLUMNS) - 1:
+                    content.append(_right_text(x + width, y, value))
+                else:
+                    content.append(_text(x, y, fit_text(value, FONT_SIZE, width - 6)))
+                x += width
+        
+        if totals:
+            count, total = totals
+            content.append(_line(y - 6))
+            y -= ROW_HEIGHT + 4
+            content.append(_text(MARGIN, y, f"{count} expense(s)", 'F2'))
+            content.append(_right_text(A4_WIDTH - MARGIN, y, f"Total INR {total:,.2f}", 'F2'))
+        return ''.join(content)
+    
+    @staticmethod
+    def _receipt_page(writer: PdfStreamWriter, expense: Dict[str, Any], row: tuple) -> int:
+        date, email, vendor, category, status, amount = row
+        content = [
+            _text(
+                MARGIN, A4_HEIGHT - MARGIN - 12,
+                fit_text(f"{date}  {vendor}", 12, A4_WIDTH - 2 * MARGIN), 'F2', 12
+            ),
+            _text(
+                MARGIN, A4_HEIGHT - MARGIN - 26,
+                f"{email} | {category} | {status} | INR {amount} | Expense {expense['_id']}",
+                'F1', 8
+            )
+        ]
+        
+        image, note = ReimbursementPack._receipt_image(expense.get('image_path'))
+        if image is None:
+            content.append(_text(MARGIN, A4_HEIGHT - MARGIN - CAPTION_HEIGHT - 20, note, 'F1', 10))
+            return writer.add_page(''.join(content))
+        
+        data, width, height, grayscale = image
+        image_id = writer.add_jpeg(data, width, height, grayscale)
+        # Fit inside the area below the caption, keeping the aspect ratio;
+        # small images are not enlarged beyond one point per pixel
+        box_width = A4_WIDTH - 2 * MARGIN
+        box_height = A4_HEIGHT - 2 * MARGIN - CAPTION_HEIGHT
+        scale = min(box_width / width, box_height / height, 1.0)
+        draw_width, draw_height = width * scale, height * scale
+        x = MARGIN + (box_width - draw_width) / 2
+        y = A4_HEIGHT - MARGIN - CAPTION_HEIGHT - draw_height
+        content.append(f"q {draw_width:.2f} 0 0 {draw_height:.2f} {x:.2f} {y:.2f} cm /Im1 Do Q\n")
+        return writer.add_page(''.join(content), {'Im1': image_id})
+    
+    @staticmethod
+    def generate(
+        expenses: Iterable[Dict[str, Any]],
+        title: str,
+        subtitle: str = '',
+        stats: Optional[Dict[str, int]] = None
+    ) -> Iterator[bytes]:
+        """
+        Yield the PDF for expenses, a page at a time.
+        
+        Memory holds one receipt image and one summary page of rows; the
+        rest of the document is only referenced by object offsets. When
+        given, stats receives the expense_count once the PDF is complete.
+        """
+        writer = PdfStreamWriter()
+        summary_ids = []
+        receipt_ids = []
+        rows = []
+        user_emails = {}
+        count = 0
+        total = Decimal('0')
+        
+        for batch in ReceiptZipExporter._batches(expenses):
+            ReceiptZipExporter._lookup_emails(batch, user_emails)
+            
+            for expense in batch:
+                email = user_emails.get(expense['user_id'], 'Unknown')
+                row = ReimbursementPack._summary_row(expense, email)
+                count += 1
+                total += ExpenseModel.get_amount_inr(expense)
+                
+                receipt_ids.append(ReimbursementPack._receipt_page(writer, expense, row))
+                
+                rows.append(row)
+                if len(rows) == ROWS_PER_PAGE:
+                    summary_ids.append(writer.add_page(
+                        ReimbursementPack._summary_page(rows, title, subtitle, len(summary_ids) + 1)
+                    ))
+                    rows = []
+                yield writer.drain()
+        
+        # The totals go on the last summary page, which may have to be a new one
+        summary_ids.append(writer.add_page(
+            ReimbursementPack._summary_page(
+                rows, title, subtitle, len(summary_ids) + 1, (count, total)
+            )
+        ))
+        writer.page_ids = summary_ids + receipt_ids
+        writer.close(title)
+        if stats is not None:
+            stats['expense_count'] = count
+        yield writer.drain()
+        
+        logger.info(f"Generated reimbursement pack with {count} expense(s)")
+    
+    @staticmethod
+    def describe_filters(filter_args: Dict[str, str]) -> str:
+        """One-line description of the filters a pack was generated with."""
+        described = ', '.join(
+            f"{key}={value}" for key, value in filter_args.items() if value
+        ) or 'all expenses'
+        return f"Filters: {described}. Generated {datetime.utcnow().strftime('%Y-%m-%d %H:%M')} UTC"
+    
+    @staticmethod
+    def write_to(
+        output,
+        expenses: Iterable[Dict[str, Any]],
+        title: str,
+        subtitle: str = ''
+    ) -> Tuple[int, int]:
+        """
+        Write the PDF to a binary file object.
+        
+        Returns:
+            (size in bytes, number of expenses in the pack)
+        """
+        size = 0
+        stats = {}
+        for chunk in ReimbursementPack.generate(expenses, title, subtitle, stats):
+            output.write(chunk)
+            size += len(chunk)
+        return size, stats['expense_count']
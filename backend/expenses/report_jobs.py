@@ -0,0 +1,222 @@
+"""
+Background report jobs.
+
+Requests too large to generate within an HTTP request are queued in
+report_jobs and picked up by `flask --app app jobs run-report-jobs`. The
+finished file is written to the storage backend under .reports/, which the
+storage reconciler ignores, and removed again after REPORT_RETENTION_HOURS.
+"""
+from extensions.mongodb import mongodb
+from expenses.filters import parse_filter_args, build_expense_query
+from expenses.archive import ArchiveService, ARCHIVE_COLLECTION
+from expenses.reimbursement_pack import ReimbursementPack, PACK_PROJECTION
+from storage.file_manager import FileManager
+from storage.backends import get_storage
+from utils.responses import success_response, error_response
+from flask import current_app
+from pymongo import ReturnDocument
+from bson import ObjectId
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+REPORT_JOBS_COLLECTION = 'report_jobs'
+REPORTS_PREFIX = '.reports/'
+PACK_TITLE = 'Reimbursement pack'
+
+class ReportJobService:
+    @staticmethod
+    def count_expenses(filters: Dict[str, Any], limit: Optional[int] = None) -> int:
+        """Expenses matching filters, live and archived; stops counting at limit if given."""
+        query = build_expense_query(**filters)
+        # count_documents sends limit as a $limit stage, which must be positive
+        options = {'limit': limit} if limit else {}
+        count = mongodb.get_collection('expenses').count_documents(query, **options)
+        if ArchiveService.needs_archive(filters) and not (limit and count >= limit):
+            options = {'limit': limit - count} if limit else {}
+            count += mongodb.get_collection(ARCHIVE_COLLECTION).count_documents(query, **options)
+        return count
+    
+    @staticmethod
+    def pack_expenses(filters: Dict[str, Any]):
+        return ArchiveService.find_expenses(
+            build_expense_query(**filters), filters, PACK_PROJECTION
+        )
+    
+    @staticmethod
+    def _format_job(job: Dict[str, Any]) -> Dict[str, Any]:
+        formatted = {
+            'job_id': str(job['_id']),
+            'type': job['type'],
+            'status': job['status'],
+            'filters': job['filters'],
+            'created_at': job['created_at'].isoformat(),
+            'finished_at': job['finished_at'].isoformat() if job.get('finished_at') else None,
+            'expense_count': job.get('expense_count'),
+            'size': job.get('size'),
+            'error': job.get('error')
+        }
+        if job['status'] == 'done':
+            formatted['download_url'] = f"/hr/report-jobs/{job['_id']}/download"
+        return formatted
+    
+    @staticmethod
+    def create_pack_job(filter_args: Dict[str, str], user_id: str) -> tuple:
+        """Queue a reimbursement pack; filter_args are the raw query parameters."""
+        try:
+            job = {
+                '_id': ObjectId(),
+                'type': 'reimbursement_pack',
+                'status': 'queued',
+                'filters': filter_args,
+                'requested_by': user_id,
+                'created_at': datetime.utcnow()
+            }
+            mongodb.get_collection(REPORT_JOBS_COLLECTION).insert_one(job)
+            
+            logger.info(f"Queued reimbursement pack {job['_id']} for {user_id}: {filter_args}")
+            return success_response(
+                "Reimbursement pack queued; poll the job for its download link",
+                ReportJobService._format_job(job),
+                202
+            )
+        
+        except Exception as e:
+            logger.error(f"Error queueing reimbursement pack: {str(e)}")
+            return error_response("Failed to queue reimbursement pack", 500)
+    
+    @staticmethod
+    def get_job(job_id: str) -> tuple:
+        if not ObjectId.is_valid(job_id):
+            return error_response("Report job not found", 404)
+        job = mongodb.get_collection(REPORT_JOBS_COLLECTION).find_one({'_id': ObjectId(job_id)})
+        if not job:
+            return error_response("Report job not found", 404)
+        return success_response("Report job retrieved", ReportJobService._format_job(job))
+    
+    @staticmethod
+    def download(job_id: str):
+        if not ObjectId.is_valid(job_id):
+            return error_response("Report job not found", 404)
+        job = mongodb.get_collection(REPORT_JOBS_COLLECTION).find_one({'_id': ObjectId(job_id)})
+        if not job:
+            return error_response("Report job not found", 404)
+        if job['status'] != 'done':
+            return error_response(f"Report is not ready (status: {job['status']})", 409)
+        
+        upload_folder = current_app.config.get('UPLOAD_FOLDER', 'uploads/expenses')
+        return FileManager.send_stored_file(
+            os.path.join(upload_folder, job['file_key']),
+            as_attachment=True,
+            download_name=f"reimbursement_pack_{job['created_at'].strftime('%Y%m%d')}.pdf"
+        )
+    
+    @staticmethod
+    def _claim() -> Optional[Dict[str, Any]]:
+        """Oldest queued job, or a running one older than REPORT_JOB_TIMEOUT_MINUTES."""
+        now = datetime.utcnow()
+        timeout = timedelta(minutes=current_app.config.get('REPORT_JOB_TIMEOUT_MINUTES', 60))
+        return mongodb.get_collection(REPORT_JOBS_COLLECTION).find_one_and_update(
+            {'$or': [
+                {'status': 'queued'},
+                {'status': 'running', 'started_at': {'$lt': now - timeout}}
+            ]},
+            {'$set': {'status': 'running', 'started_at': now}},
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    @staticmethod
+    def _expires_at(finished_at: datetime) -> datetime:
+        return finished_at + timedelta(hours=current_app.config.get('REPORT_RETENTION_HOURS', 72))
+    
+    @staticmethod
+    def _fail(job: Dict[str, Any], error: str) -> None:
+        now = datetime.utcnow()
+        mongodb.get_collection(REPORT_JOBS_COLLECTION).update_one(
+            {'_id': job['_id']},
+            {'$set': {
+                'status': 'failed',
+                'error': error,
+                'finished_at': now,
+                'expires_at': ReportJobService._expires_at(now)
+            }}
+        )
+    
+    @staticmethod
+    def _run(job: Dict[str, Any]) -> None:
+        collection = mongodb.get_collection(REPORT_JOBS_COLLECTION)
+        filters, error_msg = parse_filter_args(job['filters'])
+        if error_msg:
+            ReportJobService._fail(job, error_msg)
+            return
+        
+        key = f"{REPORTS_PREFIX}{job['_id']}.pdf"
+        with FileManager._temp_file() as temp:
+            temp_path = temp.name
+            try:
+                size, expense_count = ReimbursementPack.write_to(
+                    temp,
+                    ReportJobService.pack_expenses(filters),
+                    PACK_TITLE,
+                    ReimbursementPack.describe_filters(job['filters'])
+                )
+            except Exception:
+                temp.close()
+                os.remove(temp_path)
+                raise
+        # Consumes temp_path
+        get_storage().put_file(key, temp_path, 'application/pdf')
+        
+        now = datetime.utcnow()
+        collection.update_one(
+            {'_id': job['_id']},
+            {'$set': {
+                'status': 'done',
+                'file_key': key,
+                'size': size,
+                'expense_count': expense_count,
+                'finished_at': now,
+                'expires_at': ReportJobService._expires_at(now)
+            }}
+        )
+    
+    @staticmethod
+    def run_pending() -> int:
+        """
+        Run queued jobs one after another until none are left.
+        
+        Returns:
+            Number of jobs run, including failed ones
+        """
+        ran = 0
+        while True:
+            job = ReportJobService._claim()
+            if job is None:
+                break
+            ran += 1
+            try:
+                ReportJobService._run(job)
+                logger.info(f"Report job {job['_id']} finished")
+            except Exception as e:
+                logger.error(f"Report job {job['_id']} failed: {str(e)}", exc_info=True)
+                ReportJobService._fail(job, str(e)[:500])
+        return ran
+    
+    @staticmethod
+    def purge_expired() -> int:
+        """Delete finished reports past their expiry, with their job records."""
+        collection = mongodb.get_collection(REPORT_JOBS_COLLECTION)
+        storage = get_storage()
+        purged = 0
+        for job in collection.find({'expires_at': {'$lt': datetime.utcnow()}}, {'file_key': 1}):
+            if job.get('file_key'):
+                storage.delete(job['file_key'])
+            collection.delete_one({'_id': job['_id']})
+            purged += 1
+        if purged:
+            logger.info(f"Purged {purged} expired report(s)")
+        return purged
@@ -0,0 +1,232 @@
+"""
+Monthly expense rollups maintained by dirty-bucket refresh.
+"""
+from extensions.mongodb import mongodb
+from expenses.models import ExpenseModel
+from expenses.archive import ARCHIVE_COLLECTION
+from datetime import datetime
+from typing import Optional, Dict, Any, Iterable, List
+from pymongo import UpdateOne
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+MONTH_PATTERN = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
+
+ROLLUP_DIMENSIONS = {
+    'user': '$user_id',
+    'department': '$department',
+    'category': '$category',
+    'status': '$status'
+}
+
+class RollupService:
+    @staticmethod
+    def month_key(value: datetime) -> str:
+        return value.strftime('%Y-%m')
+    
+    @staticmethod
+    def month_bounds(month: str) -> tuple[datetime, datetime]:
+        start = datetime.strptime(month, '%Y-%m')
+        if start.month == 12:
+            end = start.replace(year=start.year + 1, month=1)
+        else:
+            end = start.replace(month=start.month + 1)
+        return start, end
+    
+    @staticmethod
+    def expense_month(expense: Dict[str, Any]) -> Optional[str]:
+        """Month an expense is reported in: its bill date, else its upload date."""
+        reported_at = expense.get('bill_date') or expense.get('created_at')
+        return RollupService.month_key(reported_at) if reported_at else None
+    
+    @staticmethod
+    def mark_dirty(expenses: Iterable[Dict[str, Any]]) -> None:
+        """
+        Flag the months touched by these expenses for re-aggregation.
+        
+        Failures are logged only; a full refresh repairs missed marks.
+        """
+        months = {RollupService.expense_month(expense) for expense in expenses}
+        months.discard(None)
+        RollupService.mark_months_dirty(months)
+    
+    @staticmethod
+    def mark_months_dirty(months: Iterable[str]) -> None:
+        months = set(months)
+        if not months:
+            return
+        
+        now = datetime.utcnow()
+        try:
+            mongodb.get_collection('rollup_dirty').bulk_write(
+                [
+                    UpdateOne({'_id': month}, {'$set': {'dirty_at': now}}, upsert=True)
+                    for month in months
+                ],
+                ordered=False
+            )
+        except Exception as e:
+            logger.error(f"Error marking rollup months dirty: {str(e)}")
+    
+    @staticmethod
+    def mark_all_dirty() -> int:
+        """Flag every month that has expenses, for a full rebuild."""
+        month_expr = {'$dateToString': {
+            'format': '%Y-%m',
+            'date': {'$ifNull': ['$bill_date', '$created_at']}
+        }}
+        pipeline = [
+            {'$project': {'_id': 0, 'month': month_expr}},
+            {'$unionWith': {
+                'coll': ARCHIVE_COLLECTION,
+                'pipeline': [{'$project': {'_id': 0, 'month': month_expr}}]
+            }},
+            {'$group': {'_id': '$month'}}
+        ]
+        rows = mongodb.get_collection('expenses').aggregate(pipeline)
+        months = [row['_id'] for row in rows if row['_id']]
+        RollupService.mark_months_dirty(months)
+        return len(months)
+    
+    @staticmethod
+    def refresh_month(month: str) -> None:
+        """Re-aggregate one month into monthly_rollups with $merge."""
+        start, end = RollupService.month_bounds(month)
+        refreshed_at = datetime.utcnow()
+        
+        in_month = {'$gte': start, '$lt': end}
+        match = {'$or': [
+            {'bill_date': in_month},
+            {'bill_date': None, 'created_at': in_month}
+        ]}
+        
+        pipeline = [
+            {'$match': match},
+            {'$unionWith': {'coll': ARCHIVE_COLLECTION, 'pipeline': [{'$match': match}]}},
+            {'$group': {
+                '_id': {'user_id': '$user_id', 'category': '$category', 'status': '$status'},
+                'count': {'$sum': 1},
+                'total_amount': {'$sum': '$amount_inr'}
+            }},
+            {'$lookup': {
+                'from': 'users',
+                'localField': '_id.user_id',
+                'foreignField': '_id',
+                'as': 'user'
+            }},
+            {'$project': {
+                '_id': {
+                    'month': month,
+                    'user_id': '$_id.user_id',
+                    'category': '$_id.category',
+                    'status': '$_id.status'
+                },
+                'month': month,
+                'user_id': '$_id.user_id',
+                'category': '$_id.category',
+                'status': '$_id.status',
+                'department': {
+                    '$ifNull': [{'$arrayElemAt': ['$user.department', 0]}, 'unassigned']
+                },
+                'count': 1,
+                'total_amount': 1,
+                'refreshed_at': refreshed_at
+            }},
+            {'$merge': {
+                'into': 'monthly_rollups',
+                'whenMatched': 'replace',
+                'whenNotMatched': 'insert'
+            }}
+        ]
+        mongodb.get_collection('expenses').aggregate(pipeline)
+        
+        # Buckets that no longer have any expenses
+        mongodb.get_collection('monthly_rollups').delete_many(
+            {'month': month, 'refreshed_at': {'$lt': refreshed_at}}
+        )
+    
+    @staticmethod
+    def refresh_dirty(limit: Optional[int] = None) -> int:
+        """
+        Re-aggregate dirty months, oldest mark first.
+        
+        A mark is cleared only if it was not set again while its month was
+        being refreshed, so concurrent writes are picked up next run.
+        
+        Returns:
+            Number of months refreshed
+        """
+        dirty_collection = mongodb.get_collection('rollup_dirty')
+        cursor = dirty_collection.find().sort('dirty_at', 1)
+        if limit:
+            cursor = cursor.limit(limit)
+        
+        refreshed = 0
+        for mark in list(cursor):
+            RollupService.refresh_month(mark['_id'])
+            dirty_collection.delete_one(
+                {'_id': mark['_id'], 'dirty_at': {'$lte': mark['dirty_at']}}
+            )
+            refreshed += 1
+        
+        if refreshed:
+            logger.info(f"Rollups refreshed for {refreshed} month(s)")
+        return refreshed
+    
+    @staticmethod
+    def get_trends(
+        month_from: str,
+        month_to: str,
+        group_by: Optional[str] = None,
+        status: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Monthly totals between two YYYY-MM months, optionally split by a dimension.
+        
+        Returns:
+            Rows of month, optional key, count and total_amount ordered by month
+        """
+        match = {'month': {'$gte': month_from, '$lte': month_to}}
+        if status:
+            match['status'] = status
+        
+        group_id = {'month': '$month'}
+        if group_by:
+            group_id['key'] = ROLLUP_DIMENSIONS[group_by]
+        
+        pipeline = [
+            {'$match': match},
+            {'$group': {
+                '_id': group_id,
+                'count': {'$sum': '$count'},
+                'total_amount': {'$sum': '$total_amount'}
+            }},
+            {'$sort': {'_id.month': 1, 'total_amount': -1}}
+        ]
+        
+        rows = []
+        for row in mongodb.get_collection('monthly_rollups').aggregate(pipeline):
+            item = {
+                'month': row['_id']['month'],
+                'count': row['count'],
+                'total_amount': ExpenseModel.decimal_to_float(row['total_amount'])
+            }
+            if group_by:
+                item['key'] = row['_id'].get('key')
+            rows.append(item)
+        
+        if group_by == 'user':
+            user_ids = list({row['key'] for row in rows if row['key']})
+            emails = {
+                user['_id']: user['email']
+                for user in mongodb.get_collection('users').find(
+                    {'_id': {'$in': user_ids}}, {'email': 1}
+                )
+            }
+            for row in rows:
+                row['email'] = emails.get(row['key'], 'Unknown')
+                row['key'] = str(row['key'])
+        
+        return rows
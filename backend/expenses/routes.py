@@ -1,5 +1,9 @@
 from flask import Blueprint, request, send_file
 from expenses.service import ExpenseService
+from expenses.uploads import UploadSessionService
+from expenses.filters import parse_filter_args, parse_search_query, parse_page_args
+from expenses.models import ExpenseModel
+from storage.previews import PREVIEW_SIZES
 from utils.jwt import require_auth
 from utils.responses import error_response
 import logging
@@ -31,17 +35,87 @@ def upload_expense():
         logger.error(f"Upload expense route error: {str(e)}", exc_info=True)
         return error_response("Failed to upload expense", 500)
 
+@expenses_bp.route('/uploads', methods=['POST'])
+@require_auth
+def create_upload_session():
+    try:
+        data = request.get_json(silent=True) or {}
+        user_id = request.current_user['user_id']
+        return UploadSessionService.create_session(user_id, data.get('filename'), data.get('size'))
+        
+    except Exception as e:
+        logger.error(f"Create upload session route error: {str(e)}", exc_info=True)
+        return error_response("Failed to create upload session", 500)
+
+@expenses_bp.route('/uploads/<upload_id>', methods=['GET'])
+@require_auth
+def get_upload_session(upload_id):
+    try:
+        return UploadSessionService.get_session(upload_id, request.current_user['user_id'])
+        
+    except Exception as e:
+        logger.error(f"Get upload session route error: {str(e)}", exc_info=True)
+        return error_response("Failed to retrieve upload session", 500)
+
+@expenses_bp.route('/uploads/<upload_id>', methods=['PUT'])
+@require_auth
+def upload_chunk(upload_id):
+    try:
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return error_response("Upload-Offset header must be an integer", 400)
+        
+        return UploadSessionService.write_chunk(
+            upload_id,
+            request.current_user['user_id'],
+            offset,
+            request.stream,
+            request.content_length,
+            request.headers.get('Upload-Checksum')
+        )
+        
+    except Exception as e:
+        logger.error(f"Upload chunk route error: {str(e)}", exc_info=True)
+        return error_response("Failed to store chunk", 500)
+
+@expenses_bp.route('/uploads/<upload_id>/complete', methods=['POST'])
+@require_auth
+def complete_upload_session(upload_id):
+    try:
+        result = UploadSessionService.complete_session(upload_id, request.current_user['user_id'])
+        logger.info(f"Resumable upload result: {'success' if result[1] == 201 else 'failed'}")
+        return result
+        
+    except Exception as e:
+        logger.error(f"Complete upload session route error: {str(e)}", exc_info=True)
+        return error_response("Failed to complete upload", 500)
+
+@expenses_bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@require_auth
+def abort_upload_session(upload_id):
+    try:
+        return UploadSessionService.abort_session(upload_id, request.current_user['user_id'])
+        
+    except Exception as e:
+        logger.error(f"Abort upload session route error: {str(e)}", exc_info=True)
+        return error_response("Failed to cancel upload", 500)
+
 @expenses_bp.route('/my', methods=['GET'])
 @require_auth
 def get_my_expenses():
     try:
         user_id = request.current_user['user_id']
-        status = request.args.get('status')
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
+        filters, _ = parse_filter_args(request.args, strict=False)
+        filters['user_id'] = user_id
+        
+        fields, error_msg = ExpenseModel.parse_fields(request.args.get('fields'))
+        if error_msg:
+            return error_response(error_msg, 400)
         
-        logger.info(f"Get expenses request from user: {user_id}, status filter: {status or 'all'}")
-        result = ExpenseService.get_user_expenses(user_id, status, date_from, date_to)
+        status_filter = filters['status'] or 'all'
+        logger.info(f"Get expenses request from user: {user_id}, status filter: {status_filter}")
+        result = ExpenseService.get_user_expenses(fields=fields, **filters)
         logger.debug(f"Found {result[0].get_json().get('data', {}).get('count', 0)} expenses")
         return result
         
@@ -49,31 +123,77 @@ def get_my_expenses():
         logger.error(f"Get my expenses route error: {str(e)}", exc_info=True)
         return error_response("Failed to retrieve expenses", 500)
 
+@expenses_bp.route('/search', methods=['GET'])
+@require_auth
+def search_my_expenses():
+    try:
+        try:
+            terms, prefixes = parse_search_query(request.args.get('q'))
+        except ValueError as e:
+            return error_response(str(e), 400)
+        
+        user_id = request.current_user['user_id']
+        filters, _ = parse_filter_args(request.args, strict=False)
+        filters['user_id'] = user_id
+        
+        page, per_page, error_msg = parse_page_args(request.args)
+        if error_msg:
+            return error_response(error_msg, 400)
+        
+        fields, error_msg = ExpenseModel.parse_fields(request.args.get('fields'))
+        if error_msg:
+            return error_response(error_msg, 400)
+        
+        return ExpenseService.search_expenses(
+            terms, prefixes, page, per_page, fields=fields, **filters
+        )
+        
+    except Exception as e:
+        logger.error(f"Search my expenses route error: {str(e)}", exc_info=True)
+        return error_response("Failed to search expenses", 500)
+
 @expenses_bp.route('/export', methods=['GET'])
 @require_auth
 def export_expenses():
     try:
         user_id = request.current_user['user_id']
-        format_type = request.args.get('format', 'excel')  # excel or csv
-        status = request.args.get('status')
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
+        format_type = request.args.get('format', 'excel')  # excel, csv, parquet or arrow
+        filters, _ = parse_filter_args(request.args, strict=False)
+        filters['user_id'] = user_id
         
         logger.info(f"Export expenses request from user: {user_id}, format: {format_type}")
-        result = ExpenseService.export_expenses(user_id, format_type, status, date_from, date_to)
+        result = ExpenseService.export_expenses(format_type=format_type, **filters)
         return result
         
     except Exception as e:
         logger.error(f"Export expenses route error: {str(e)}", exc_info=True)
         return error_response("Failed to export expenses", 500)
 
+@expenses_bp.route('/<expense_id>', methods=['GET'])
+@require_auth
+def get_expense(expense_id):
+    try:
+        user_id = request.current_user['user_id']
+        role = request.current_user.get('role')
+        return ExpenseService.get_expense(expense_id, user_id, role)
+        
+    except Exception as e:
+        logger.error(f"Get expense route error: {str(e)}", exc_info=True)
+        return error_response("Failed to retrieve expense", 500)
+
 @expenses_bp.route('/<expense_id>/download', methods=['GET'])
 @require_auth
 def download_expense_file(expense_id):
     try:
         user_id = request.current_user['user_id']
         logger.info(f"Download file request for expense: {expense_id} from user: {user_id}")
-        result = ExpenseService.download_expense_file(expense_id, user_id)
+        size = request.args.get('size')
+        if size and size not in PREVIEW_SIZES:
+            return error_response(f"size must be one of: {', '.join(PREVIEW_SIZES)}", 400)
+        
+        original = request.args.get('original', 'false').lower() == 'true'
+        
+        result = ExpenseService.download_expense_file(expense_id, user_id, size, original)
         return result
         
     except Exception as e:
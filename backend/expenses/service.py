@@ -1,21 +1,42 @@
 from extensions.mongodb import mongodb
-from expenses.models import ExpenseModel, ExpenseStatus
+from expenses.models import ExpenseModel, ExpenseStatus, LIST_FIELDS
+from expenses.filters import build_expense_query, build_search_query, FILTER_KEYS
+from expenses.archive import ArchiveService, ARCHIVE_COLLECTION
+from expenses.rollups import RollupService
+from expenses.duplicates import DuplicateDetector
+from expenses.columnar import ColumnarExporter, COLUMNAR_FORMATS, EXPORT_PROJECTION
+from expenses.receipts_zip import ReceiptZipExporter, RECEIPTS_ZIP_PROJECTION
+from expenses.reimbursement_pack import ReimbursementPack
+from expenses.report_jobs import ReportJobService, PACK_TITLE
 from ai.bill_extractor import BillExtractor
 from storage.file_manager import FileManager
+from storage.previews import PreviewService, PREVIEW_MAX_AGE
+from users.stats import UserStatsService
 from utils.responses import success_response, error_response
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
 from datetime import datetime
 from typing import Optional, Dict, Any
-from flask import send_file
+from flask import send_file, Response, stream_with_context, current_app
 import logging
 import os
 import io
-import pandas as pd
+import csv
+import gzip
+import itertools
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment
 
 logger = logging.getLogger(__name__)
 
+BULK_PREVIEW_LIMIT = 20
+CSV_CHUNK_ROWS = 500
+
+# Fields needed to move an expense between statuses and update derived data
+TRANSITION_PROJECTION = {
+    'user_id': 1, 'status': 1, 'amount_inr': 1, 'bill_date': 1, 'created_at': 1
+}
+
 class ExpenseService:
     @staticmethod
     def create_expense(user_id: str, file) -> tuple:
@@ -28,8 +49,24 @@ class ExpenseService:
             if not image_path:
                 return error_response("Failed to save file", 500)
             
+            return ExpenseService.create_expense_from_file(user_id, image_path)
+            
+        except Exception as e:
+            logger.error(f"Error creating expense: {str(e)}")
+            return error_response("Failed to create expense", 500)
+    
+    @staticmethod
+    def create_expense_from_file(user_id: str, image_path: str) -> tuple:
+        """
+        Extract and store an expense for a receipt already saved by FileManager.
+        
+        The file is released if extraction, validation or the insert fails.
+        Duplicate detection is best-effort and never fails the upload.
+        """
+        release_file = False
+        try:
             try:
-                extracted_data = BillExtractor.extract_bill_data(image_path)
+                extracted_data, ocr_text = BillExtractor.extract_bill_data_with_text(image_path)
             except Exception as e:
                 logger.error(f"Bill extraction error: {str(e)}", exc_info=True)
                 FileManager.delete_file(image_path)
@@ -55,60 +92,69 @@ class ExpenseService:
                     400
                 )
             
+            release_file = True
             expense_doc = ExpenseModel.create_expense(
                 user_id=user_id,
                 image_path=image_path,
                 extracted_data=extracted_data,
-                status=ExpenseStatus.PENDING
+                status=ExpenseStatus.PENDING,
+                ocr_text=ocr_text
             )
             
+            expense_doc.update(DuplicateDetector.fingerprint(image_path))
+            try:
+                duplicates = DuplicateDetector.find_duplicates(expense_doc)
+            except Exception as e:
+                logger.error(f"Duplicate lookup failed for {image_path}: {str(e)}")
+                duplicates = []
+            if duplicates:
+                expense_doc['duplicates'] = duplicates
+            
             expenses_collection = mongodb.get_collection('expenses')
             result = expenses_collection.insert_one(expense_doc)
+            release_file = False
             expense_id = str(result.inserted_id)
             
-            expense = expenses_collection.find_one({'_id': result.inserted_id})
+            if duplicates:
+                try:
+                    DuplicateDetector.link_duplicates(result.inserted_id, duplicates)
+                except Exception as e:
+                    logger.error(f"Failed to link duplicates of expense {expense_id}: {str(e)}")
+                logger.warning(
+                    f"Expense {expense_id} flagged as possible duplicate of "
+                    f"{len(duplicates)} expense(s)"
+                )
+            
+            UserStatsService.record_created(
+                expense_doc['user_id'], expense_doc['status'], expense_doc.get('amount_inr')
+            )
+            RollupService.mark_dirty([expense_doc])
+            PreviewService.schedule(image_path)
             
             logger.info(f"Expense created: {expense_id} for user: {user_id}")
             
+            # insert_one sets _id on expense_doc, so no read-back is needed
             return success_response(
                 "Expense uploaded successfully",
-                ExpenseModel.format_expense_response(expense),
+                ExpenseModel.format_expense_response(expense_doc),
                 201
             )
             
         except Exception as e:
             logger.error(f"Error creating expense: {str(e)}")
+            if release_file:
+                FileManager.delete_file(image_path)
             return error_response("Failed to create expense", 500)
     
     @staticmethod
-    def get_user_expenses(user_id: str, status: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None) -> tuple:
+    def get_user_expenses(user_id: str, fields: Optional[tuple] = LIST_FIELDS, **filters) -> tuple:
         try:
-            expenses_collection = mongodb.get_collection('expenses')
+            query = build_expense_query(user_id=user_id, **filters)
+            projection = ExpenseModel.build_projection(fields)
             
-            query = {'user_id': ObjectId(user_id)}
-            if status:
-                query['status'] = status
-            
-            if date_from or date_to:
-                query['created_at'] = {}
-                if date_from:
-                    try:
-                        date_from_obj = datetime.fromisoformat(date_from.replace('Z', '+00:00'))
-                        query['created_at']['$gte'] = date_from_obj
-                    except ValueError:
-                        pass
-                if date_to:
-                    try:
-                        date_to_obj = datetime.fromisoformat(date_to.replace('Z', '+00:00'))
-                        query['created_at']['$lte'] = date_to_obj
-                    except ValueError:
-                        pass
-            
-            expenses = list(expenses_collection.find(query).sort('created_at', -1))
-            
-            formatted_expenses = [
-                ExpenseModel.format_expense_response(exp) for exp in expenses
-            ]
+            expenses = list(ArchiveService.find_expenses(query, filters, projection))
+            
+            formatted_expenses = ExpenseModel.format_expense_list(expenses, fields)
             
             return success_response(
                 "Expenses retrieved successfully",
@@ -120,40 +166,51 @@ class ExpenseService:
             return error_response("Failed to retrieve expenses", 500)
     
     @staticmethod
-    def get_all_expenses(
-        user_id: Optional[str] = None,
-        status: Optional[str] = None,
-        date_from: Optional[datetime] = None,
-        date_to: Optional[datetime] = None
-    ) -> tuple:
+    def get_expense(expense_id: str, user_id: str, role: str) -> tuple:
         try:
-            expenses_collection = mongodb.get_collection('expenses')
+            if not ObjectId.is_valid(expense_id):
+                return error_response("Expense not found", 404)
+            expense = ArchiveService.find_expense({'_id': ObjectId(expense_id)})
+            
+            if not expense:
+                return error_response("Expense not found", 404)
             
-            query = {}
+            if str(expense['user_id']) != user_id and role != 'HR':
+                return error_response("Unauthorized access", 403)
             
-            if user_id:
-                query['user_id'] = ObjectId(user_id)
+            if role == 'HR':
+                user = mongodb.get_collection('users').find_one(
+                    {'_id': expense['user_id']}, {'email': 1}
+                )
+                expense['user_email'] = user['email'] if user else 'Unknown'
             
-            if status:
-                query['status'] = status
+            return success_response(
+                "Expense retrieved successfully",
+                ExpenseModel.format_expense_response(expense)
+            )
             
-            if date_from or date_to:
-                query['created_at'] = {}
-                if date_from:
-                    query['created_at']['$gte'] = date_from
-                if date_to:
-                    query['created_at']['$lte'] = date_to
+        except Exception as e:
+            logger.error(f"Error getting expense: {str(e)}")
+            return error_response("Failed to retrieve expense", 500)
+    
+    @staticmethod
+    def get_all_expenses(fields: Optional[tuple] = LIST_FIELDS, **filters) -> tuple:
+        try:
+            query = build_expense_query(**filters)
+            projection = ExpenseModel.build_projection(fields)
             
-            expenses = list(expenses_collection.find(query).sort('created_at', -1))
+            expenses = list(ArchiveService.find_expenses(query, filters, projection))
             
             users_collection = mongodb.get_collection('users')
+            user_ids = list({expense['user_id'] for expense in expenses})
+            user_map = {
+                user['_id']: user['email']
+                for user in users_collection.find({'_id': {'$in': user_ids}}, {'email': 1})
+            }
             for expense in expenses:
-                user = users_collection.find_one({'_id': expense['user_id']})
-                expense['user_email'] = user['email'] if user else 'Unknown'
+                expense['user_email'] = user_map.get(expense['user_id'], 'Unknown')
             
-            formatted_expenses = [
-                ExpenseModel.format_expense_response(exp) for exp in expenses
-            ]
+            formatted_expenses = ExpenseModel.format_expense_list(expenses, fields)
             
             return success_response(
                 "Expenses retrieved successfully",
@@ -165,30 +222,267 @@ class ExpenseService:
             return error_response("Failed to retrieve expenses", 500)
     
     @staticmethod
-    def update_expense_status(expense_id: str, status: str, notes: Optional[str] = None) -> tuple:
+    def search_expenses(
+        terms: list,
+        prefixes: list,
+        page: int = 1,
+        per_page: int = 50,
+        fields: Optional[tuple] = LIST_FIELDS,
+        include_user_email: bool = False,
+        **filters
+    ) -> tuple:
+        """
+        Search vendor details, category and OCR text, combined with list filters.
+        
+        Whole-word terms are ranked by text score (newest first on ties);
+        prefix-only searches are ordered newest first.
+        """
         try:
-            if status not in [ExpenseStatus.APPROVED, ExpenseStatus.REJECTED, ExpenseStatus.PENDING]:
-                return error_response("Invalid status. Must be 'approved', 'rejected', or 'pending'", 400)
+            query = {**build_expense_query(**filters), **build_search_query(terms, prefixes)}
+            
+            scored = [{'$addFields': {'score': {'$meta': 'textScore'}}}] if terms else []
+            pipeline = [{'$match': query}, *scored]
+            if ArchiveService.needs_archive(filters):
+                pipeline.append({'$unionWith': {
+                    'coll': ARCHIVE_COLLECTION,
+                    'pipeline': [{'$match': query}, *scored]
+                }})
+            
+            projection = ExpenseModel.build_projection(fields)
+            if projection is None:
+                projection = {'ocr_text': 0, 'search_tokens': 0}
+            elif terms:
+                projection['score'] = 1
+            
+            pipeline += [
+                {'$sort': {'score': -1, 'created_at': -1} if terms else {'created_at': -1}},
+                {'$facet': {
+                    'items': [
+                        {'$skip': (page - 1) * per_page},
+                        {'$limit': per_page},
+                        {'$project': projection}
+                    ],
+                    'total': [{'$count': 'count'}]
+                }}
+            ]
+            
+            result = next(mongodb.get_collection('expenses').aggregate(pipeline), {})
+            expenses = result.get('items', [])
+            total = result['total'][0]['count'] if result.get('total') else 0
+            
+            if include_user_email:
+                users_collection = mongodb.get_collection('users')
+                user_ids = list({expense['user_id'] for expense in expenses})
+                user_map = {
+                    user['_id']: user['email']
+                    for user in users_collection.find({'_id': {'$in': user_ids}}, {'email': 1})
+                }
+                for expense in expenses:
+                    expense['user_email'] = user_map.get(expense['user_id'], 'Unknown')
+            
+            formatted_expenses = ExpenseModel.format_expense_list(expenses, fields)
+            if terms:
+                for formatted, expense in zip(formatted_expenses, expenses):
+                    formatted['score'] = round(expense.get('score', 0.0), 4)
             
+            return success_response(
+                "Search completed successfully",
+                {
+                    'expenses': formatted_expenses,
+                    'count': len(formatted_expenses),
+                    'total': total,
+                    'page': page,
+                    'per_page': per_page
+                }
+            )
+            
+        except Exception as e:
+            logger.error(f"Error searching expenses: {str(e)}", exc_info=True)
+            return error_response("Failed to search expenses", 500)
+    
+    @staticmethod
+    def get_flagged_duplicates(
+        page: int = 1,
+        per_page: int = 50,
+        fields: Optional[tuple] = LIST_FIELDS
+    ) -> tuple:
+        """Live expenses flagged as possible duplicates, newest first."""
+        try:
             expenses_collection = mongodb.get_collection('expenses')
+            # Matches the partial index; duplicates is only written when non-empty
+            query = {'duplicates': {'$exists': True}}
             
-            update_data = {
-                'status': status,
-                'updated_at': datetime.utcnow()
+            total = expenses_collection.count_documents(query)
+            expenses = list(
+                expenses_collection.find(query, ExpenseModel.build_projection(fields))
+                .sort('created_at', -1)
+                .skip((page - 1) * per_page)
+                .limit(per_page)
+            )
+            
+            users_collection = mongodb.get_collection('users')
+            user_ids = list({expense['user_id'] for expense in expenses})
+            user_map = {
+                user['_id']: user['email']
+                for user in users_collection.find({'_id': {'$in': user_ids}}, {'email': 1})
             }
+            for expense in expenses:
+                expense['user_email'] = user_map.get(expense['user_id'], 'Unknown')
             
-            if notes is not None:
-                update_data['hr_notes'] = notes.strip() if notes else None
+            formatted_expenses = ExpenseModel.format_expense_list(expenses, fields)
             
-            result = expenses_collection.update_one(
-                {'_id': ObjectId(expense_id)},
-                {'$set': update_data}
+            return success_response(
+                "Flagged expenses retrieved successfully",
+                {
+                    'expenses': formatted_expenses,
+                    'count': len(formatted_expenses),
+                    'total': total,
+                    'page': page,
+                    'per_page': per_page
+                }
             )
             
-            if result.matched_count == 0:
-                return error_response("Expense not found", 404)
+        except Exception as e:
+            logger.error(f"Error getting flagged duplicates: {str(e)}", exc_info=True)
+            return error_response("Failed to retrieve flagged expenses", 500)
+    
+    @staticmethod
+    def get_expenses_summary(top: int = 10, **filters) -> tuple:
+        try:
+            expenses_collection = mongodb.get_collection('expenses')
+            
+            query = build_expense_query(**filters)
+            totals_group = {'count': {'$sum': 1}, 'total_amount': {'$sum': '$amount_inr'}}
             
-            expense = expenses_collection.find_one({'_id': ObjectId(expense_id)})
+            pipeline = [{'$match': query}]
+            if ArchiveService.needs_archive(filters):
+                pipeline.append({'$unionWith': {
+                    'coll': ARCHIVE_COLLECTION, 'pipeline': [{'$match': query}]
+                }})
+            
+            pipeline += [
+                # Only fields in the status/created_at covering index. The plan is
+                # covered only when the filters include a status, the index prefix;
+                # without one the documents are fetched as usual.
+                {'$project': {
+                    '_id': 0, 'user_id': 1, 'status': 1, 'category': 1,
+                    'amount_inr': 1, 'created_at': 1
+                }},
+                {'$facet': {
+                    'totals': [
+                        {'$group': {'_id': None, **totals_group}}
+                    ],
+                    'by_status': [
+                        {'$group': {'_id': '$status', **totals_group}},
+                        {'$sort': {'_id': 1}}
+                    ],
+                    'by_category': [
+                        {'$group': {'_id': '$category', **totals_group}},
+                        {'$sort': {'total_amount': -1}}
+                    ],
+                    'by_month': [
+                        {'$group': {
+                            '_id': {'$dateToString': {'format': '%Y-%m', 'date': '$created_at'}},
+                            **totals_group
+                        }},
+                        {'$sort': {'_id': 1}}
+                    ],
+                    'top_spenders': [
+                        {'$group': {'_id': '$user_id', **totals_group}},
+                        {'$sort': {'total_amount': -1}},
+                        {'$limit': top},
+                        {'$lookup': {
+                            'from': 'users',
+                            'localField': '_id',
+                            'foreignField': '_id',
+                            'as': 'user'
+                        }},
+                        {'$project': {
+                            'count': 1,
+                            'total_amount': 1,
+                            'email': {'$arrayElemAt': ['$user.email', 0]}
+                        }}
+                    ]
+                }}
+            ]
+            
+            result = next(expenses_collection.aggregate(pipeline), {})
+            
+            def buckets(rows, key_name):
+                return [
+                    {
+                        key_name: row['_id'],
+                        'count': row['count'],
+                        'total_amount': ExpenseModel.decimal_to_float(row['total_amount'])
+                    }
+                    for row in rows
+                ]
+            
+            totals = result.get('totals') or [{'count': 0, 'total_amount': 0}]
+            summary = {
+                'total_count': totals[0]['count'],
+                'total_amount': ExpenseModel.decimal_to_float(totals[0]['total_amount']),
+                'by_status': buckets(result.get('by_status', []), 'status'),
+                'by_category': buckets(result.get('by_category', []), 'category'),
+                'by_month': buckets(result.get('by_month', []), 'month'),
+                'top_spenders': [
+                    {
+                        'user_id': str(row['_id']),
+                        'email': row.get('email', 'Unknown'),
+                        'count': row['count'],
+                        'total_amount': ExpenseModel.decimal_to_float(row['total_amount'])
+                    }
+                    for row in result.get('top_spenders', [])
+                ]
+            }
+            
+            return success_response("Expense summary retrieved successfully", summary)
+            
+        except Exception as e:
+            logger.error(f"Error getting expense summary: {str(e)}", exc_info=True)
+            return error_response("Failed to retrieve expense summary", 500)
+    
+    @staticmethod
+    def update_expense_status(
+        expense_id: str,
+        status: str,
+        notes: Optional[str] = None,
+        version: Optional[int] = None
+    ) -> tuple:
+        try:
+            if status not in [ExpenseStatus.APPROVED, ExpenseStatus.REJECTED, ExpenseStatus.PENDING]:
+                return error_response("Invalid status. Must be 'approved', 'rejected', or 'pending'", 400)
+            
+            expenses_collection = mongodb.get_collection('expenses')
+            
+            query = {'_id': ObjectId(expense_id)}
+            if version is not None:
+                query.update(ExpenseModel.version_filter(version))
+            
+            expense = expenses_collection.find_one_and_update(
+                query,
+                ExpenseModel.status_update(status, notes),
+                return_document=ReturnDocument.AFTER
+            )
+            
+            if expense is None:
+                current = None
+                if version is not None:
+                    current = expenses_collection.find_one(
+                        {'_id': ObjectId(expense_id)}, {'version': 1}
+                    )
+                if current is None:
+                    return error_response("Expense not found", 404)
+                return error_response(
+                    "Expense was modified by another reviewer. Reload and try again.",
+                    409,
+                    {'version': current.get('version', 1)}
+                )
+            
+            UserStatsService.record_status_change(
+                expense['user_id'], expense['previous_status'], status, expense.get('amount_inr')
+            )
+            RollupService.mark_dirty([expense])
             
             logger.info(f"Expense status updated: {expense_id} to {status} with notes: {bool(notes)}")
             
@@ -209,30 +503,18 @@ class ExpenseService:
             return error_response("Failed to update expense status", 500)
     
     @staticmethod
-    def export_expenses(user_id: str, format_type: str, status: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None) -> tuple:
+    def export_expenses(user_id: str, format_type: str, **filters) -> tuple:
         try:
-            expenses_collection = mongodb.get_collection('expenses')
+            query = build_expense_query(user_id=user_id, **filters)
+            
+            if format_type.lower() in COLUMNAR_FORMATS:
+                return ExpenseService._export_columnar(
+                    ArchiveService.find_expenses(query, filters, EXPORT_PROJECTION),
+                    format_type.lower(),
+                    'expenses'
+                )
             
-            query = {'user_id': ObjectId(user_id)}
-            if status:
-                query['status'] = status
-            
-            if date_from or date_to:
-                query['created_at'] = {}
-                if date_from:
-                    try:
-                        date_from_obj = datetime.fromisoformat(date_from.replace('Z', '+00:00'))
-                        query['created_at']['$gte'] = date_from_obj
-                    except ValueError:
-                        pass
-                if date_to:
-                    try:
-                        date_to_obj = datetime.fromisoformat(date_to.replace('Z', '+00:00'))
-                        query['created_at']['$lte'] = date_to_obj
-                    except ValueError:
-                        pass
-            
-            expenses = list(expenses_collection.find(query).sort('created_at', -1))
+            expenses = list(ArchiveService.find_expenses(query, filters))
             
             if not expenses:
                 return error_response("No expenses found to export", 404)
@@ -241,14 +523,12 @@ class ExpenseService:
             export_data = []
             for exp in expenses:
                 extracted = exp.get('extracted_data', {})
-                amount = extracted.get('Bill Amount (INR)') or extracted.get('Bill Amount') or '0'
-                amount_clean = str(amount).replace('₹', '').replace(',', '').replace('$', '').replace('€', '').strip()
                 
                 export_data.append({
                     'Date': extracted.get('Date', ''),
                     'Vendor': extracted.get('Details', ''),
                     'Bill Type': extracted.get('Bill Type', ''),
-                    'Amount (INR)': amount_clean,
+                    'Amount (INR)': ExpenseModel.get_amount_inr(exp),
                     'Status': exp.get('status', ''),
                     'HR Notes': exp.get('hr_notes', ''),
                     'Created At': exp.get('created_at', '').strftime('%Y-%m-%d %H:%M:%S') if exp.get('created_at') else '',
@@ -256,14 +536,9 @@ class ExpenseService:
                 })
             
             if format_type.lower() == 'csv':
-                df = pd.DataFrame(export_data)
-                output = io.StringIO()
-                df.to_csv(output, index=False)
-                output.seek(0)
-                
                 from flask import Response
                 return Response(
-                    output.getvalue(),
+                    ExpenseService._stream_csv(export_data),
                     mimetype='text/csv',
                     headers={'Content-Disposition': f'attachment; filename=expenses_{datetime.now().strftime("%Y%m%d")}.csv'}
                 )
@@ -318,10 +593,117 @@ class ExpenseService:
             return error_response("Failed to export expenses", 500)
     
     @staticmethod
-    def download_expense_file(expense_id: str, user_id: str) -> tuple:
+    def export_receipts_zip(**filters) -> tuple:
+        """Stream the receipt files of expenses matching filters as a ZIP with a CSV manifest."""
         try:
-            expenses_collection = mongodb.get_collection('expenses')
-            expense = expenses_collection.find_one({'_id': ObjectId(expense_id)})
+            query = build_expense_query(**filters)
+            expenses = iter(ArchiveService.find_expenses(query, filters, RECEIPTS_ZIP_PROJECTION))
+            
+            first = next(expenses, None)
+            if first is None:
+                return error_response("No expenses found to export", 404)
+            
+            # The generator reads storage and MongoDB after the view has returned
+            filename = f'receipts_{datetime.now().strftime("%Y%m%d")}.zip'
+            return Response(
+                stream_with_context(ReceiptZipExporter.stream(itertools.chain([first], expenses))),
+                mimetype='application/zip',
+                headers={'Content-Disposition': f'attachment; filename={filename}'}
+            )
+            
+        except Exception as e:
+            logger.error(f"Error exporting receipts: {str(e)}")
+            return error_response("Failed to export receipts", 500)
+    
+    @staticmethod
+    def export_reimbursement_pack(
+        filters: Dict[str, Any],
+        filter_args: Dict[str, str],
+        user_id: str,
+        run_async: bool = False
+    ) -> tuple:
+        """
+        Reimbursement pack PDF for expenses matching filters.
+        
+        Up to PACK_SYNC_MAX_EXPENSES expenses are streamed in the response;
+        larger packs (or run_async) are queued as a report job and answered
+        with 202.
+        """
+        try:
+            sync_max = current_app.config.get('PACK_SYNC_MAX_EXPENSES', 50)
+            count = ReportJobService.count_expenses(filters, limit=sync_max + 1)
+            if not count:
+                return error_response("No expenses found to export", 404)
+            if run_async or count > sync_max:
+                return ReportJobService.create_pack_job(filter_args, user_id)
+            
+            pages = ReimbursementPack.generate(
+                ReportJobService.pack_expenses(filters),
+                PACK_TITLE,
+                ReimbursementPack.describe_filters(filter_args)
+            )
+            filename = f'reimbursement_pack_{datetime.now().strftime("%Y%m%d")}.pdf'
+            return Response(
+                stream_with_context(pages),
+                mimetype='application/pdf',
+                headers={'Content-Disposition': f'attachment; filename={filename}'}
+            )
+            
+        except Exception as e:
+            logger.error(f"Error exporting reimbursement pack: {str(e)}")
+            return error_response("Failed to export reimbursement pack", 500)
+    
+    @staticmethod
+    def _export_columnar(
+        expenses,
+        format_type: str,
+        filename: str,
+        include_user_email: bool = False
+    ):
+        """Send expenses as a Parquet file or Arrow IPC stream written straight from the cursor."""
+        if not ColumnarExporter.is_available():
+            return error_response(f"{format_type} export requires pyarrow", 501)
+        
+        output, row_count = ColumnarExporter.write(expenses, format_type, include_user_email)
+        if not row_count:
+            output.close()
+            return error_response("No expenses found to export", 404)
+        
+        extension, mimetype = COLUMNAR_FORMATS[format_type]
+        return send_file(
+            output,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=f'{filename}_{datetime.now().strftime("%Y%m%d")}.{extension}'
+        )
+    
+    @staticmethod
+    def _stream_csv(rows: list, chunk_rows: int = CSV_CHUNK_ROWS):
+        """Yield CSV text in chunks so large exports are not built in one string."""
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        
+        for idx, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if idx % chunk_rows == 0:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        
+        yield output.getvalue()
+    
+    @staticmethod
+    def download_expense_file(
+        expense_id: str,
+        user_id: str,
+        size: Optional[str] = None,
+        original: bool = False
+    ) -> tuple:
+        try:
+            if not ObjectId.is_valid(expense_id):
+                return error_response("Expense not found", 404)
+            expense = ArchiveService.find_expense({'_id': ObjectId(expense_id)})
             
             if not expense:
                 return error_response("Expense not found", 404)
@@ -335,11 +717,30 @@ class ExpenseService:
                     return error_response("Unauthorized access", 403)
             
             image_path = expense.get('image_path')
-            if not image_path or not os.path.exists(image_path):
+            if original and expense.get('original_image_path'):
+                # Kept by jobs recompress-receipts while the expense is pending
+                image_path = expense['original_image_path']
+            if not image_path or not FileManager.file_exists(image_path):
                 return error_response("File not found", 404)
             
+            if size:
+                preview_path = PreviewService.get_preview_path(image_path, size)
+                if preview_path:
+                    return FileManager.send_stored_file(
+                        preview_path, max_age=PREVIEW_MAX_AGE, private=True
+                    )
+            
             from flask import send_file
-            return send_file(
+            if image_path.endswith('.gz'):
+                # Archived receipts may be stored gzip-compressed
+                download_name = os.path.basename(image_path)[:-len('.gz')]
+                return send_file(
+                    gzip.open(image_path, 'rb'),
+                    as_attachment=True,
+                    download_name=download_name
+                )
+            
+            return FileManager.send_stored_file(
                 image_path,
                 as_attachment=True,
                 download_name=os.path.basename(image_path)
@@ -349,6 +750,58 @@ class ExpenseService:
             logger.error(f"Error downloading file: {str(e)}")
             return error_response("Failed to download file", 500)
     
+    @staticmethod
+    def _apply_stats_changes(deltas: Dict, stale_users: set) -> None:
+        for user_id in stale_users:
+            deltas.pop(user_id, None)
+        UserStatsService.apply_deltas(deltas)
+        if stale_users:
+            try:
+                UserStatsService.rebuild(list(stale_users))
+            except Exception as e:
+                logger.warning(f"User stats rebuild after bulk update failed: {str(e)}")
+    
+    @staticmethod
+    def _transition_expenses(expenses: list, status: str, notes: Optional[str] = None) -> int:
+        """
+        Move expenses loaded with TRANSITION_PROJECTION to status.
+        
+        Returns:
+            Number of expenses updated
+        """
+        expenses_collection = mongodb.get_collection('expenses')
+        update_pipeline = ExpenseModel.status_update(status, notes)
+        
+        by_status = {}
+        for expense in expenses:
+            by_status.setdefault(expense['status'], []).append(expense)
+        
+        # Update per previous status so every matched document is known to
+        # have made exactly the transition the stats deltas describe.
+        modified_count = 0
+        deltas = {}
+        stale_users = set()
+        for old_status, group in by_status.items():
+            result = expenses_collection.update_many(
+                {'_id': {'$in': [exp['_id'] for exp in group]}, 'status': old_status},
+                update_pipeline
+            )
+            modified_count += result.modified_count
+            
+            if result.matched_count != len(group):
+                stale_users.update(exp['user_id'] for exp in group)
+                continue
+            for exp in group:
+                UserStatsService.merge_delta(
+                    deltas,
+                    exp['user_id'],
+                    UserStatsService.status_change_delta(old_status, status, exp.get('amount_inr'))
+                )
+        
+        ExpenseService._apply_stats_changes(deltas, stale_users)
+        RollupService.mark_dirty(expenses)
+        return modified_count
+    
     @staticmethod
     def bulk_update_status(expense_ids: list, status: str, notes: Optional[str] = None) -> tuple:
         try:
@@ -367,49 +820,210 @@ class ExpenseService:
             if not object_ids:
                 return error_response("No valid expense IDs provided", 400)
             
-            update_data = {
-                'status': status,
-                'updated_at': datetime.utcnow()
-            }
+            candidates = list(expenses_collection.find(
+                {'_id': {'$in': object_ids}},
+                TRANSITION_PROJECTION
+            ))
+            modified_count = ExpenseService._transition_expenses(candidates, status, notes)
             
-            if notes is not None:
-                update_data['hr_notes'] = notes.strip() if notes else None
+            logger.info(f"Bulk update: {modified_count} expenses updated to {status}")
             
-            result = expenses_collection.update_many(
-                {'_id': {'$in': object_ids}},
-                {'$set': update_data}
+            return success_response(
+                f"Successfully updated {modified_count} expense(s)",
+                {'updated_count': modified_count, 'status': status}
             )
             
-            logger.info(f"Bulk update: {result.modified_count} expenses updated to {status}")
+        except Exception as e:
+            logger.error(f"Error bulk updating expenses: {str(e)}")
+            return error_response("Failed to bulk update expenses", 500)
+    
+    @staticmethod
+    def bulk_update_by_filter(
+        filters: Dict[str, Any],
+        status: str,
+        notes: Optional[str] = None,
+        dry_run: bool = False,
+        batch_size: int = 500
+    ) -> tuple:
+        try:
+            valid_statuses = [ExpenseStatus.APPROVED, ExpenseStatus.REJECTED, ExpenseStatus.PENDING]
+            if status not in valid_statuses:
+                return error_response(
+                    "Invalid status. Must be 'approved', 'rejected', or 'pending'", 400
+                )
+            
+            query = build_expense_query(**filters)
+            if not query:
+                # An empty query would update every live expense
+                return error_response(
+                    f"filter must set at least one of: {', '.join(FILTER_KEYS)}", 400
+                )
+            
+            expenses_collection = mongodb.get_collection('expenses')
+            
+            if dry_run:
+                totals = next(expenses_collection.aggregate([
+                    {'$match': query},
+                    {'$group': {
+                        '_id': None,
+                        'count': {'$sum': 1},
+                        'total_amount': {'$sum': '$amount_inr'}
+                    }}
+                ]), {'count': 0, 'total_amount': 0})
+                
+                preview = ExpenseModel.format_expense_list(
+                    expenses_collection.find(query, ExpenseModel.build_projection(LIST_FIELDS))
+                    .sort('created_at', -1)
+                    .limit(BULK_PREVIEW_LIMIT),
+                    LIST_FIELDS
+                )
+                
+                return success_response(
+                    f"{totals['count']} expense(s) would be updated",
+                    {
+                        'dry_run': True,
+                        'matched_count': totals['count'],
+                        'total_amount': ExpenseModel.decimal_to_float(totals['total_amount']),
+                        'status': status,
+                        'preview': preview
+                    }
+                )
+            
+            # Walk matches in _id order one bounded batch at a time so each
+            # update_many touches at most batch_size documents.
+            modified_count = 0
+            last_id = None
+            while True:
+                batch_query = dict(query)
+                if last_id is not None:
+                    batch_query['_id'] = {'$gt': last_id}
+                
+                batch = list(
+                    expenses_collection.find(batch_query, TRANSITION_PROJECTION)
+                    .sort('_id', 1)
+                    .limit(batch_size)
+                )
+                if not batch:
+                    break
+                
+                modified_count += ExpenseService._transition_expenses(batch, status, notes)
+                last_id = batch[-1]['_id']
+            
+            logger.info(f"Filter bulk update: {modified_count} expenses updated to {status}")
             
             return success_response(
-                f"Successfully updated {result.modified_count} expense(s)",
-                {'updated_count': result.modified_count, 'status': status}
+                f"Successfully updated {modified_count} expense(s)",
+                {'updated_count': modified_count, 'status': status}
             )
             
         except Exception as e:
-            logger.error(f"Error bulk updating expenses: {str(e)}")
+            logger.error(f"Error bulk updating expenses by filter: {str(e)}", exc_info=True)
             return error_response("Failed to bulk update expenses", 500)
     
     @staticmethod
-    def export_all_expenses(format_type: str, status: Optional[str] = None, user_id: Optional[str] = None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None) -> tuple:
+    def bulk_update_individual(updates: list) -> tuple:
         try:
+            valid_statuses = [ExpenseStatus.APPROVED, ExpenseStatus.REJECTED, ExpenseStatus.PENDING]
+            
+            requested = {}
+            for item in updates:
+                if (
+                    not isinstance(item, dict)
+                    or not isinstance(item.get('expense_id'), str)
+                    or item.get('status') not in valid_statuses
+                ):
+                    return error_response("Each update needs an expense_id and a valid status", 400)
+                version = item.get('version')
+                if version is not None and (
+                    isinstance(version, bool) or not isinstance(version, int) or version < 1
+                ):
+                    return error_response(
+                        f"Invalid version for {item['expense_id']}: must be a positive integer", 400
+                    )
+                if item.get('notes') is not None and not isinstance(item['notes'], str):
+                    return error_response(
+                        f"Invalid notes for {item['expense_id']}: must be a string", 400
+                    )
+                try:
+                    requested[ObjectId(item.get('expense_id'))] = item
+                except Exception:
+                    return error_response(f"Invalid expense_id: {item.get('expense_id')}", 400)
+            
             expenses_collection = mongodb.get_collection('expenses')
+            current = {
+                exp['_id']: exp
+                for exp in expenses_collection.find(
+                    {'_id': {'$in': list(requested)}},
+                    TRANSITION_PROJECTION
+                )
+            }
+            
+            operations = []
+            deltas = {}
+            affected_users = set()
+            for expense_id, item in requested.items():
+                expense = current.get(expense_id)
+                if expense is None:
+                    continue
+                
+                query = {'_id': expense_id, 'status': expense['status']}
+                if item.get('version') is not None:
+                    query.update(ExpenseModel.version_filter(item['version']))
+                update = ExpenseModel.status_update(item['status'], item.get('notes'))
+                operations.append(UpdateOne(query, update))
+                
+                affected_users.add(expense['user_id'])
+                UserStatsService.merge_delta(
+                    deltas,
+                    expense['user_id'],
+                    UserStatsService.status_change_delta(
+                        expense['status'], item['status'], expense.get('amount_inr')
+                    )
+                )
+            
+            updated_count = 0
+            if operations:
+                result = expenses_collection.bulk_write(operations, ordered=False)
+                updated_count = result.modified_count
+                # bulk_write does not say which operations missed, so fall back
+                # to rebuilding every affected user if any of them did.
+                stale_users = affected_users if result.matched_count != len(operations) else set()
+                ExpenseService._apply_stats_changes(deltas, stale_users)
+                RollupService.mark_dirty(current.values())
+            
+            logger.info(
+                f"Individual bulk update: {updated_count} of {len(requested)} expenses updated"
+            )
+            
+            return success_response(
+                f"Successfully updated {updated_count} expense(s)",
+                {
+                    'updated_count': updated_count,
+                    'not_found_count': len(requested) - len(operations),
+                    'conflict_count': len(operations) - updated_count
+                }
+            )
+            
+        except Exception as e:
+            logger.error(f"Error applying individual bulk updates: {str(e)}", exc_info=True)
+            return error_response("Failed to bulk update expenses", 500)
+    
+    @staticmethod
+    def export_all_expenses(format_type: str, **filters) -> tuple:
+        try:
             users_collection = mongodb.get_collection('users')
             
-            query = {}
-            if status:
-                query['status'] = status
-            if user_id:
-                query['user_id'] = ObjectId(user_id)
-            if date_from or date_to:
-                query['created_at'] = {}
-                if date_from:
-                    query['created_at']['$gte'] = date_from
-                if date_to:
-                    query['created_at']['$lte'] = date_to
+            query = build_expense_query(**filters)
+            
+            if format_type.lower() in COLUMNAR_FORMATS:
+                return ExpenseService._export_columnar(
+                    ArchiveService.find_expenses(query, filters, EXPORT_PROJECTION),
+                    format_type.lower(),
+                    'all_expenses',
+                    include_user_email=True
+                )
             
-            expenses = list(expenses_collection.find(query).sort('created_at', -1))
+            expenses = list(ArchiveService.find_expenses(query, filters))
             
             if not expenses:
                 return error_response("No expenses found to export", 404)
@@ -426,15 +1040,13 @@ class ExpenseService:
             export_data = []
             for exp in expenses:
                 extracted = exp.get('extracted_data', {})
-                amount = extracted.get('Bill Amount (INR)') or extracted.get('Bill Amount') or '0'
-                amount_clean = str(amount).replace('₹', '').replace(',', '').replace('$', '').replace('€', '').strip()
                 
                 export_data.append({
                     'User Email': user_map.get(exp['user_id'], 'Unknown'),
                     'Date': extracted.get('Date', ''),
                     'Vendor': extracted.get('Details', ''),
                     'Bill Type': extracted.get('Bill Type', ''),
-                    'Amount (INR)': amount_clean,
+                    'Amount (INR)': ExpenseModel.get_amount_inr(exp),
                     'Status': exp.get('status', ''),
                     'HR Notes': exp.get('hr_notes', ''),
                     'Created At': exp.get('created_at', '').strftime('%Y-%m-%d %H:%M:%S') if exp.get('created_at') else '',
@@ -442,14 +1054,9 @@ class ExpenseService:
                 })
             
             if format_type.lower() == 'csv':
-                df = pd.DataFrame(export_data)
-                output = io.StringIO()
-                df.to_csv(output, index=False)
-                output.seek(0)
-                
                 from flask import Response
                 return Response(
-                    output.getvalue(),
+                    ExpenseService._stream_csv(export_data),
                     mimetype='text/csv',
                     headers={'Content-Disposition': f'attachment; filename=all_expenses_{datetime.now().strftime("%Y%m%d")}.csv'}
                 )
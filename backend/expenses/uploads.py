@@ -0,0 +1,349 @@
+"""
+Resumable uploads for large receipts.
+
+A client creates an upload session, PUTs the file in chunks at increasing
+offsets (retrying or resuming from the offset the server reports), then
+completes the session, which runs the normal extraction path. Chunks are
+written straight into a per-session file; sessions live in a TTL
+collection, so abandoned uploads expire on their own.
+"""
+from extensions.mongodb import mongodb
+from expenses.service import ExpenseService
+from storage.file_manager import FileManager
+from utils.responses import success_response, error_response
+from werkzeug.utils import secure_filename
+from flask import current_app
+from bson import ObjectId
+from datetime import datetime, timedelta
+from typing import Optional
+import hashlib
+import base64
+import binascii
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_SESSIONS_COLLECTION = 'upload_sessions'
+WRITE_BUFFER_SIZE = 64 * 1024
+# A chunk write that has not finished after this long is assumed dead
+STALE_WRITE_SECONDS = 120
+
+# Leading bytes of each allowed file type
+FILE_SIGNATURES = {
+    'pdf': (b'%PDF',),
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpg': (b'\xff\xd8\xff',),
+    'jpeg': (b'\xff\xd8\xff',)
+}
+
+def _session_folder() -> str:
+    folder = current_app.config.get('UPLOAD_SESSION_FOLDER', 'uploads/sessions')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def _parse_checksum(header: Optional[str]) -> Optional[bytes]:
+    """SHA-256 digest from an "Upload-Checksum: sha256 <base64>" header."""
+    algorithm, _, value = (header or '').strip().partition(' ')
+    if algorithm.lower() != 'sha256' or not value:
+        raise ValueError("Upload-Checksum must be 'sha256 <base64 digest>'")
+    try:
+        digest = base64.b64decode(value.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("Upload-Checksum digest is not valid base64")
+    if len(digest) != hashlib.sha256().digest_size:
+        raise ValueError("Upload-Checksum digest has the wrong length")
+    return digest
+
+class UploadSessionService:
+    @staticmethod
+    def _find_session(upload_id: str, user_id: str) -> Optional[dict]:
+        if not ObjectId.is_valid(upload_id):
+            return None
+        session = mongodb.get_collection(UPLOAD_SESSIONS_COLLECTION).find_one(
+            {'_id': ObjectId(upload_id)}
+        )
+        if not session or session['user_id'] != user_id:
+            return None
+        return session
+    
+    @staticmethod
+    def _format_session(session: dict) -> dict:
+        return {
+            'upload_id': str(session['_id']),
+            'filename': session['filename'],
+            'size': session['size'],
+            'offset': session['offset'],
+            'chunk_size': current_app.config.get('UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024),
+            'expires_at': session['expires_at'].isoformat()
+        }
+    
+    @staticmethod
+    def _expires_at() -> datetime:
+        ttl_hours = current_app.config.get('UPLOAD_SESSION_TTL_HOURS', 24)
+        return datetime.utcnow() + timedelta(hours=ttl_hours)
+    
+    @staticmethod
+    def _release(session: dict) -> None:
+        mongodb.get_collection(UPLOAD_SESSIONS_COLLECTION).update_one(
+            {'_id': session['_id']}, {'$set': {'writing_since': None}}
+        )
+    
+    @staticmethod
+    def _discard(session: dict) -> None:
+        mongodb.get_collection(UPLOAD_SESSIONS_COLLECTION).delete_one({'_id': session['_id']})
+        if os.path.exists(session['temp_path']):
+            os.remove(session['temp_path'])
+    
+    @staticmethod
+    def create_session(user_id: str, filename: str, size) -> tuple:
+        try:
+            filename = secure_filename(filename or '')
+            if not filename or not FileManager.allowed_file(filename):
+                return error_response(
+                    "File type not allowed. Allowed types: PNG, JPG, JPEG, PDF", 400
+                )
+            
+            if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+                return error_response("size must be a positive integer", 400)
+            max_size = current_app.config.get('RESUMABLE_MAX_FILE_SIZE', 100 * 1024 * 1024)
+            if size > max_size:
+                return error_response(
+                    f"File size exceeds maximum allowed size ({max_size / 1024 / 1024}MB)", 413
+                )
+            
+            session_id = ObjectId()
+            temp_path = os.path.join(_session_folder(), f"{session_id}.part")
+            open(temp_path, 'wb').close()
+            
+            now = datetime.utcnow()
+            session = {
+                '_id': session_id,
+                'user_id': user_id,
+                'filename': filename,
+                'ext': filename.rsplit('.', 1)[1].lower(),
+                'size': size,
+                'offset': 0,
+                'chunks': 0,
+                'temp_path': temp_path,
+                'status': 'open',
+                'writing_since': None,
+                'created_at': now,
+                'expires_at': UploadSessionService._expires_at()
+            }
+            mongodb.get_collection(UPLOAD_SESSIONS_COLLECTION).insert_one(session)
+            
+            logger.info(
+                f"Upload session {session_id} created for user {user_id}: {filename} ({size} bytes)"
+            )
+            return success_response(
+                "Upload session created", UploadSessionService._format_session(session), 201
+            )
+        
+        except Exception as e:
+            logger.error(f"Error creating upload session: {str(e)}")
+            return error_response("Failed to create upload session", 500)
+    
+    @staticmethod
+    def get_session(upload_id: str, user_id: str) -> tuple:
+        session = UploadSessionService._find_session(upload_id, user_id)
+        if not session:
+            return error_response("Upload session not found", 404)
+        return success_response(
+            "Upload session retrieved", UploadSessionService._format_session(session)
+        )
+    
+    @staticmethod
+    def write_chunk(
+        upload_id: str,
+        user_id: str,
+        offset: int,
+        stream,
+        length: Optional[int],
+        checksum: Optional[str] = None
+    ) -> tuple:
+        """
+        Write one chunk at offset.
+        
+        The session's offset only advances after the chunk has been fully
+        received, matched its checksum (if given) and been flushed to disk, so
+        a failed chunk is simply sent again from the same offset.
+        """
+        sessions_collection = mongodb.get_collection(UPLOAD_SESSIONS_COLLECTION)
+        session = UploadSessionService._find_session(upload_id, user_id)
+        if not session:
+            return error_response("Upload session not found", 404)
+        if session['status'] != 'open':
+            return error_response("Upload session is being completed", 409)
+        
+        if offset != session['offset']:
+            return error_response(
+                f"Offset mismatch: expected {session['offset']}", 409, {'offset': session['offset']}
+            )
+        if length is None:
+            return error_response("Content-Length is required", 411)
+        max_chunk = current_app.config.get('UPLOAD_CHUNK_MAX_SIZE', 16 * 1024 * 1024)
+        if length <= 0 or length > max_chunk:
+            return error_response(f"Chunk size must be between 1 and {max_chunk} bytes", 400)
+        if offset + length > session['size']:
+            return error_response("Chunk extends past the declared file size", 400)
+        
+        expected_digest = None
+        if checksum:
+            try:
+                expected_digest = _parse_checksum(checksum)
+            except ValueError as e:
+                return error_response(str(e), 400)
+        
+        # Claim the offset so concurrent retries of a chunk cannot interleave writes
+        now = datetime.utcnow()
+        claimed = sessions_collection.find_one_and_update(
+            {
+                '_id': session['_id'],
+                'status': 'open',
+                'offset': offset,
+                '$or': [
+                    {'writing_since': None},
+                    {'writing_since': {'$lt': now - timedelta(seconds=STALE_WRITE_SECONDS)}}
+                ]
+            },
+            {'$set': {'writing_since': now}}
+        )
+        if claimed is None:
+            return error_response("Another chunk is being written to this session", 409)
+        
+        try:
+            digest = hashlib.sha256()
+            received = 0
+            with open(session['temp_path'], 'r+b') as target:
+                target.seek(offset)
+                while received < length:
+                    data = stream.read(min(WRITE_BUFFER_SIZE, length - received))
+                    if not data:
+                        break
+                    digest.update(data)
+                    target.write(data)
+                    received += len(data)
+                target.flush()
+                os.fsync(target.fileno())
+        except Exception:
+            UploadSessionService._release(session)
+            raise
+        
+        if received != length:
+            UploadSessionService._release(session)
+            return error_response(
+                f"Incomplete chunk: received {received} of {length} bytes", 400, {'offset': offset}
+            )
+        if expected_digest is not None and digest.digest() != expected_digest:
+            UploadSessionService._release(session)
+            return error_response("Chunk checksum mismatch", 400, {'offset': offset})
+        
+        new_offset = offset + length
+        sessions_collection.update_one(
+            {'_id': session['_id'], 'offset': offset},
+            {
+                '$set': {
+                    'offset': new_offset,
+                    'writing_since': None,
+                    'expires_at': UploadSessionService._expires_at()
+                },
+                '$inc': {'chunks': 1}
+            }
+        )
+        
+        return success_response(
+            "Chunk stored", {'upload_id': upload_id, 'offset': new_offset, 'size': session['size']}
+        )
+    
+    @staticmethod
+    def complete_session(upload_id: str, user_id: str) -> tuple:
+        """Validate the assembled file and hand it to the normal extraction path."""
+        sessions_collection = mongodb.get_collection(UPLOAD_SESSIONS_COLLECTION)
+        session = UploadSessionService._find_session(upload_id, user_id)
+        if not session:
+            return error_response("Upload session not found", 404)
+        if session['offset'] != session['size']:
+            return error_response(
+                f"Upload incomplete: {session['offset']} of {session['size']} bytes received",
+                409,
+                {'offset': session['offset']}
+            )
+        
+        session = sessions_collection.find_one_and_update(
+            {
+                '_id': session['_id'],
+                'status': 'open',
+                'offset': session['size'],
+                'writing_since': None
+            },
+            {'$set': {'status': 'completing'}}
+        )
+        if session is None:
+            return error_response("Upload session is being completed", 409)
+        
+        try:
+            with open(session['temp_path'], 'r+b') as assembled:
+                assembled.truncate(session['size'])
+                header = assembled.read(16)
+            
+            if not header.startswith(FILE_SIGNATURES[session['ext']]):
+                UploadSessionService._discard(session)
+                return error_response(
+                    f"File content does not match the .{session['ext']} extension", 400
+                )
+            
+            image_path = FileManager.store_temp_file(session['temp_path'], session['ext'])
+        except Exception as e:
+            logger.error(f"Error completing upload session {upload_id}: {str(e)}")
+            UploadSessionService._discard(session)
+            return error_response("Failed to store uploaded file", 500)
+        
+        sessions_collection.delete_one({'_id': session['_id']})
+        logger.info(f"Upload session {upload_id} completed: {image_path}")
+        return ExpenseService.create_expense_from_file(user_id, image_path)
+    
+    @staticmethod
+    def abort_session(upload_id: str, user_id: str) -> tuple:
+        session = UploadSessionService._find_session(upload_id, user_id)
+        if not session:
+            return error_response("Upload session not found", 404)
+        if session['status'] != 'open':
+            return error_response("Upload session is being completed", 409)
+        
+        UploadSessionService._discard(session)
+        return success_response("Upload cancelled")
+    
+    @staticmethod
+    def purge_stale_files() -> int:
+        """
+        Remove session files whose session has expired.
+        
+        Session documents are removed by the TTL index; their files are not.
+        
+        Returns:
+            Number of files removed
+        """
+        folder = _session_folder()
+        ttl_hours = current_app.config.get('UPLOAD_SESSION_TTL_HOURS', 24)
+        ttl = timedelta(hours=ttl_hours).total_seconds()
+        sessions_collection = mongodb.get_collection(UPLOAD_SESSIONS_COLLECTION)
+        
+        removed = 0
+        for entry in os.scandir(folder):
+            name, _, ext = entry.name.partition('.')
+            if ext != 'part' or not entry.is_file():
+                continue
+            # Files of live sessions are touched on every chunk
+            if time.time() - entry.stat().st_mtime < ttl:
+                continue
+            if ObjectId.is_valid(name) and sessions_collection.count_documents(
+                {'_id': ObjectId(name)}, limit=1
+            ):
+                continue
+            os.remove(entry.path)
+            removed += 1
+        
+        logger.info(f"Removed {removed} expired upload session file(s)")
+        return removed
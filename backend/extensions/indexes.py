@@ -0,0 +1,183 @@
+from pymongo import ASCENDING, DESCENDING, TEXT
+from typing import Dict, Any, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Search: one text index per collection (vendor weighted above OCR text),
+# plus a multikey index for prefix matches on search_tokens
+SEARCH_INDEXES = [
+    {
+        'keys': [('extracted_data.Details', TEXT), ('category', TEXT), ('ocr_text', TEXT)],
+        'name': 'expense_search_text',
+        'weights': {'extracted_data.Details': 10, 'category': 5, 'ocr_text': 1},
+        'default_language': 'english'
+    },
+    {'keys': [('search_tokens', ASCENDING)]}
+]
+
+# Duplicate detection: perceptual hash bands and exact bill fields
+DUPLICATE_INDEXES = [
+    {'keys': [('hash_bands', ASCENDING)]},
+    {'keys': [('amount_inr', ASCENDING), ('bill_date', ASCENDING), ('vendor_key', ASCENDING)]}
+]
+
+# Declarative index set, applied with `flask --app app jobs apply-indexes`.
+# Each entry is a key list plus create_index options. Single-field indexes
+# that are a prefix of a compound index below are intentionally omitted.
+INDEX_MANIFEST: Dict[str, List[Dict[str, Any]]] = {
+    'users': [
+        {'keys': [('email', ASCENDING)], 'unique': True},
+        {'keys': [('role', ASCENDING)]}
+    ],
+    'expenses': [
+        # Per-user lists sorted by upload time
+        {'keys': [('user_id', ASCENDING), ('created_at', DESCENDING)]},
+        # Per-user lists filtered by status and bill date
+        {'keys': [('user_id', ASCENDING), ('status', ASCENDING), ('bill_date', DESCENDING)]},
+        # HR lists and summaries: status + created_at without user_id
+        {'keys': [
+            ('status', ASCENDING), ('created_at', DESCENDING), ('user_id', ASCENDING),
+            ('category', ASCENDING), ('amount_inr', ASCENDING)
+        ]},
+        # HR lists without a status filter
+        {'keys': [('created_at', ASCENDING)]},
+        {'keys': [('bill_date', ASCENDING)]},
+        # HR review queue of possible duplicates
+        {
+            'keys': [('created_at', DESCENDING)],
+            'name': 'flagged_duplicates',
+            'partialFilterExpression': {'duplicates': {'$exists': True}}
+        },
+        # Storage reconciliation walks expenses in image_path order
+        {'keys': [('image_path', ASCENDING)]},
+        # Originals kept by recompress-receipts, walked the same way
+        {'keys': [('original_image_path', ASCENDING)], 'sparse': True},
+        *SEARCH_INDEXES,
+        *DUPLICATE_INDEXES
+    ],
+    'expenses_archive': [
+        {'keys': [('user_id', ASCENDING), ('created_at', DESCENDING)]},
+        {'keys': [('status', ASCENDING), ('created_at', DESCENDING)]},
+        {'keys': [('created_at', ASCENDING)]},
+        {'keys': [('user_id', ASCENDING), ('status', ASCENDING), ('bill_date', DESCENDING)]},
+        {'keys': [('image_path', ASCENDING)]},
+        {'keys': [('original_image_path', ASCENDING)], 'sparse': True},
+        *SEARCH_INDEXES,
+        *DUPLICATE_INDEXES
+    ],
+    'monthly_rollups': [
+        {'keys': [('month', ASCENDING), ('status', ASCENDING)]}
+    ],
+    'rollup_dirty': [
+        {'keys': [('dirty_at', ASCENDING)]}
+    ],
+    'report_jobs': [
+        # Queue claims take the oldest queued job
+        {'keys': [('status', ASCENDING), ('created_at', ASCENDING)]},
+        {'keys': [('expires_at', ASCENDING)]}
+    ],
+    'upload_sessions': [
+        # Abandoned resumable uploads expire on their own
+        {'keys': [('expires_at', ASCENDING)], 'expireAfterSeconds': 0}
+    ]
+}
+
+# Options compared against existing indexes; others (e.g. name) are ignored
+COMPARED_OPTIONS = ('unique', 'sparse', 'expireAfterSeconds', 'partialFilterExpression', 'weights')
+
+def _key_spec(keys) -> tuple:
+    # The server may report directions as floats (1.0); text fields are
+    # compared as a set, in field order
+    text_fields = sorted(field for field, direction in keys if direction == TEXT)
+    return tuple(
+        (field, int(direction) if isinstance(direction, (int, float)) else direction)
+        for field, direction in keys if direction != TEXT
+    ) + tuple((field, TEXT) for field in text_fields)
+
+def _existing_key_spec(info: Dict[str, Any]) -> tuple:
+    """Key spec of an existing index as it would be declared in the manifest."""
+    if 'weights' not in info:
+        return _key_spec(info['key'])
+    # Text indexes are reported as _fts/_ftsx; the text fields are the weights
+    keys = [
+        (field, direction) for field, direction in info['key'] if field not in ('_fts', '_ftsx')
+    ]
+    return _key_spec(keys + [(field, TEXT) for field in info['weights']])
+
+def _options(spec: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        option: dict(spec[option]) if isinstance(spec[option], dict) else spec[option]
+        for option in COMPARED_OPTIONS if spec.get(option) not in (None, False)
+    }
+
+def plan_indexes(
+    db,
+    manifest: Dict[str, List[Dict[str, Any]]] = INDEX_MANIFEST
+) -> Dict[str, Dict[str, list]]:
+    """
+    Compare the manifest with the indexes that exist in the database.
+    
+    Returns:
+        Per collection: 'create' (manifest specs missing from the database),
+        'conflict' (same keys, different options) and 'unlisted' (existing
+        index names not in the manifest)
+    """
+    plan = {}
+    for collection_name, specs in manifest.items():
+        existing = {
+            _existing_key_spec(info): (name, _options(info))
+            for name, info in db[collection_name].index_information().items()
+        }
+        
+        create, conflict, listed = [], [], set()
+        for spec in specs:
+            keys = _key_spec(spec['keys'])
+            if keys not in existing:
+                create.append(spec)
+                continue
+            
+            name, options = existing[keys]
+            listed.add(name)
+            if options != _options(spec):
+                conflict.append({'name': name, 'existing': options, 'manifest': _options(spec)})
+        
+        unlisted = [name for name, _ in existing.values() if name != '_id_' and name not in listed]
+        plan[collection_name] = {'create': create, 'conflict': conflict, 'unlisted': unlisted}
+    
+    return plan
+
+def apply_indexes(
+    db,
+    drop_unlisted: bool = False,
+    dry_run: bool = False
+) -> Dict[str, Dict[str, list]]:
+    """
+    Create manifest indexes that are missing, optionally dropping unlisted ones.
+    
+    Conflicting indexes are only reported; changing their options needs a
+    manual drop so it is never done implicitly.
+    """
+    plan = plan_indexes(db)
+    if dry_run:
+        return plan
+    
+    for collection_name, changes in plan.items():
+        collection = db[collection_name]
+        for spec in changes['create']:
+            options = {key: value for key, value in spec.items() if key != 'keys'}
+            name = collection.create_index(spec['keys'], **options)
+            logger.info(f"Created index {collection_name}.{name}")
+        
+        if drop_unlisted:
+            for name in changes['unlisted']:
+                collection.drop_index(name)
+                logger.info(f"Dropped index {collection_name}.{name}")
+        
+        for conflict in changes['conflict']:
+            logger.warning(
+                f"Index {collection_name}.{conflict['name']} has options {conflict['existing']}, "
+                f"manifest expects {conflict['manifest']}"
+            )
+    
+    return plan
@@ -1,6 +1,7 @@
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
 from flask import current_app
+from extensions.profiler import query_profiler
 import logging
 
 logger = logging.getLogger(__name__)
@@ -26,18 +27,21 @@ class MongoDB:
             logger.info(f"Connecting to MongoDB: {db_name}")
             logger.debug(f"MongoDB URI: {mongo_uri[:50]}..." if len(mongo_uri) > 50 else f"MongoDB URI: {mongo_uri}")
             
+            query_profiler.init_app(app)
+            
             self.client = MongoClient(
                 mongo_uri,
                 serverSelectionTimeoutMS=10000,
                 connectTimeoutMS=10000,
-                socketTimeoutMS=10000
+                socketTimeoutMS=10000,
+                event_listeners=[query_profiler] if query_profiler.enabled else []
             )
             
             self.client.admin.command('ping')
             self.db = self.client[db_name]
+            query_profiler.attach(self.client, db_name)
             
             logger.info(f"Successfully connected to MongoDB: {db_name}")
-            self._create_indexes()
             
         except (ConnectionFailure, ServerSelectionTimeoutError) as e:
             logger.error(f"Failed to connect to MongoDB: {str(e)}")
@@ -51,24 +55,6 @@ class MongoDB:
             logger.error(f"MongoDB initialization error: {str(e)}", exc_info=True)
             raise
     
-    def _create_indexes(self):
-        try:
-            users_collection = self.db.users
-            users_collection.create_index("email", unique=True)
-            users_collection.create_index("role")
-            
-            expenses_collection = self.db.expenses
-            expenses_collection.create_index("user_id")
-            expenses_collection.create_index("status")
-            expenses_collection.create_index("created_at")
-            expenses_collection.create_index([("user_id", 1), ("status", 1)])
-            expenses_collection.create_index([("user_id", 1), ("created_at", -1)])
-            
-            logger.info("Database indexes created successfully")
-            
-        except Exception as e:
-            logger.warning(f"Error creating indexes: {str(e)}")
-    
     def get_db(self):
         if self.db is None:
             raise RuntimeError("Database not initialized. Call init_app first.")
@@ -0,0 +1,280 @@
+from pymongo import monitoring
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, Optional
+import threading
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROFILED_COMMANDS = {'find', 'aggregate', 'count', 'distinct', 'update', 'delete', 'findAndModify'}
+
+# Envelope fields that explain does not accept
+EXPLAIN_STRIPPED_FIELDS = {
+    'lsid', 'txnNumber', 'autocommit', 'startTransaction', '$db', '$clusterTime',
+    '$readPreference', 'readConcern', 'writeConcern', 'apiVersion', 'apiStrict',
+    'apiDeprecationErrors', 'ordered', 'bypassDocumentValidation'
+}
+
+MAX_SHAPES = 500
+
+def _shape(value: Any) -> Any:
+    """Replace literal values with '?' while keeping field names and operators."""
+    if isinstance(value, dict):
+        return {key: _shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(item, dict) for item in value):
+            return [_shape(item) for item in value]
+        return '?'
+    return '?'
+
+def query_shape(command_name: str, command: Dict[str, Any]) -> Optional[str]:
+    """
+    Identify a command by collection, operation and the structure of its filter.
+    
+    Two finds with the same filter fields and sort but different values share
+    a shape.
+    """
+    collection = command.get(command_name)
+    if not isinstance(collection, str):
+        return None
+    
+    if command_name == 'aggregate':
+        pipeline = command.get('pipeline') or []
+        stages = [next(iter(stage), '') for stage in pipeline]
+        first_match = pipeline[0].get('$match') if pipeline and '$match' in pipeline[0] else None
+        detail = {'stages': stages, 'match': _shape(first_match or {})}
+    elif command_name in ('update', 'delete'):
+        statements = command.get('updates' if command_name == 'update' else 'deletes') or [{}]
+        detail = {'filter': _shape(statements[0].get('q') or {})}
+    elif command_name == 'findAndModify':
+        detail = {
+            'filter': _shape(command.get('query') or {}),
+            'sort': _shape(command.get('sort') or {})
+        }
+    else:
+        detail = {'filter': _shape(command.get('filter') or command.get('query') or {})}
+        if command.get('sort'):
+            detail['sort'] = list(command['sort'].items())
+    
+    return f"{collection}.{command_name} {json.dumps(detail, sort_keys=True, default=str)}"
+
+def _explain_command(command_name: str, command: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Build the command to explain, or None for operations that cannot be explained safely."""
+    if command_name == 'aggregate':
+        if any(('$out' in stage or '$merge' in stage) for stage in command.get('pipeline') or []):
+            return None
+    
+    explained = {key: value for key, value in command.items() if key not in EXPLAIN_STRIPPED_FIELDS}
+    # explain accepts a single write statement
+    if command_name == 'update':
+        explained['updates'] = explained.get('updates', [])[:1]
+    elif command_name == 'delete':
+        explained['deletes'] = explained.get('deletes', [])[:1]
+    return explained
+
+def _find_value(document: Any, key: str) -> Any:
+    """First value stored under key anywhere in a nested explain document."""
+    if isinstance(document, dict):
+        if key in document:
+            return document[key]
+        items = document.values()
+    elif isinstance(document, list):
+        items = document
+    else:
+        return None
+    
+    for item in items:
+        found = _find_value(item, key)
+        if found is not None:
+            return found
+    return None
+
+def _plan_stages(document: Any) -> set:
+    stages = set()
+    if isinstance(document, dict):
+        if isinstance(document.get('stage'), str):
+            stages.add(document['stage'])
+        for item in document.values():
+            stages |= _plan_stages(item)
+    elif isinstance(document, list):
+        for item in document:
+            stages |= _plan_stages(item)
+    return stages
+
+class QueryProfiler(monitoring.CommandListener):
+    """
+    Per-query-shape latency collector.
+    
+    Commands are grouped by query_shape. The first execution of each shape,
+    and any execution slower than slow_ms (at most once per explain_interval
+    seconds per shape), is explained in a background thread to record docs
+    examined and whether the winning plan uses an index.
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.slow_ms = 100
+        self.explain_interval = 60
+        self.client = None
+        self.db_name = None
+        self._pending: Dict[int, tuple] = {}
+        self._shapes: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._started_at = datetime.utcnow()
+    
+    def init_app(self, app) -> None:
+        self.enabled = app.config.get('QUERY_PROFILER_ENABLED', False)
+        self.slow_ms = app.config.get('SLOW_QUERY_MS', 100)
+        if self.enabled:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='query-explain')
+            logger.info(f"Query profiler enabled (slow query threshold {self.slow_ms} ms)")
+    
+    def attach(self, client, db_name: str) -> None:
+        """Client used to run explain; set once the connection is established."""
+        self.client = client
+        self.db_name = db_name
+    
+    def started(self, event) -> None:
+        if not self.enabled or event.command_name not in PROFILED_COMMANDS:
+            return
+        shape = query_shape(event.command_name, event.command)
+        if shape:
+            with self._lock:
+                self._pending[event.request_id] = (
+                    shape, event.command_name, event.command, event.database_name
+                )
+    
+    def succeeded(self, event) -> None:
+        self._finish(event, failed=False)
+    
+    def failed(self, event) -> None:
+        self._finish(event, failed=True)
+    
+    def _finish(self, event, failed: bool) -> None:
+        if not self.enabled:
+            return
+        
+        with self._lock:
+            pending = self._pending.pop(event.request_id, None)
+            if pending is None:
+                return
+            shape, command_name, command, database_name = pending
+            duration_ms = event.duration_micros / 1000
+            
+            stats = self._shapes.get(shape)
+            if stats is None:
+                if len(self._shapes) >= MAX_SHAPES:
+                    return
+                stats = self._shapes[shape] = {
+                    'shape': shape,
+                    'count': 0,
+                    'errors': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'slow_count': 0,
+                    'docs_examined': None,
+                    'keys_examined': None,
+                    'returned': None,
+                    'plan_stages': None,
+                    'explained_at': 0.0
+                }
+            
+            stats['count'] += 1
+            stats['errors'] += int(failed)
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            
+            slow = duration_ms >= self.slow_ms
+            stats['slow_count'] += int(slow)
+            
+            now = time.monotonic()
+            first = stats['explained_at'] == 0.0
+            explain_due = slow and now - stats['explained_at'] >= self.explain_interval
+            explain = not failed and (first or explain_due)
+            if explain:
+                stats['explained_at'] = now
+        
+        if explain and self._executor is not None and self.client is not None:
+            self._executor.submit(
+                self._explain, shape, command_name, command, database_name, duration_ms, slow
+            )
+    
+    def _explain(self, shape: str, command_name: str, command, database_name: str,
+                 duration_ms: float, slow: bool) -> None:
+        explained = _explain_command(command_name, command)
+        if explained is None:
+            return
+        
+        try:
+            plan = self.client[database_name].command(
+                'explain', explained, verbosity='executionStats'
+            )
+        except Exception as e:
+            logger.debug(f"Could not explain {shape}: {str(e)}")
+            return
+        
+        stages = _plan_stages(_find_value(plan, 'winningPlan') or plan.get('stages') or {})
+        docs_examined = _find_value(plan, 'totalDocsExamined')
+        keys_examined = _find_value(plan, 'totalKeysExamined')
+        returned = _find_value(plan, 'nReturned')
+        
+        with self._lock:
+            stats = self._shapes.get(shape)
+            if stats is not None:
+                stats.update({
+                    'docs_examined': docs_examined,
+                    'keys_examined': keys_examined,
+                    'returned': returned,
+                    'plan_stages': sorted(stages)
+                })
+        
+        if slow:
+            winning_plan = plan.get('queryPlanner', {}).get('winningPlan', plan.get('stages'))
+            logger.warning(
+                f"Slow query ({duration_ms:.1f} ms): {shape} "
+                f"docsExamined={docs_examined} keysExamined={keys_examined} nReturned={returned} "
+                f"plan={json.dumps(winning_plan, default=str)}"
+            )
+    
+    def report(self, unindexed_only: bool = False) -> Dict[str, Any]:
+        """
+        Per-shape statistics for this worker, slowest total time first.
+        
+        A shape is unindexed when its winning plan contains a COLLSCAN.
+        """
+        with self._lock:
+            shapes = [dict(stats) for stats in self._shapes.values()]
+        
+        rows = []
+        for stats in shapes:
+            stages = stats.pop('plan_stages')
+            stats.pop('explained_at')
+            stats['avg_ms'] = (
+                round(stats['total_ms'] / stats['count'], 2) if stats['count'] else 0.0
+            )
+            stats['total_ms'] = round(stats['total_ms'], 2)
+            stats['max_ms'] = round(stats['max_ms'], 2)
+            stats['plan_stages'] = stages
+            stats['unindexed'] = None if stages is None else 'COLLSCAN' in stages
+            if unindexed_only and not stats['unindexed']:
+                continue
+            rows.append(stats)
+        
+        rows.sort(key=lambda row: row['total_ms'], reverse=True)
+        return {
+            'enabled': self.enabled,
+            'slow_query_ms': self.slow_ms,
+            'since': self._started_at,
+            'shapes': rows
+        }
+    
+    def reset(self) -> None:
+        with self._lock:
+            self._shapes.clear()
+            self._started_at = datetime.utcnow()
+
+query_profiler = QueryProfiler()
@@ -1,7 +1,13 @@
 from flask import Blueprint, request
 from expenses.service import ExpenseService
 from utils.jwt import require_role
-from utils.responses import error_response
+from expenses.filters import parse_filter_args, parse_search_query, parse_page_args
+from expenses.models import ExpenseModel
+from expenses.rollups import RollupService, ROLLUP_DIMENSIONS, MONTH_PATTERN
+from extensions.profiler import query_profiler
+from storage.reconcile import StorageReconciler
+from expenses.report_jobs import ReportJobService
+from utils.responses import success_response, error_response
 from datetime import datetime
 import logging
 
@@ -9,56 +15,136 @@ logger = logging.getLogger(__name__)
 
 hr_bp = Blueprint('hr', __name__, url_prefix='/hr')
 
+MAX_INDIVIDUAL_UPDATES = 1000
+
 @hr_bp.route('/expenses', methods=['GET'])
 @require_role('HR')
 def get_all_expenses():
     try:
-        user_id = request.args.get('user_id')
-        status = request.args.get('status')
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
-        
-        parsed_date_from = None
-        parsed_date_to = None
+        filters, error_msg = parse_filter_args(request.args)
+        if error_msg:
+            return error_response(error_msg, 400)
         
-        if date_from:
-            try:
-                parsed_date_from = datetime.fromisoformat(date_from.replace('Z', '+00:00'))
-            except ValueError:
-                return error_response("Invalid date_from format. Use ISO format (YYYY-MM-DDTHH:MM:SS)", 400)
+        fields, error_msg = ExpenseModel.parse_fields(request.args.get('fields'))
+        if error_msg:
+            return error_response(error_msg, 400)
         
-        if date_to:
-            try:
-                parsed_date_to = datetime.fromisoformat(date_to.replace('Z', '+00:00'))
-            except ValueError:
-                return error_response("Invalid date_to format. Use ISO format (YYYY-MM-DDTHH:MM:SS)", 400)
-        
-        return ExpenseService.get_all_expenses(
-            user_id=user_id,
-            status=status,
-            date_from=parsed_date_from,
-            date_to=parsed_date_to
-        )
+        return ExpenseService.get_all_expenses(fields=fields, **filters)
         
     except Exception as e:
         logger.error(f"Get all expenses route error: {str(e)}")
         return error_response("Failed to retrieve expenses", 500)
 
+@hr_bp.route('/expenses/search', methods=['GET'])
+@require_role('HR')
+def search_expenses():
+    try:
+        try:
+            terms, prefixes = parse_search_query(request.args.get('q'))
+        except ValueError as e:
+            return error_response(str(e), 400)
+        
+        filters, error_msg = parse_filter_args(request.args)
+        if error_msg:
+            return error_response(error_msg, 400)
+        
+        page, per_page, error_msg = parse_page_args(request.args)
+        if error_msg:
+            return error_response(error_msg, 400)
+        
+        fields, error_msg = ExpenseModel.parse_fields(request.args.get('fields'))
+        if error_msg:
+            return error_response(error_msg, 400)
+        
+        return ExpenseService.search_expenses(
+            terms, prefixes, page, per_page, fields=fields, include_user_email=True, **filters
+        )
+        
+    except Exception as e:
+        logger.error(f"Search expenses route error: {str(e)}", exc_info=True)
+        return error_response("Failed to search expenses", 500)
+
+@hr_bp.route('/expenses/duplicates', methods=['GET'])
+@require_role('HR')
+def get_flagged_duplicates():
+    try:
+        page, per_page, error_msg = parse_page_args(request.args)
+        if error_msg:
+            return error_response(error_msg, 400)
+        
+        fields, error_msg = ExpenseModel.parse_fields(request.args.get('fields'))
+        if error_msg:
+            return error_response(error_msg, 400)
+        
+        return ExpenseService.get_flagged_duplicates(page, per_page, fields=fields)
+        
+    except Exception as e:
+        logger.error(f"Get flagged duplicates route error: {str(e)}", exc_info=True)
+        return error_response("Failed to retrieve flagged expenses", 500)
+
+@hr_bp.route('/expenses/summary', methods=['GET'])
+@require_role('HR')
+def get_expenses_summary():
+    try:
+        filters, error_msg = parse_filter_args(request.args)
+        if error_msg:
+            return error_response(error_msg, 400)
+        
+        try:
+            top = min(max(int(request.args.get('top', 10)), 1), 50)
+        except ValueError:
+            return error_response("top must be an integer", 400)
+        
+        return ExpenseService.get_expenses_summary(top=top, **filters)
+        
+    except Exception as e:
+        logger.error(f"Get expenses summary route error: {str(e)}", exc_info=True)
+        return error_response("Failed to retrieve expense summary", 500)
+
 @hr_bp.route('/expenses/bulk-update', methods=['POST'])
 @require_role('HR')
 def bulk_update_expenses():
     try:
         data = request.get_json()
-        expense_ids = data.get('expense_ids', [])
+        if not data:
+            return error_response("Request body is required", 400)
+        
+        if 'updates' in data:
+            updates = data.get('updates')
+            if not updates or not isinstance(updates, list):
+                return error_response("updates array is required", 400)
+            if len(updates) > MAX_INDIVIDUAL_UPDATES:
+                return error_response(f"At most {MAX_INDIVIDUAL_UPDATES} updates per request", 400)
+            return ExpenseService.bulk_update_individual(updates)
+        
         status = data.get('status')
         notes = data.get('notes')
         
-        if not expense_ids or not isinstance(expense_ids, list):
-            return error_response("expense_ids array is required", 400)
-        
         if not status or status not in ['approved', 'rejected', 'pending']:
             return error_response("Valid status is required (approved, rejected, or pending)", 400)
         
+        if 'filter' in data:
+            filter_data = data.get('filter')
+            if not isinstance(filter_data, dict) or not filter_data:
+                return error_response("filter must be a non-empty object", 400)
+            
+            filters, error_msg = parse_filter_args(filter_data)
+            if error_msg:
+                return error_response(error_msg, 400)
+            
+            try:
+                batch_size = min(max(int(data.get('batch_size', 500)), 1), 5000)
+            except (TypeError, ValueError):
+                return error_response("batch_size must be an integer", 400)
+            
+            return ExpenseService.bulk_update_by_filter(
+                filters, status, notes, dry_run=bool(data.get('dry_run')), batch_size=batch_size
+            )
+        
+        expense_ids = data.get('expense_ids', [])
+        if not expense_ids or not isinstance(expense_ids, list):
+            return error_response("expense_ids array, filter or updates is required", 400)
+        
         result = ExpenseService.bulk_update_status(expense_ids, status, notes)
         return result
         
@@ -71,33 +157,69 @@ def bulk_update_expenses():
 def export_all_expenses():
     try:
         format_type = request.args.get('format', 'excel')
-        status = request.args.get('status')
-        user_id = request.args.get('user_id')
-        date_from = request.args.get('date_from')
-        date_to = request.args.get('date_to')
-        
-        parsed_date_from = None
-        parsed_date_to = None
-        
-        if date_from:
-            try:
-                parsed_date_from = datetime.fromisoformat(date_from.replace('Z', '+00:00'))
-            except ValueError:
-                pass
-        
-        if date_to:
-            try:
-                parsed_date_to = datetime.fromisoformat(date_to.replace('Z', '+00:00'))
-            except ValueError:
-                pass
+        filters, _ = parse_filter_args(request.args, strict=False)
         
-        result = ExpenseService.export_all_expenses(format_type, status, user_id, parsed_date_from, parsed_date_to)
+        result = ExpenseService.export_all_expenses(format_type, **filters)
         return result
         
     except Exception as e:
         logger.error(f"Export all expenses route error: {str(e)}", exc_info=True)
         return error_response("Failed to export expenses", 500)
 
+@hr_bp.route('/expenses/receipts.zip', methods=['GET'])
+@require_role('HR')
+def export_receipts_zip():
+    try:
+        filters, error_msg = parse_filter_args(request.args)
+        if error_msg:
+            return error_response(error_msg, 400)
+        
+        return ExpenseService.export_receipts_zip(**filters)
+        
+    except Exception as e:
+        logger.error(f"Export receipts route error: {str(e)}", exc_info=True)
+        return error_response("Failed to export receipts", 500)
+
+@hr_bp.route('/expenses/reimbursement-pack.pdf', methods=['GET'])
+@require_role('HR')
+def export_reimbursement_pack():
+    try:
+        filters, error_msg = parse_filter_args(request.args)
+        if error_msg:
+            return error_response(error_msg, 400)
+        
+        # Raw values are kept so a queued job parses them the same way
+        filter_args = {key: request.args[key] for key in filters if request.args.get(key)}
+        run_async = request.args.get('async', 'false').lower() == 'true'
+        
+        return ExpenseService.export_reimbursement_pack(
+            filters, filter_args, request.current_user['user_id'], run_async
+        )
+        
+    except Exception as e:
+        logger.error(f"Export reimbursement pack route error: {str(e)}", exc_info=True)
+        return error_response("Failed to export reimbursement pack", 500)
+
+@hr_bp.route('/report-jobs/<job_id>', methods=['GET'])
+@require_role('HR')
+def get_report_job(job_id):
+    try:
+        return ReportJobService.get_job(job_id)
+        
+    except Exception as e:
+        logger.error(f"Get report job route error: {str(e)}", exc_info=True)
+        return error_response("Failed to retrieve report job", 500)
+
+@hr_bp.route('/report-jobs/<job_id>/download', methods=['GET'])
+@require_role('HR')
+def download_report(job_id):
+    try:
+        return ReportJobService.download(job_id)
+        
+    except Exception as e:
+        logger.error(f"Download report route error: {str(e)}", exc_info=True)
+        return error_response("Failed to download report", 500)
+
 @hr_bp.route('/expenses/<expense_id>/status', methods=['PATCH'])
 @require_role('HR')
 def update_expense_status(expense_id):
@@ -109,13 +231,77 @@ def update_expense_status(expense_id):
         
         status = data.get('status')
         notes = data.get('notes')
+        version = data.get('version')
         
         if not status:
             return error_response("Status is required", 400)
         
-        return ExpenseService.update_expense_status(expense_id, status, notes)
+        if version is not None and (not isinstance(version, int) or isinstance(version, bool)):
+            return error_response("version must be an integer", 400)
+        
+        return ExpenseService.update_expense_status(expense_id, status, notes, version)
         
     except Exception as e:
         logger.error(f"Update expense status route error: {str(e)}")
         return error_response("Failed to update expense status", 500)
 
+@hr_bp.route('/rollups', methods=['GET'])
+@require_role('HR')
+def get_rollups():
+    try:
+        now = datetime.utcnow()
+        month_from = request.args.get('from', f"{now.year - 1}-{now.month:02d}")
+        month_to = request.args.get('to', f"{now.year}-{now.month:02d}")
+        group_by = request.args.get('group_by')
+        status = request.args.get('status')
+        
+        if not MONTH_PATTERN.match(month_from) or not MONTH_PATTERN.match(month_to):
+            return error_response("from and to must use YYYY-MM format", 400)
+        
+        if group_by and group_by not in ROLLUP_DIMENSIONS:
+            return error_response(
+                f"Invalid group_by. Must be one of: {', '.join(ROLLUP_DIMENSIONS)}", 400
+            )
+        
+        rows = RollupService.get_trends(month_from, month_to, group_by, status)
+        return success_response(
+            "Rollups retrieved successfully",
+            {'from': month_from, 'to': month_to, 'group_by': group_by, 'rows': rows}
+        )
+        
+    except Exception as e:
+        logger.error(f"Get rollups route error: {str(e)}", exc_info=True)
+        return error_response("Failed to retrieve rollups", 500)
+
+@hr_bp.route('/query-profile', methods=['GET'])
+@require_role('HR')
+def get_query_profile():
+    try:
+        unindexed_only = request.args.get('unindexed', 'false').lower() == 'true'
+        report = query_profiler.report(unindexed_only=unindexed_only)
+        
+        if request.args.get('reset', 'false').lower() == 'true':
+            query_profiler.reset()
+        
+        return success_response("Query profile retrieved successfully", report)
+        
+    except Exception as e:
+        logger.error(f"Get query profile route error: {str(e)}", exc_info=True)
+        return error_response("Failed to retrieve query profile", 500)
+
+@hr_bp.route('/storage-usage', methods=['GET'])
+@require_role('HR')
+def get_storage_usage():
+    try:
+        try:
+            top = min(max(int(request.args.get('top', 20)), 1), 100)
+        except ValueError:
+            return error_response("top must be an integer", 400)
+        
+        return success_response(
+            "Storage usage retrieved successfully", StorageReconciler.get_usage(top=top)
+        )
+        
+    except Exception as e:
+        logger.error(f"Get storage usage route error: {str(e)}", exc_info=True)
+        return error_response("Failed to retrieve storage usage", 500)
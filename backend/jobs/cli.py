@@ -0,0 +1,251 @@
+from flask import current_app
+from flask.cli import AppGroup
+from jobs.migrations import (
+    backfill_typed_fields, backfill_search_tokens, backfill_duplicate_index,
+    migrate_to_content_store, sync_to_storage
+)
+from users.stats import UserStatsService
+from expenses.archive import ArchiveService
+from expenses.rollups import RollupService
+from expenses.uploads import UploadSessionService
+from storage.reconcile import StorageReconciler
+from storage.recompress import ReceiptRecompressor
+from expenses.report_jobs import ReportJobService, PACK_TITLE
+from expenses.reimbursement_pack import ReimbursementPack
+from expenses.filters import parse_filter_args
+from extensions.mongodb import mongodb
+from extensions.indexes import apply_indexes
+import click
+import time
+
+jobs_cli = AppGroup('jobs', help='Maintenance and background jobs.')
+
+@jobs_cli.command('backfill-typed-fields')
+@click.option('--batch-size', default=500, show_default=True, help='Expenses per batch.')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between batches.')
+def backfill_typed_fields_command(batch_size, pause):
+    """Store normalized amount, currency, category and bill date on existing expenses."""
+    updated = backfill_typed_fields(batch_size=batch_size, pause=pause)
+    click.echo(f"Backfilled typed fields on {updated} expense(s)")
+
+@jobs_cli.command('backfill-search-tokens')
+@click.option('--batch-size', default=500, show_default=True, help='Expenses per batch.')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between batches.')
+def backfill_search_tokens_command(batch_size, pause):
+    """Store search tokens on expenses created before search was added."""
+    updated = backfill_search_tokens(batch_size=batch_size, pause=pause)
+    click.echo(f"Backfilled search tokens on {updated} expense(s)")
+
+@jobs_cli.command('backfill-duplicate-index')
+@click.option('--batch-size', default=200, show_default=True, help='Expenses per batch.')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between batches.')
+def backfill_duplicate_index_command(batch_size, pause):
+    """Hash existing receipts and flag probable duplicate claims."""
+    fingerprinted, flagged = backfill_duplicate_index(batch_size=batch_size, pause=pause)
+    click.echo(
+        f"Fingerprinted {fingerprinted} expense(s), flagged {flagged} as possible duplicates"
+    )
+
+@jobs_cli.command('migrate-content-store')
+@click.option('--batch-size', default=200, show_default=True, help='Expenses per batch.')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between batches.')
+def migrate_content_store_command(batch_size, pause):
+    """Move existing receipts into the content-addressed store and rewrite image_path."""
+    migrated, missing = migrate_to_content_store(batch_size=batch_size, pause=pause)
+    click.echo(f"Migrated {migrated} expense(s); {missing} file(s) missing")
+
+@jobs_cli.command('sync-storage')
+@click.option('--source', default=None, help='Local folder to upload. Defaults to UPLOAD_FOLDER.')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep every 200 uploads.')
+def sync_storage_command(source, pause):
+    """Upload local receipts to the configured storage backend (e.g. before switching to s3)."""
+    source = source or current_app.config.get('UPLOAD_FOLDER', 'uploads/expenses')
+    uploaded, skipped = sync_to_storage(source, pause=pause)
+    click.echo(f"Uploaded {uploaded} file(s); {skipped} already present")
+
+@jobs_cli.command('purge-upload-sessions')
+def purge_upload_sessions_command():
+    """Delete files left behind by expired resumable upload sessions."""
+    removed = UploadSessionService.purge_stale_files()
+    click.echo(f"Removed {removed} expired upload file(s)")
+
+@jobs_cli.command('reconcile-storage')
+@click.option('--dry-run', is_flag=True, help='Only report; do not quarantine or record usage.')
+@click.option('--min-age-hours', type=float, default=None, help='Defaults to GC_MIN_AGE_HOURS.')
+@click.option('--max-orphan-ratio', default=0.5, show_default=True,
+              help='Stop quarantining when more than this share of files look orphaned.')
+def reconcile_storage_command(dry_run, min_age_hours, max_orphan_ratio):
+    """Quarantine unreferenced receipts, report missing ones and record usage per user."""
+    if min_age_hours is None:
+        min_age_hours = current_app.config.get('GC_MIN_AGE_HOURS', 24)
+    
+    report = StorageReconciler.reconcile(
+        min_age_hours=min_age_hours,
+        dry_run=dry_run,
+        max_orphan_ratio=max_orphan_ratio
+    )
+    
+    click.echo(
+        f"{report['files']} file(s), {report['bytes']} bytes; "
+        f"{report['referenced_files']} referenced"
+    )
+    click.echo(
+        f"{report['orphans']} orphaned ({report['orphan_bytes']} bytes), "
+        f"{report['quarantined']} quarantined"
+    )
+    for key in report['orphan_examples']:
+        click.echo(f"  orphan {key}")
+    if report['quarantine_stopped']:
+        click.echo("Quarantine stopped: orphan ratio above --max-orphan-ratio")
+    click.echo(
+        f"{report['missing_files']} expense(s) missing their file, "
+        f"{report['missing_blobs']} blob record(s) without a file, "
+        f"{report['unreferenced_blobs']} file(s) referenced only by a blob record"
+    )
+    for missing in report['missing_examples']:
+        click.echo(f"  missing {missing['expense_id']} {missing['image_path']}")
+
+@jobs_cli.command('purge-quarantine')
+@click.option('--older-than-days', type=float, default=None, help='Defaults to GC_QUARANTINE_DAYS.')
+@click.option('--dry-run', is_flag=True, help='Only count the files.')
+def purge_quarantine_command(older_than_days, dry_run):
+    """Delete files quarantined by reconcile-storage more than N days ago."""
+    if older_than_days is None:
+        older_than_days = current_app.config.get('GC_QUARANTINE_DAYS', 7)
+    
+    deleted = StorageReconciler.purge_quarantine(older_than_days=older_than_days, dry_run=dry_run)
+    click.echo(f"{'Would delete' if dry_run else 'Deleted'} {deleted} quarantined file(s)")
+
+@jobs_cli.command('recompress-receipts')
+@click.option('--batch-size', default=50, show_default=True, help='Expenses per batch.')
+@click.option('--limit', type=int, default=None, help='Stop after this many expenses.')
+@click.option('--pause', default=0.0, show_default=True, help='Seconds to sleep between batches.')
+@click.option('--keep-pending-originals/--discard-originals', default=None,
+              help='Keep originals of pending expenses. '
+                   'Defaults to RECOMPRESS_KEEP_PENDING_ORIGINALS.')
+def recompress_receipts_command(batch_size, limit, pause, keep_pending_originals):
+    """Re-encode stored receipt photos at a capped resolution and swap them in."""
+    released = ReceiptRecompressor.release_originals()
+    click.echo(f"Released {released} original(s) of settled expenses")
+    
+    report = ReceiptRecompressor.recompress(
+        batch_size=batch_size,
+        limit=limit,
+        pause=pause,
+        keep_pending_originals=keep_pending_originals
+    )
+    click.echo(
+        f"Recompressed {report['recompressed']} receipt(s), skipped {report['skipped']}, "
+        f"failed {report['failed']}, changed during run {report['changed']}"
+    )
+    click.echo(f"{report['bytes_before']} -> {report['bytes_after']} bytes")
+
+@jobs_cli.command('rebuild-user-stats')
+def rebuild_user_stats_command():
+    """Recompute the user_stats collection from all expenses."""
+    written = UserStatsService.rebuild()
+    click.echo(f"Rebuilt statistics for {written} user(s)")
+
+@jobs_cli.command('archive-expenses')
+@click.option('--older-than-days', type=int, default=None, help='Defaults to ARCHIVE_AFTER_DAYS.')
+@click.option('--batch-size', default=200, show_default=True, help='Expenses per batch.')
+@click.option('--pause', default=0.5, show_default=True, help='Seconds to sleep between batches.')
+@click.option('--move-files/--keep-files', default=False, show_default=True,
+              help='Move receipts under UPLOAD_FOLDER/archive/.')
+@click.option('--compress/--no-compress', default=None,
+              help='Gzip moved receipts. Defaults to ARCHIVE_COMPRESS_FILES.')
+def archive_expenses_command(older_than_days, batch_size, pause, move_files, compress):
+    """Move old approved/rejected expenses into expenses_archive."""
+    if older_than_days is None:
+        older_than_days = current_app.config.get('ARCHIVE_AFTER_DAYS', 365)
+    if compress is None:
+        compress = current_app.config.get('ARCHIVE_COMPRESS_FILES', False)
+    
+    archived = ArchiveService.archive_settled_expenses(
+        older_than_days,
+        batch_size=batch_size,
+        pause=pause,
+        move_files=move_files,
+        compress_files=compress
+    )
+    click.echo(f"Archived {archived} expense(s)")
+
+@jobs_cli.command('refresh-rollups')
+@click.option('--all', 'refresh_all', is_flag=True, help='Mark every month dirty first.')
+@click.option('--interval', default=0, show_default=True,
+              help='Keep running, refreshing every N seconds.')
+def refresh_rollups_command(refresh_all, interval):
+    """Re-aggregate dirty months into monthly_rollups."""
+    if refresh_all:
+        marked = RollupService.mark_all_dirty()
+        click.echo(f"Marked {marked} month(s) dirty")
+    
+    while True:
+        refreshed = RollupService.refresh_dirty()
+        click.echo(f"Refreshed {refreshed} month(s)")
+        if not interval:
+            break
+        time.sleep(interval)
+
+@jobs_cli.command('run-report-jobs')
+@click.option('--interval', default=0, show_default=True,
+              help='Keep running, checking for queued jobs every N seconds.')
+def run_report_jobs_command(interval):
+    """Generate queued reports (e.g. large reimbursement packs) and purge expired ones."""
+    while True:
+        purged = ReportJobService.purge_expired()
+        ran = ReportJobService.run_pending()
+        if ran or purged:
+            click.echo(f"Ran {ran} report job(s), purged {purged} expired report(s)")
+        if not interval:
+            break
+        time.sleep(interval)
+
+@jobs_cli.command('reimbursement-pack')
+@click.option('--output', required=True, type=click.Path(dir_okay=False), help='PDF file to write.')
+@click.option('--user-id', default=None)
+@click.option('--status', default=None)
+@click.option('--bill-type', default=None)
+@click.option('--date-from', default=None, help='Upload time, ISO format.')
+@click.option('--date-to', default=None, help='Upload time, ISO format.')
+@click.option('--bill-date-from', default=None, help='Bill date, ISO format.')
+@click.option('--bill-date-to', default=None, help='Bill date, ISO format.')
+def reimbursement_pack_command(output, **filter_args):
+    """Write a reimbursement pack PDF (summary table and receipts) for the given filters."""
+    filter_args = {key: value for key, value in filter_args.items() if value}
+    filters, error_msg = parse_filter_args(filter_args)
+    if error_msg:
+        raise click.UsageError(error_msg)
+    
+    with open(output, 'wb') as target:
+        size, expense_count = ReimbursementPack.write_to(
+            target,
+            ReportJobService.pack_expenses(filters),
+            PACK_TITLE,
+            ReimbursementPack.describe_filters(filter_args)
+        )
+    click.echo(f"Wrote {expense_count} expense(s), {size} bytes to {output}")
+
+@jobs_cli.command('apply-indexes')
+@click.option('--dry-run', is_flag=True, help='Only report the changes.')
+@click.option('--drop-unlisted', is_flag=True, help='Drop indexes that are not in the manifest.')
+def apply_indexes_command(dry_run, drop_unlisted):
+    """Create the indexes declared in extensions/indexes.py."""
+    plan = apply_indexes(mongodb.get_db(), drop_unlisted=drop_unlisted, dry_run=dry_run)
+    
+    for collection_name, changes in plan.items():
+        for spec in changes['create']:
+            action = 'would create' if dry_run else 'created'
+            click.echo(f"{action} {collection_name} {spec['keys']}")
+        for name in changes['unlisted']:
+            action = 'dropped' if drop_unlisted and not dry_run else 'unlisted'
+            click.echo(f"{action} {collection_name}.{name}")
+        for conflict in changes['conflict']:
+            click.echo(
+                f"conflict {collection_name}.{conflict['name']}: "
+                f"existing {conflict['existing']}, manifest {conflict['manifest']}"
+            )
+    
+    if not dry_run:
+        created = sum(len(changes['create']) for changes in plan.values())
+        click.echo(f"Created {created} index(es)")
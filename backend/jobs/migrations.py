@@ -0,0 +1,280 @@
+from extensions.mongodb import mongodb
+from expenses.models import ExpenseModel
+from expenses.duplicates import DuplicateDetector, DUPLICATE_COLLECTIONS
+from storage.file_manager import FileManager
+from storage.backends import get_storage
+from pymongo import UpdateOne
+from typing import Dict, Any, Callable
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+MISSING_TYPED_FIELDS = {
+    '$or': [
+        {'amount_inr': {'$exists': False}},
+        {'bill_date': {'$exists': False}}
+    ]
+}
+
+MISSING_SEARCH_TOKENS = {'search_tokens': {'$exists': False}}
+
+MISSING_IMAGE_HASH = {'image_hash': {'$exists': False}}
+
+def _backfill(
+    collection_name: str,
+    missing: Dict[str, Any],
+    projection: Dict[str, int],
+    build_update: Callable[[Dict[str, Any]], Dict[str, Any]],
+    label: str,
+    batch_size: int,
+    pause: float
+) -> int:
+    """
+    Set derived fields on documents matching missing, in _id order.
+    
+    Walks the collection in _id order so it can run while the app is serving
+    traffic; each update is guarded by missing so documents written by the
+    new code path are never overwritten.
+    """
+    collection = mongodb.get_collection(collection_name)
+    
+    last_id = None
+    updated = 0
+    while True:
+        query = dict(missing)
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        
+        batch = list(
+            collection.find(query, projection)
+            .sort('_id', 1)
+            .limit(batch_size)
+        )
+        if not batch:
+            break
+        
+        operations = [
+            UpdateOne({'_id': doc['_id'], **missing}, {'$set': build_update(doc)})
+            for doc in batch
+        ]
+        result = collection.bulk_write(operations, ordered=False)
+        updated += result.modified_count
+        last_id = batch[-1]['_id']
+        
+        logger.info(
+            f"{label} backfill on {collection_name}: {updated} updated (last _id: {last_id})"
+        )
+        
+        if pause:
+            time.sleep(pause)
+    
+    return updated
+
+def backfill_typed_fields(batch_size: int = 500, pause: float = 0.0) -> int:
+    """
+    Populate typed amount/currency/category/bill_date fields on existing expenses.
+    
+    Returns:
+        Number of expenses updated
+    """
+    return _backfill(
+        'expenses',
+        MISSING_TYPED_FIELDS,
+        {'extracted_data': 1},
+        lambda doc: ExpenseModel.normalize_extracted_data(doc.get('extracted_data') or {}),
+        'Typed field',
+        batch_size,
+        pause
+    )
+
+def _search_tokens_update(doc: Dict[str, Any]) -> Dict[str, Any]:
+    extracted_data = doc.get('extracted_data') or {}
+    category = (
+        doc.get('category') or ExpenseModel.normalize_extracted_data(extracted_data)['category']
+    )
+    return {
+        'search_tokens': ExpenseModel.search_tokens(extracted_data, category, doc.get('ocr_text'))
+    }
+
+def backfill_search_tokens(batch_size: int = 500, pause: float = 0.0) -> int:
+    """
+    Populate search_tokens on live and archived expenses created before search.
+    
+    Returns:
+        Number of expenses updated
+    """
+    projection = {
+        'extracted_data.Details': 1, 'extracted_data.Bill Type': 1, 'category': 1, 'ocr_text': 1
+    }
+    return sum(
+        _backfill(collection_name, MISSING_SEARCH_TOKENS, projection, _search_tokens_update,
+                  'Search token', batch_size, pause)
+        for collection_name in ('expenses', 'expenses_archive')
+    )
+
+def backfill_duplicate_index(batch_size: int = 200, pause: float = 0.0) -> tuple:
+    """
+    Fingerprint existing receipts and flag duplicate pairs among them.
+    
+    Expenses are processed in _id order, so each one is compared with every
+    expense fingerprinted before it; both sides of a match are flagged.
+    
+    Returns:
+        (fingerprinted, flagged) expense counts
+    """
+    projection = {
+        'image_path': 1,
+        'extracted_data.Details': 1,
+        'amount_inr': 1,
+        'bill_date': 1,
+        'vendor_key': 1
+    }
+    fingerprinted = 0
+    flagged = 0
+    
+    for collection_name in DUPLICATE_COLLECTIONS:
+        collection = mongodb.get_collection(collection_name)
+        last_id = None
+        while True:
+            query = dict(MISSING_IMAGE_HASH)
+            if last_id is not None:
+                query['_id'] = {'$gt': last_id}
+            
+            batch = list(collection.find(query, projection).sort('_id', 1).limit(batch_size))
+            if not batch:
+                break
+            
+            operations = []
+            for doc in batch:
+                fields = DuplicateDetector.fingerprint(doc.get('image_path'))
+                if 'vendor_key' not in doc:
+                    fields['vendor_key'] = ' '.join(
+                        ExpenseModel.tokenize((doc.get('extracted_data') or {}).get('Details'))
+                    ) or None
+                doc.update(fields)
+                operations.append(
+                    UpdateOne({'_id': doc['_id'], **MISSING_IMAGE_HASH}, {'$set': fields})
+                )
+            
+            result = collection.bulk_write(operations, ordered=False)
+            fingerprinted += result.modified_count
+            
+            for doc in batch:
+                duplicates = DuplicateDetector.find_duplicates(doc)
+                if duplicates:
+                    DuplicateDetector.record_duplicates(doc['_id'], duplicates)
+                    flagged += 1
+            
+            last_id = batch[-1]['_id']
+            logger.info(
+                f"Duplicate index backfill on {collection_name}: {fingerprinted} fingerprinted, "
+                f"{flagged} flagged (last _id: {last_id})"
+            )
+            
+            if pause:
+                time.sleep(pause)
+    
+    return fingerprinted, flagged
+
+def migrate_to_content_store(batch_size: int = 200, pause: float = 0.0) -> tuple:
+    """
+    Move receipts of live expenses into the content-addressed store.
+    
+    Expenses are walked in _id order. Each file is copied into the store (or
+    an identical blob is reused), image_path is rewritten with a guard on the
+    old path, and only then is the old file removed. Receipts moved by
+    archive-expenses stay under archive/.
+    
+    Returns:
+        (migrated, missing) expense counts
+    """
+    expenses_collection = mongodb.get_collection('expenses')
+    
+    last_id = None
+    migrated = 0
+    missing = 0
+    while True:
+        query = {'image_path': {'$exists': True, '$ne': None}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        
+        batch = list(
+            expenses_collection.find(query, {'image_path': 1}).sort('_id', 1).limit(batch_size)
+        )
+        if not batch:
+            break
+        
+        for doc in batch:
+            old_path = doc['image_path']
+            if FileManager.get_blob_key(old_path):
+                continue
+            
+            new_path = FileManager.store_existing_file(old_path)
+            if new_path is None:
+                missing += 1
+                logger.warning(
+                    f"Content store migration: file missing for {doc['_id']}: {old_path}"
+                )
+                continue
+            
+            result = expenses_collection.update_one(
+                {'_id': doc['_id'], 'image_path': old_path},
+                {'$set': {'image_path': new_path}}
+            )
+            if result.modified_count:
+                FileManager.delete_file(old_path)
+                migrated += 1
+            else:
+                # The expense changed or was archived meanwhile; drop our reference
+                FileManager.delete_file(new_path)
+        
+        last_id = batch[-1]['_id']
+        logger.info(
+            f"Content store migration: {migrated} migrated, {missing} missing "
+            f"(last _id: {last_id})"
+        )
+        
+        if pause:
+            time.sleep(pause)
+    
+    return migrated, missing
+
+def sync_to_storage(source_folder: str, pause: float = 0.0, batch_size: int = 200) -> tuple:
+    """
+    Upload files under a local folder to the configured storage backend.
+    
+    Keys are paths relative to source_folder, matching how image_path maps
+    to keys, so pointing source_folder at the old UPLOAD_FOLDER makes
+    existing receipts reachable after switching STORAGE_BACKEND. Keys that
+    already exist are skipped, so the job can be re-run after a failure.
+    
+    Returns:
+        (uploaded, skipped) file counts
+    """
+    storage = get_storage()
+    uploaded = 0
+    skipped = 0
+    for directory, subdirectories, filenames in os.walk(source_folder):
+        # Skip .tmp (incomplete uploads) and other reserved directories
+        subdirectories[:] = [name for name in subdirectories if not name.startswith('.')]
+        
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            key = os.path.relpath(path, source_folder).replace(os.sep, '/')
+            if storage.exists(key):
+                skipped += 1
+                continue
+            
+            with open(path, 'rb') as source:
+                storage.put(key, source)
+            uploaded += 1
+            
+            if uploaded % batch_size == 0:
+                logger.info(f"Storage sync: {uploaded} uploaded, {skipped} already present")
+                if pause:
+                    time.sleep(pause)
+    
+    logger.info(f"Storage sync: {uploaded} uploaded, {skipped} already present")
+    return uploaded, skipped
@@ -0,0 +1,335 @@
+"""
+Storage backends for receipts and other uploaded files.
+
+Files are addressed by key, a '/'-separated path relative to the store root
+(UPLOAD_FOLDER for the local backend, S3_PREFIX in the bucket for S3).
+"""
+import os
+import shutil
+import tempfile
+import mimetypes
+from datetime import datetime, timezone
+from flask import current_app
+from typing import Optional, Iterator, BinaryIO, NamedTuple
+import logging
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_SIZE = 256 * 1024
+# Downloads up to this size are buffered in memory by open()
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+class StoredObject(NamedTuple):
+    key: str
+    size: int
+    modified: datetime  # naive UTC, like the timestamps stored in MongoDB
+
+class StorageBackend:
+    """Interface implemented by each storage backend."""
+    
+    # Directory for temporary upload files; None uses the system default
+    temp_dir: Optional[str] = None
+    
+    def put_file(self, key: str, path: str, content_type: Optional[str] = None) -> None:
+        """Store the local file at path under key, consuming the file."""
+        raise NotImplementedError
+    
+    def put(self, key: str, fileobj: BinaryIO, content_type: Optional[str] = None) -> None:
+        """Store the contents of a readable file object under key."""
+        raise NotImplementedError
+    
+    def open(self, key: str) -> BinaryIO:
+        """Seekable binary file object with the contents of key."""
+        raise NotImplementedError
+    
+    def stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE,
+               start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Bytes [start, end) of key in chunks, without buffering the whole file."""
+        raise NotImplementedError
+    
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+    
+    def size(self, key: str) -> Optional[int]:
+        """Size in bytes, or None if key does not exist."""
+        raise NotImplementedError
+    
+    def delete(self, key: str) -> bool:
+        """Remove key; returns False if it did not exist."""
+        raise NotImplementedError
+    
+    def list_keys(self, prefix: str = '') -> Iterator[StoredObject]:
+        """Every object whose key starts with prefix, in ascending key (code point) order."""
+        raise NotImplementedError
+    
+    def move(self, key: str, new_key: str) -> None:
+        raise NotImplementedError
+    
+    def presign(
+        self,
+        key: str,
+        expires_in: int = 300,
+        download_name: Optional[str] = None
+    ) -> Optional[str]:
+        """Time-limited URL clients can fetch key from directly, if supported."""
+        return None
+    
+    def local_path(self, key: str) -> Optional[str]:
+        """Filesystem path of key, if the backend stores files locally."""
+        return None
+
+class LocalStorage(StorageBackend):
+    """Files under a directory on the local filesystem."""
+    
+    def __init__(self, root: str):
+        self.root = root
+        self.temp_dir = os.path.join(root, '.tmp')
+    
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(os.path.abspath(self.root) + os.sep):
+            raise ValueError(f"Key outside storage root: {key}")
+        return path
+    
+    def put_file(self, key: str, path: str, content_type: Optional[str] = None) -> None:
+        destination = self._path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        # Atomic when path is in temp_dir, which is on the same filesystem
+        shutil.move(path, destination)
+    
+    def put(self, key: str, fileobj: BinaryIO, content_type: Optional[str] = None) -> None:
+        os.makedirs(self.temp_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.temp_dir, delete=False) as temp:
+            shutil.copyfileobj(fileobj, temp, STREAM_CHUNK_SIZE)
+        self.put_file(key, temp.name, content_type)
+    
+    def open(self, key: str) -> BinaryIO:
+        return open(self._path(key), 'rb')
+    
+    def stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE,
+               start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        with self.open(key) as source:
+            source.seek(start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                chunk = source.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+    
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._path(key))
+    
+    def size(self, key: str) -> Optional[int]:
+        path = self._path(key)
+        return os.path.getsize(path) if os.path.isfile(path) else None
+    
+    def delete(self, key: str) -> bool:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return False
+        os.remove(path)
+        return True
+    
+    def _walk(self, directory: str, key_prefix: str) -> Iterator[StoredObject]:
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+        # Sorting directories as "<name>/" makes the walk yield keys in the
+        # same order as sorting the full keys
+        def sort_key(entry) -> str:
+            return entry.name + '/' if entry.is_dir(follow_symlinks=False) else entry.name
+        entries.sort(key=sort_key)
+        for entry in entries:
+            key = key_prefix + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                yield from self._walk(entry.path, key + '/')
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat()
+                yield StoredObject(key, stat.st_size, datetime.utcfromtimestamp(stat.st_mtime))
+    
+    def list_keys(self, prefix: str = '') -> Iterator[StoredObject]:
+        # Walk the deepest directory that contains prefix, then filter
+        directory_prefix = prefix[:prefix.rfind('/') + 1]
+        directory = self._path(directory_prefix) if directory_prefix else os.path.abspath(self.root)
+        for stored in self._walk(directory, directory_prefix):
+            if stored.key.startswith(prefix):
+                yield stored
+    
+    def move(self, key: str, new_key: str) -> None:
+        destination = self._path(new_key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(self._path(key), destination)
+    
+    def local_path(self, key: str) -> Optional[str]:
+        return self._path(key)
+
+class S3Storage(StorageBackend):
+    """
+    Objects in an S3-compatible bucket (AWS S3, MinIO, ...).
+    
+    Uploads above multipart_threshold are sent as concurrent multipart
+    uploads by boto3's transfer manager.
+    """
+    
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = '',
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+        multipart_threshold: int = 8 * 1024 * 1024,
+        multipart_chunksize: int = 8 * 1024 * 1024
+    ):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND is 's3' but boto3 is not installed")
+        
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            # MinIO and most S3-compatible servers expect path-style addressing
+            config=BotoConfig(
+                signature_version='s3v4',
+                s3={'addressing_style': 'path'} if endpoint_url else {}
+            )
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize
+        )
+    
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+    
+    def _extra_args(self, key: str, content_type: Optional[str]) -> dict:
+        content_type = content_type or mimetypes.guess_type(key)[0]
+        return {'ContentType': content_type} if content_type else {}
+    
+    def put_file(self, key: str, path: str, content_type: Optional[str] = None) -> None:
+        try:
+            self.client.upload_file(
+                path, self.bucket, self._key(key),
+                ExtraArgs=self._extra_args(key, content_type),
+                Config=self.transfer_config
+            )
+        finally:
+            os.remove(path)
+    
+    def put(self, key: str, fileobj: BinaryIO, content_type: Optional[str] = None) -> None:
+        self.client.upload_fileobj(
+            fileobj, self.bucket, self._key(key),
+            ExtraArgs=self._extra_args(key, content_type),
+            Config=self.transfer_config
+        )
+    
+    def open(self, key: str) -> BinaryIO:
+        target = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        self.client.download_fileobj(
+            self.bucket, self._key(key), target, Config=self.transfer_config
+        )
+        target.seek(0)
+        return target
+    
+    def stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE,
+               start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        params = {'Bucket': self.bucket, 'Key': self._key(key)}
+        if start or end is not None:
+            params['Range'] = f"bytes={start}-{'' if end is None else end - 1}"
+        body = self.client.get_object(**params)['Body']
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            body.close()
+    
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+    
+    def exists(self, key: str) -> bool:
+        return self._head(key) is not None
+    
+    def size(self, key: str) -> Optional[int]:
+        head = self._head(key)
+        return head['ContentLength'] if head else None
+    
+    def delete(self, key: str) -> bool:
+        if not self.exists(key):
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        return True
+    
+    def list_keys(self, prefix: str = '') -> Iterator[StoredObject]:
+        # S3 lists keys in UTF-8 byte order, which matches code point order
+        strip = len(self.prefix) + 1 if self.prefix else 0
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for item in page.get('Contents', []):
+                modified = item['LastModified'].astimezone(timezone.utc).replace(tzinfo=None)
+                yield StoredObject(item['Key'][strip:], item['Size'], modified)
+    
+    def move(self, key: str, new_key: str) -> None:
+        # S3 has no rename; copy() uses multipart copies for large objects
+        self.client.copy(
+            {'Bucket': self.bucket, 'Key': self._key(key)}, self.bucket, self._key(new_key),
+            Config=self.transfer_config
+        )
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+    
+    def presign(
+        self,
+        key: str,
+        expires_in: int = 300,
+        download_name: Optional[str] = None
+    ) -> Optional[str]:
+        params = {'Bucket': self.bucket, 'Key': self._key(key)}
+        if download_name:
+            params['ResponseContentDisposition'] = f'attachment; filename="{download_name}"'
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires_in)
+
+def create_storage(config) -> StorageBackend:
+    """Build the backend selected by STORAGE_BACKEND (local or s3)."""
+    backend = config.get('STORAGE_BACKEND', 'local').lower()
+    
+    if backend == 's3':
+        return S3Storage(
+            bucket=config['S3_BUCKET'],
+            prefix=config.get('S3_PREFIX', ''),
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            region=config.get('S3_REGION'),
+            access_key=config.get('S3_ACCESS_KEY_ID'),
+            secret_key=config.get('S3_SECRET_ACCESS_KEY')
+        )
+    if backend == 'local':
+        return LocalStorage(config.get('UPLOAD_FOLDER', 'uploads/expenses'))
+    
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+def init_storage(app) -> None:
+    app.extensions['storage'] = create_storage(app.config)
+    logger.info(f"Storage backend: {type(app.extensions['storage']).__name__}")
+
+def get_storage() -> StorageBackend:
+    return current_app.extensions['storage']
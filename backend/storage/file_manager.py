@@ -1,12 +1,37 @@
 import os
-import uuid
+import re
+import hashlib
+import tempfile
+import time
+import mimetypes
+from datetime import datetime
 from werkzeug.utils import secure_filename
-from flask import current_app
-from typing import Optional, Tuple
+from flask import current_app, send_file, redirect, request, Response
+from werkzeug.datastructures import ContentRange
+from urllib.parse import quote
+from pymongo import ReturnDocument
+from extensions.mongodb import mongodb
+from storage.backends import get_storage, STREAM_CHUNK_SIZE
+from utils.responses import error_response
+from typing import Optional, Tuple, BinaryIO
 import logging
 
 logger = logging.getLogger(__name__)
 
+BLOBS_COLLECTION = 'blobs'
+HASH_CHUNK_SIZE = 1024 * 1024
+# How long an upload waits for a concurrent delete of the same blob to finish
+BLOB_DELETE_WAIT_SECONDS = 30
+
+# <ab>/<cd>/<sha256>.<ext> relative to UPLOAD_FOLDER
+BLOB_KEY_PATTERN = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]+$')
+# A blob or one of its previews ("<blob key>.<size>.webp")
+CONTENT_KEY_PATTERN = re.compile(
+    r'^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})\.[a-z0-9]+(?:\.([a-z]+)\.webp)?$'
+)
+# Content-addressed files never change under the same path
+CONTENT_MAX_AGE = 365 * 24 * 3600
+
 class FileManager:
     @staticmethod
     def allowed_file(filename: str) -> bool:
@@ -34,42 +59,360 @@ class FileManager:
         
         return True, None
     
+    @staticmethod
+    def blob_key(digest: str, ext: str) -> str:
+        """Relative path of a blob, fanned out over two levels of hash-prefix directories."""
+        return f"{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+    
+    @staticmethod
+    def get_blob_key(file_path: str) -> Optional[str]:
+        """Blob key for a path inside the content store, or None for legacy paths."""
+        relative_path = FileManager.storage_key(file_path)
+        return relative_path if relative_path and BLOB_KEY_PATTERN.match(relative_path) else None
+    
+    @staticmethod
+    def storage_key(file_path: str) -> Optional[str]:
+        """Key of a stored file in the storage backend, or None for paths outside UPLOAD_FOLDER."""
+        if not file_path:
+            return None
+        upload_folder = current_app.config.get('UPLOAD_FOLDER', 'uploads/expenses')
+        relative_path = os.path.relpath(file_path, upload_folder).replace(os.sep, '/')
+        if relative_path.startswith('../') or relative_path in ('.', '..'):
+            return None
+        return relative_path
+    
+    @staticmethod
+    def file_exists(file_path: str) -> bool:
+        key = FileManager.storage_key(file_path)
+        if key is None:
+            # Paths outside UPLOAD_FOLDER are plain local files
+            return bool(file_path) and os.path.exists(file_path)
+        return get_storage().exists(key)
+    
+    @staticmethod
+    def open_file(file_path: str) -> BinaryIO:
+        """Seekable binary file object for a stored file, wherever the backend keeps it."""
+        key = FileManager.storage_key(file_path)
+        if key is None:
+            return open(file_path, 'rb')
+        return get_storage().open(key)
+    
+    @staticmethod
+    def content_etag(file_path: str) -> Optional[str]:
+        """Strong ETag for a content-addressed blob or one of its previews, else None."""
+        key = FileManager.storage_key(file_path)
+        match = CONTENT_KEY_PATTERN.match(key) if key else None
+        if not match:
+            return None
+        digest, preview_size = match.groups()
+        return f"{digest}-{preview_size}" if preview_size else digest
+    
+    @staticmethod
+    def send_stored_file(
+        file_path: str,
+        as_attachment: bool = False,
+        download_name: Optional[str] = None,
+        max_age: Optional[int] = None,
+        private: bool = False
+    ):
+        """
+        Response serving a stored file, honouring conditional and Range requests.
+        
+        Content-addressed files get their SHA-256 as a strong ETag and are
+        cacheable as immutable for FILE_CACHE_MAX_AGE unless max_age is given.
+        Local files are sent with send_file, or handed to the front proxy when
+        FILE_OFFLOAD is 'x-accel-redirect' ('x-sendfile' goes through Flask's
+        USE_X_SENDFILE). Remote objects are redirected to a presigned URL when
+        STORAGE_PRESIGN_DOWNLOADS is set, otherwise streamed through this
+        process without being buffered.
+        """
+        key = FileManager.storage_key(file_path)
+        storage = get_storage()
+        etag = FileManager.content_etag(file_path)
+        if etag and max_age is None:
+            max_age = current_app.config.get('FILE_CACHE_MAX_AGE', CONTENT_MAX_AGE)
+        
+        name = download_name or os.path.basename(key or file_path)
+        local_path = storage.local_path(key) if key is not None else file_path
+        offload_prefix = current_app.config.get('FILE_OFFLOAD_PREFIX', '/protected-files')
+        
+        nginx_offload = key and current_app.config.get('FILE_OFFLOAD') == 'x-accel-redirect'
+        if local_path is not None and not nginx_offload:
+            response = send_file(
+                os.path.abspath(local_path),
+                as_attachment=as_attachment,
+                download_name=download_name,
+                etag=etag or True
+            )
+            return FileManager._cache_for(response, max_age, private)
+        
+        if local_path is None and current_app.config.get('STORAGE_PRESIGN_DOWNLOADS', True):
+            url = storage.presign(
+                key,
+                expires_in=current_app.config.get('STORAGE_PRESIGN_EXPIRES', 300),
+                download_name=download_name if as_attachment else None
+            )
+            if url:
+                return redirect(url, code=302)
+        
+        response = Response(mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        if as_attachment:
+            response.headers.set('Content-Disposition', 'attachment', filename=name)
+        if etag:
+            response.set_etag(etag)
+        FileManager._cache_for(response, max_age, private)
+        
+        if local_path is not None:
+            # nginx serves the file, including Range and its own validators,
+            # from an internal location mapped to UPLOAD_FOLDER
+            response.headers['X-Accel-Redirect'] = f"{offload_prefix.rstrip('/')}/{quote(key)}"
+            return response.make_conditional(request)
+        
+        size = storage.size(key)
+        if size is None:
+            return error_response("File not found", 404)
+        
+        response.accept_ranges = 'bytes'
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+        
+        start, stop = 0, size
+        if_range = request.if_range
+        range_valid = (
+            not (if_range.etag or if_range.date) or (etag is not None and if_range.etag == etag)
+        )
+        if request.range and range_valid:
+            byte_range = request.range.range_for_length(size)
+            if byte_range is None:
+                response.status_code = 416
+                response.headers['Content-Range'] = f"bytes */{size}"
+                return response
+            start, stop = byte_range
+            response.status_code = 206
+            response.content_range = ContentRange('bytes', start, stop, size)
+        
+        response.response = storage.stream(key, STREAM_CHUNK_SIZE, start, stop)
+        response.direct_passthrough = True
+        response.content_length = stop - start
+        return response
+    
+    @staticmethod
+    def _cache_for(response, max_age: Optional[int], private: bool):
+        if max_age is None:
+            return response
+        response.cache_control.max_age = max_age
+        response.cache_control.no_cache = None
+        if private:
+            response.cache_control.private = True
+        else:
+            response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+    
+    @staticmethod
+    def _place_blob(temp_path: str, digest: str, ext: str, size: int) -> str:
+        """
+        Reference the blob for digest, moving temp_path into the storage backend.
+        
+        The reference is taken before the file is placed, so a concurrent
+        delete of the last reference cannot remove the file after this upload
+        has decided to reuse it. If a delete has already claimed the blob,
+        the upload waits for it to finish and then stores the file again.
+        """
+        upload_folder = current_app.config.get('UPLOAD_FOLDER', 'uploads/expenses')
+        key = FileManager.blob_key(digest, ext)
+        file_path = os.path.join(upload_folder, key)
+        storage = get_storage()
+        blobs_collection = mongodb.get_collection(BLOBS_COLLECTION)
+        
+        blob = blobs_collection.find_one_and_update(
+            {'_id': key},
+            {
+                '$inc': {'refcount': 1},
+                '$setOnInsert': {'sha256': digest, 'size': size, 'created_at': datetime.utcnow()}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        
+        if blob.get('deleting'):
+            deadline = time.monotonic() + BLOB_DELETE_WAIT_SECONDS
+            while blobs_collection.count_documents({'_id': key, 'deleting': True}, limit=1):
+                if time.monotonic() > deadline:
+                    # The deleting process died; its claim no longer applies
+                    logger.warning(f"Taking over abandoned delete of {key}")
+                    blobs_collection.update_one({'_id': key}, {'$unset': {'deleting': ''}})
+                    break
+                time.sleep(0.05)
+        
+        if storage.exists(key):
+            os.remove(temp_path)
+            logger.info(f"Deduplicated upload: {key}")
+        else:
+            # Consumes temp_path; remote backends upload it in multipart chunks
+            storage.put_file(key, temp_path)
+        
+        return file_path
+    
+    @staticmethod
+    def _temp_file():
+        temp_dir = get_storage().temp_dir
+        if temp_dir:
+            os.makedirs(temp_dir, exist_ok=True)
+        # For local storage this is on the same filesystem as the store, so
+        # placing the blob is an atomic rename
+        return tempfile.NamedTemporaryFile(dir=temp_dir, delete=False)
+    
+    @staticmethod
+    def store_existing_file(source_path: str) -> Optional[str]:
+        """
+        Copy a file already on disk into the content store.
+        
+        The source is left in place for the caller to remove once the new
+        path has been recorded.
+        
+        Returns:
+            New path, or None if the source does not exist
+        """
+        if not FileManager.file_exists(source_path):
+            return None
+        
+        has_ext = '.' in os.path.basename(source_path)
+        ext = source_path.rsplit('.', 1)[1].lower() if has_ext else 'bin'
+        
+        digest = hashlib.sha256()
+        size = 0
+        with FileManager.open_file(source_path) as source, FileManager._temp_file() as temp:
+            temp_path = temp.name
+            for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                temp.write(chunk)
+                size += len(chunk)
+        
+        return FileManager._place_blob(temp_path, digest.hexdigest(), ext, size)
+    
+    @staticmethod
+    def store_temp_file(temp_path: str, ext: str) -> str:
+        """
+        Move a complete local file, such as a finished resumable upload, into
+        the content store. temp_path is consumed.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        with open(temp_path, 'rb') as source:
+            for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                size += len(chunk)
+        
+        return FileManager._place_blob(temp_path, digest.hexdigest(), ext, size)
+    
     @staticmethod
     def save_file(file, user_id: str) -> Optional[str]:
+        """
+        Store an upload under its SHA-256, reusing an identical existing blob.
+        
+        The upload is hashed while it is streamed to a temporary file, so it
+        is only read once.
+        """
+        temp_path = None
         try:
-            upload_folder = current_app.config.get('UPLOAD_FOLDER', 'uploads/expenses')
-            user_folder = os.path.join(upload_folder, str(user_id))
-            os.makedirs(user_folder, exist_ok=True)
-            
             original_filename = secure_filename(file.filename)
             file_ext = original_filename.rsplit('.', 1)[1].lower()
-            unique_filename = f"{uuid.uuid4().hex}.{file_ext}"
             
-            file_path = os.path.join(user_folder, unique_filename)
-            file.save(file_path)
+            digest = hashlib.sha256()
+            size = 0
+            with FileManager._temp_file() as temp:
+                temp_path = temp.name
+                for chunk in iter(lambda: file.stream.read(HASH_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+            
+            file_path = FileManager._place_blob(temp_path, digest.hexdigest(), file_ext, size)
+            temp_path = None
             
-            logger.info(f"File saved: {file_path}")
+            logger.info(f"File saved: {file_path} (user {user_id})")
             return file_path
             
         except Exception as e:
             logger.error(f"Error saving file: {str(e)}")
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
             return None
     
     @staticmethod
     def delete_file(file_path: str) -> bool:
+        """
+        Release a file; blobs are only removed once nothing references them.
+        
+        Returns:
+            True if the file was removed from storage
+        """
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f"File deleted: {file_path}")
-                return True
-            return False
+            key = FileManager.get_blob_key(file_path)
+            if key is None:
+                storage_key = FileManager.storage_key(file_path)
+                if storage_key is not None:
+                    deleted = get_storage().delete(storage_key)
+                elif os.path.exists(file_path):
+                    os.remove(file_path)
+                    deleted = True
+                else:
+                    deleted = False
+                if deleted:
+                    FileManager._delete_previews(storage_key)
+                    logger.info(f"File deleted: {file_path}")
+                return deleted
+            
+            blobs_collection = mongodb.get_collection(BLOBS_COLLECTION)
+            blob = blobs_collection.find_one_and_update(
+                {'_id': key, 'refcount': {'$gt': 0}},
+                {'$inc': {'refcount': -1}},
+                return_document=ReturnDocument.AFTER
+            )
+            if blob is not None and blob['refcount'] > 0:
+                logger.info(f"Released reference to {key} ({blob['refcount']} remaining)")
+                return False
+            
+            # Only the caller that claims the record deletes the file. An
+            # upload referencing the blob meanwhile waits for the claim to be
+            # released and stores the file again.
+            claimed = blobs_collection.update_one(
+                {'_id': key, 'refcount': {'$lte': 0}, 'deleting': {'$exists': False}},
+                {'$set': {'deleting': True}}
+            ).modified_count
+            if not claimed:
+                return False
+            
+            try:
+                deleted = get_storage().delete(key)
+                if deleted:
+                    FileManager._delete_previews(key)
+                    logger.info(f"File deleted: {file_path}")
+            finally:
+                removed = blobs_collection.delete_one(
+                    {'_id': key, 'refcount': {'$lte': 0}, 'deleting': True}
+                ).deleted_count
+                if not removed:
+                    blobs_collection.update_one({'_id': key}, {'$unset': {'deleting': ''}})
+            return deleted
         except Exception as e:
             logger.error(f"Error deleting file: {str(e)}")
             return False
     
+    @staticmethod
+    def _delete_previews(key: str) -> None:
+        # Imported here; previews builds on FileManager
+        from storage.previews import PreviewService
+        try:
+            PreviewService.delete_previews(key)
+        except Exception as e:
+            logger.warning(f"Could not delete previews of {key}: {str(e)}")
+    
     @staticmethod
     def get_file_path(file_path: str) -> Optional[str]:
-        if os.path.exists(file_path):
+        if FileManager.file_exists(file_path):
             return file_path
         return None
 
@@ -0,0 +1,158 @@
+"""
+Downscaled WebP previews of receipt images.
+
+A preview is stored next to its original as "<key>.<size>.webp", so it is
+content-addressed whenever the original is and never needs invalidating.
+Previews are generated after upload, or on the first request for them, in
+a small thread pool shared by the worker.
+"""
+from storage.file_manager import FileManager
+from storage.backends import get_storage
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Optional, Dict
+import threading
+import os
+import logging
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels
+PREVIEW_SIZES = {
+    'thumb': 256,
+    'medium': 1024
+}
+PREVIEW_QUALITY = 80
+# Previews never change for a given original
+PREVIEW_MAX_AGE = 365 * 24 * 3600
+
+PREVIEWABLE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+# Preview key -> future, so concurrent requests for one preview render it once
+_in_flight: Dict[str, object] = {}
+
+def preview_key(key: str, size: str) -> str:
+    return f"{key}.{size}.webp"
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=current_app.config.get('PREVIEW_WORKERS', 2),
+                thread_name_prefix='preview'
+            )
+        return _executor
+
+class PreviewService:
+    @staticmethod
+    def can_preview(image_path: str) -> bool:
+        return (
+            Image is not None
+            and bool(image_path)
+            and image_path.lower().endswith(PREVIEWABLE_EXTENSIONS)
+            and FileManager.storage_key(image_path) is not None
+        )
+    
+    @staticmethod
+    def _render(image_path: str, size: str) -> Optional[str]:
+        """Write one preview if it does not exist yet; returns its key."""
+        storage = get_storage()
+        key = preview_key(FileManager.storage_key(image_path), size)
+        if storage.exists(key):
+            return key
+        
+        edge = PREVIEW_SIZES[size]
+        with FileManager.open_file(image_path) as source, Image.open(source) as image:
+            # Lets the JPEG decoder downscale while decoding
+            image.draft('RGB', (edge, edge))
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'RGBA'):
+                has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+                image = image.convert('RGBA' if has_alpha else 'RGB')
+            image.thumbnail((edge, edge), Image.LANCZOS)
+            
+            with FileManager._temp_file() as temp:
+                try:
+                    image.save(temp, 'WEBP', quality=PREVIEW_QUALITY, method=4)
+                except Exception:
+                    temp.close()
+                    os.remove(temp.name)
+                    raise
+        
+        storage.put_file(key, temp.name, 'image/webp')
+        logger.info(f"Preview written: {key}")
+        return key
+    
+    @staticmethod
+    def _run(app, image_path: str, size: str) -> Optional[str]:
+        with app.app_context():
+            try:
+                return PreviewService._render(image_path, size)
+            except Exception as e:
+                logger.warning(f"Could not render {size} preview of {image_path}: {str(e)}")
+                return None
+            finally:
+                with _executor_lock:
+                    _in_flight.pop(preview_key(FileManager.storage_key(image_path), size), None)
+    
+    @staticmethod
+    def _submit(image_path: str, size: str):
+        key = preview_key(FileManager.storage_key(image_path), size)
+        executor = _get_executor()
+        app = current_app._get_current_object()
+        with _executor_lock:
+            future = _in_flight.get(key)
+            if future is None:
+                future = executor.submit(PreviewService._run, app, image_path, size)
+                _in_flight[key] = future
+            return future
+    
+    @staticmethod
+    def schedule(image_path: str) -> None:
+        """Render every preview size of a new upload in the background."""
+        if not current_app.config.get('PREVIEW_ON_UPLOAD', True):
+            return
+        if not PreviewService.can_preview(image_path):
+            return
+        for size in PREVIEW_SIZES:
+            PreviewService._submit(image_path, size)
+    
+    @staticmethod
+    def get_preview_path(image_path: str, size: str) -> Optional[str]:
+        """
+        Path of the preview of image_path, rendering it if needed.
+        
+        Waits up to PREVIEW_WAIT_SECONDS for a pending render. Returns None
+        when no preview can be made (PDFs, compressed archived receipts) or
+        rendering fails or times out; callers then serve the original.
+        """
+        if not PreviewService.can_preview(image_path):
+            return None
+        
+        upload_folder = current_app.config.get('UPLOAD_FOLDER', 'uploads/expenses')
+        key = preview_key(FileManager.storage_key(image_path), size)
+        if not get_storage().exists(key):
+            future = PreviewService._submit(image_path, size)
+            try:
+                key = future.result(timeout=current_app.config.get('PREVIEW_WAIT_SECONDS', 10))
+            except FutureTimeoutError:
+                logger.warning(f"Timed out waiting for {size} preview of {image_path}")
+                return None
+            if key is None:
+                return None
+        
+        return os.path.join(upload_folder, key)
+    
+    @staticmethod
+    def delete_previews(key: str) -> None:
+        storage = get_storage()
+        for size in PREVIEW_SIZES:
+            storage.delete(preview_key(key, size))
@@ -0,0 +1,330 @@
+"""
+At-rest recompression of stored receipt photos.
+
+Phone photos are re-encoded as WebP (or high-quality JPEG) with their longest
+edge capped at RECOMPRESS_MAX_EDGE, which keeps printed text legible at a
+fraction of the size. Images are transcoded in a process pool, decoded again
+to verify the output, stored as a new content-addressed blob and swapped into
+image_path with a guarded update, so an expense never points at a file that
+is not fully written.
+"""
+from extensions.mongodb import mongodb
+from expenses.archive import ARCHIVE_COLLECTION
+from expenses.models import ExpenseStatus
+from storage.file_manager import FileManager, HASH_CHUNK_SIZE
+from storage.backends import get_storage
+from flask import current_app
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+import multiprocessing
+import shutil
+import time
+import os
+import logging
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# RECOMPRESS_FORMAT -> (Pillow format, file extension)
+RECOMPRESS_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg')
+}
+RECOMPRESSIBLE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+RECOMPRESS_COLLECTIONS = ('expenses', ARCHIVE_COLLECTION)
+
+NOT_RECOMPRESSED = {'recompression': {'$exists': False}}
+
+def _transcode(
+    source_path: str,
+    target_path: str,
+    image_format: str,
+    max_edge: int,
+    quality: int
+) -> Tuple[int, int]:
+    """
+    Write source_path re-encoded to target_path and check it decodes.
+    
+    Runs in a worker process, so it only touches local files.
+    
+    Returns:
+        (width, height) of the output
+    """
+    with Image.open(source_path) as image:
+        # Lets the JPEG decoder downscale while decoding
+        image.draft('RGB', (max_edge, max_edge))
+        # Bake EXIF orientation into the pixels; the output carries no EXIF
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        if image_format == 'WEBP' and has_alpha:
+            image = image.convert('RGBA')
+        elif has_alpha:
+            # JPEG has no alpha channel: flatten onto white paper
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        expected_size = image.size
+        
+        if image_format == 'WEBP':
+            image.save(target_path, 'WEBP', quality=quality, method=6)
+        else:
+            # 4:4:4 chroma keeps coloured text and thin strokes sharp
+            image.save(
+                target_path, 'JPEG',
+                quality=quality, optimize=True, progressive=True, subsampling=0
+            )
+    
+    with Image.open(target_path) as output:
+        output.verify()
+    with Image.open(target_path) as output:
+        output.load()
+        if output.size != expected_size:
+            raise ValueError(f"Output is {output.size}, expected {expected_size}")
+    return expected_size
+
+class ReceiptRecompressor:
+    @staticmethod
+    def _source_path(image_path: str) -> Tuple[str, bool]:
+        """Local path the worker can read, and whether it is a temporary copy."""
+        storage = get_storage()
+        local_path = storage.local_path(FileManager.storage_key(image_path))
+        if local_path is not None:
+            return local_path, False
+        
+        with FileManager.open_file(image_path) as source, FileManager._temp_file() as temp:
+            shutil.copyfileobj(source, temp, HASH_CHUNK_SIZE)
+        return temp.name, True
+    
+    @staticmethod
+    def _mark(collection, doc: Dict[str, Any], recompression: Dict[str, Any]) -> None:
+        collection.update_one(
+            {'_id': doc['_id'], 'image_path': doc.get('image_path'), **NOT_RECOMPRESSED},
+            {'$set': {'recompression': {'at': datetime.utcnow(), **recompression}}}
+        )
+    
+    @staticmethod
+    def _swap(
+        collection,
+        doc: Dict[str, Any],
+        target_path: str,
+        ext: str,
+        recompression: Dict[str, Any],
+        keep_original: bool
+    ) -> bool:
+        """Store the new file and point the expense at it; False if the expense changed."""
+        old_path = doc['image_path']
+        new_path = FileManager.store_temp_file(target_path, ext)
+        
+        update = {
+            'image_path': new_path,
+            'recompression': {'at': datetime.utcnow(), **recompression}
+        }
+        if keep_original:
+            update['original_image_path'] = old_path
+        result = collection.update_one(
+            {'_id': doc['_id'], 'image_path': old_path, **NOT_RECOMPRESSED},
+            {'$set': update}
+        )
+        if not result.modified_count:
+            FileManager.delete_file(new_path)
+            return False
+        
+        if not keep_original:
+            FileManager.delete_file(old_path)
+        return True
+    
+    @staticmethod
+    def recompress(
+        batch_size: int = 50,
+        limit: Optional[int] = None,
+        pause: float = 0.0,
+        keep_pending_originals: Optional[bool] = None
+    ) -> Dict[str, int]:
+        """
+        Recompress receipt photos of live and archived expenses, in _id order.
+        
+        Every expense visited gets a recompression field (also when it is
+        skipped), so re-running the job only looks at new expenses. Output
+        that does not save at least RECOMPRESS_MIN_SAVING of the original
+        size is discarded. With keep_pending_originals, pending expenses
+        keep a reference to their original in original_image_path until
+        release_originals runs after they are settled.
+        
+        Returns:
+            Counts of recompressed, skipped and failed expenses and bytes saved
+        """
+        if Image is None:
+            raise RuntimeError("Pillow is required to recompress receipts")
+        
+        config = current_app.config
+        format_name = config.get('RECOMPRESS_FORMAT', 'webp').lower()
+        if format_name not in RECOMPRESS_FORMATS:
+            raise ValueError(f"RECOMPRESS_FORMAT must be one of: {', '.join(RECOMPRESS_FORMATS)}")
+        image_format, ext = RECOMPRESS_FORMATS[format_name]
+        max_edge = config.get('RECOMPRESS_MAX_EDGE', 2400)
+        quality = config.get('RECOMPRESS_QUALITY', 85)
+        min_saving = config.get('RECOMPRESS_MIN_SAVING', 0.2)
+        if keep_pending_originals is None:
+            keep_pending_originals = config.get('RECOMPRESS_KEEP_PENDING_ORIGINALS', True)
+        
+        report = {
+            'recompressed': 0, 'skipped': 0, 'failed': 0, 'changed': 0,
+            'bytes_before': 0, 'bytes_after': 0
+        }
+        visited = 0
+        
+        # spawn rather than fork: forked children would inherit the MongoDB
+        # client's sockets and monitor threads
+        executor = ProcessPoolExecutor(
+            max_workers=config.get('RECOMPRESS_WORKERS', 2),
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        try:
+            for collection_name in RECOMPRESS_COLLECTIONS:
+                collection = mongodb.get_collection(collection_name)
+                last_id = None
+                while limit is None or visited < limit:
+                    query = dict(NOT_RECOMPRESSED)
+                    if last_id is not None:
+                        query['_id'] = {'$gt': last_id}
+                    
+                    page_size = batch_size if limit is None else min(batch_size, limit - visited)
+                    batch = list(
+                        collection.find(query, {'image_path': 1, 'status': 1})
+                        .sort('_id', 1)
+                        .limit(page_size)
+                    )
+                    if not batch:
+                        break
+                    last_id = batch[-1]['_id']
+                    visited += len(batch)
+                    
+                    ReceiptRecompressor._recompress_batch(
+                        executor, collection, batch, report,
+                        image_format, ext, max_edge, quality, min_saving, keep_pending_originals
+                    )
+                    saved = report['bytes_before'] - report['bytes_after']
+                    logger.info(
+                        f"Recompression on {collection_name}: "
+                        f"{report['recompressed']} recompressed, {report['skipped']} skipped, "
+                        f"{report['failed']} failed, {saved} bytes saved (last _id: {last_id})"
+                    )
+                    
+                    if pause:
+                        time.sleep(pause)
+        finally:
+            executor.shutdown()
+        
+        return report
+    
+    @staticmethod
+    def _recompress_batch(
+        executor: ProcessPoolExecutor,
+        collection,
+        batch: list,
+        report: Dict[str, int],
+        image_format: str,
+        ext: str,
+        max_edge: int,
+        quality: int,
+        min_saving: float,
+        keep_pending_originals: bool
+    ) -> None:
+        jobs = []
+        try:
+            for doc in batch:
+                image_path = doc.get('image_path')
+                if (
+                    not FileManager.get_blob_key(image_path)
+                    or not image_path.lower().endswith(RECOMPRESSIBLE_EXTENSIONS)
+                    or not FileManager.file_exists(image_path)
+                ):
+                    # PDFs, files outside the content store and missing files
+                    ReceiptRecompressor._mark(collection, doc, {'skipped': 'unsupported'})
+                    report['skipped'] += 1
+                    continue
+                
+                source_path, is_copy = ReceiptRecompressor._source_path(image_path)
+                with FileManager._temp_file() as temp:
+                    target_path = temp.name
+                future = executor.submit(
+                    _transcode, source_path, target_path, image_format, max_edge, quality
+                )
+                jobs.append((doc, source_path, is_copy, target_path, future))
+            
+            for doc, source_path, is_copy, target_path, future in jobs:
+                try:
+                    width, height = future.result()
+                except Exception as e:
+                    logger.warning(f"Could not recompress {doc['image_path']}: {str(e)}")
+                    ReceiptRecompressor._mark(collection, doc, {'failed': str(e)[:200]})
+                    report['failed'] += 1
+                    continue
+                
+                original_size = os.path.getsize(source_path)
+                size = os.path.getsize(target_path)
+                if size > original_size * (1 - min_saving):
+                    ReceiptRecompressor._mark(
+                        collection, doc, {'skipped': 'not_smaller', 'size': original_size}
+                    )
+                    report['skipped'] += 1
+                    continue
+                
+                is_pending = doc.get('status') == ExpenseStatus.PENDING
+                keep_original = keep_pending_originals and is_pending
+                recompression = {
+                    'format': ext, 'width': width, 'height': height,
+                    'original_size': original_size, 'size': size
+                }
+                swapped = ReceiptRecompressor._swap(
+                    collection, doc, target_path, ext, recompression, keep_original
+                )
+                if swapped:
+                    report['recompressed'] += 1
+                    report['bytes_before'] += original_size
+                    report['bytes_after'] += size
+                else:
+                    report['changed'] += 1
+        finally:
+            for doc, source_path, is_copy, target_path, future in jobs:
+                future.cancel()
+                # store_temp_file consumes target_path when the swap happens
+                for path in (target_path, source_path if is_copy else None):
+                    if path and os.path.exists(path):
+                        os.remove(path)
+    
+    @staticmethod
+    def release_originals() -> int:
+        """
+        Drop the originals kept for expenses that are no longer pending.
+        
+        Returns:
+            Number of originals released
+        """
+        released = 0
+        for collection_name in RECOMPRESS_COLLECTIONS:
+            collection = mongodb.get_collection(collection_name)
+            settled = {
+                'original_image_path': {'$exists': True},
+                'status': {'$ne': ExpenseStatus.PENDING}
+            }
+            for doc in collection.find(settled, {'original_image_path': 1}).batch_size(500):
+                result = collection.update_one(
+                    {'_id': doc['_id'], 'original_image_path': doc['original_image_path'],
+                     'status': {'$ne': ExpenseStatus.PENDING}},
+                    {'$unset': {'original_image_path': ''}}
+                )
+                if result.modified_count:
+                    FileManager.delete_file(doc['original_image_path'])
+                    released += 1
+        
+        logger.info(f"Released {released} original receipt(s) of settled expenses")
+        return released
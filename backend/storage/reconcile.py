@@ -0,0 +1,313 @@
+"""
+Storage reconciliation: orphaned files, missing files and per-user usage.
+
+The stored keys and every reference to them (expense image_path and
+original_image_path values and blob records) are both read in ascending
+key order and merge-joined, so the job needs memory for one key at a time
+rather than for either side in full.
+"""
+from extensions.mongodb import mongodb
+from expenses.archive import ARCHIVE_COLLECTION
+from storage.backends import get_storage
+from storage.file_manager import BLOBS_COLLECTION
+from flask import current_app
+from pymongo import ReplaceOne
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterator, Optional
+import heapq
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+STORAGE_USAGE_COLLECTION = 'storage_usage'
+QUARANTINE_PREFIX = '.quarantine/'
+# Top-level directories starting with '.' (.tmp, .quarantine) are not receipts
+RESERVED_KEY_PATTERN = re.compile(r'^\.')
+PREVIEW_KEY_PATTERN = re.compile(r'^(.+)\.(?:thumb|medium)\.webp$')
+MAX_EXAMPLES = 20
+USAGE_BATCH_SIZE = 500
+# Expense fields holding a stored file, with their reference kind
+REFERENCE_FIELDS = (('image_path', 'expense'), ('original_image_path', 'original'))
+# Files scanned before orphans start being quarantined, so the orphan
+# ratio is meaningful before anything is moved
+RATIO_SAMPLE_FILES = 1000
+
+class StorageReconciler:
+    @staticmethod
+    def _expense_references(
+        collection_name: str,
+        upload_prefix: str,
+        field: str = 'image_path',
+        kind: str = 'expense'
+    ) -> Iterator[tuple]:
+        # Every string starting with upload_prefix, as an index range scan
+        # on field that also returns documents in key order
+        upper_bound = upload_prefix[:-1] + chr(ord(upload_prefix[-1]) + 1)
+        cursor = mongodb.get_collection(collection_name).find(
+            {field: {'$gte': upload_prefix, '$lt': upper_bound}},
+            {field: 1, 'user_id': 1}
+        ).sort(field, 1).batch_size(1000)
+        for doc in cursor:
+            yield doc[field][len(upload_prefix):], kind, doc
+    
+    @staticmethod
+    def _blob_references() -> Iterator[tuple]:
+        cursor = mongodb.get_collection(BLOBS_COLLECTION).find(
+            {'refcount': {'$gt': 0}}, {'_id': 1}
+        ).sort('_id', 1).batch_size(1000)
+        for doc in cursor:
+            yield doc['_id'], 'blob', doc
+    
+    @staticmethod
+    def _references(upload_prefix: str) -> Iterator[tuple]:
+        """(key, [references]) for every referenced key, in key order."""
+        merged = heapq.merge(
+            *(
+                StorageReconciler._expense_references(collection_name, upload_prefix, field, kind)
+                for collection_name in ('expenses', ARCHIVE_COLLECTION)
+                for field, kind in REFERENCE_FIELDS
+            ),
+            StorageReconciler._blob_references(),
+            key=lambda reference: reference[0]
+        )
+        current_key, group = None, []
+        for key, kind, doc in merged:
+            if key != current_key and group:
+                yield current_key, group
+                group = []
+            current_key = key
+            group.append((kind, doc))
+        if group:
+            yield current_key, group
+    
+    @staticmethod
+    def _is_referenced_now(upload_prefix: str, key: str) -> bool:
+        """Point lookups just before quarantining, for references created during the scan."""
+        if mongodb.get_collection(BLOBS_COLLECTION).count_documents(
+            {'_id': key, 'refcount': {'$gt': 0}}, limit=1
+        ):
+            return True
+        return any(
+            mongodb.get_collection(collection_name).count_documents(
+                {field: upload_prefix + key}, limit=1
+            )
+            for collection_name in ('expenses', ARCHIVE_COLLECTION)
+            for field, _ in REFERENCE_FIELDS
+        )
+    
+    @staticmethod
+    def reconcile(
+        min_age_hours: float = 24,
+        dry_run: bool = False,
+        max_orphan_ratio: float = 0.5
+    ) -> Dict[str, Any]:
+        """
+        Find orphaned and missing files and record storage usage per user.
+        
+        A file is orphaned when no expense (image_path or kept original),
+        archived expense or blob record references it, it is not a preview
+        of a referenced file and it is older than min_age_hours (so uploads
+        between save_file and insert_one are left alone). Orphans are moved under
+        .quarantine/<date>/ rather than deleted.
+        
+        Quarantining stops as soon as more than max_orphan_ratio of the
+        files scanned so far (after the first RATIO_SAMPLE_FILES) are
+        orphans; that usually means UPLOAD_FOLDER no longer matches the
+        stored image_path values.
+        
+        Returns:
+            Report with file, orphan and missing counts and examples
+        """
+        upload_folder = current_app.config.get('UPLOAD_FOLDER', 'uploads/expenses')
+        upload_prefix = upload_folder.rstrip('/') + '/'
+        storage = get_storage()
+        started_at = datetime.utcnow()
+        min_modified = started_at - timedelta(hours=min_age_hours)
+        
+        report = {
+            'files': 0,
+            'bytes': 0,
+            'referenced_files': 0,
+            'orphans': 0,
+            'orphan_bytes': 0,
+            'orphan_examples': [],
+            'missing_files': 0,
+            'missing_examples': [],
+            'missing_blobs': 0,
+            'unreferenced_blobs': 0,
+            'quarantined': 0,
+            'quarantine_stopped': False,
+            'dry_run': dry_run
+        }
+        usage: Dict[Any, Dict[str, int]] = {}
+        # Orphans found before the ratio sample is complete
+        pending_orphans = []
+        quarantine_prefix = f"{QUARANTINE_PREFIX}{started_at.strftime('%Y%m%d')}/"
+        
+        def quarantine(key: Optional[str] = None) -> None:
+            """Queue key, then move queued orphans once the ratio sample is complete."""
+            if report['quarantine_stopped']:
+                return
+            if key is not None:
+                pending_orphans.append(key)
+                if report['files'] < RATIO_SAMPLE_FILES:
+                    return
+            if report['orphans'] / report['files'] > max_orphan_ratio:
+                report['quarantine_stopped'] = True
+                pending_orphans.clear()
+                logger.error(
+                    f"Storage reconcile: {report['orphans']} of {report['files']} files look "
+                    f"orphaned; stopped quarantining. Check that UPLOAD_FOLDER matches stored "
+                    f"image_path values."
+                )
+                return
+            for pending_key in pending_orphans:
+                if StorageReconciler._is_referenced_now(upload_prefix, pending_key):
+                    continue
+                storage.move(pending_key, quarantine_prefix + pending_key)
+                report['quarantined'] += 1
+            pending_orphans.clear()
+        
+        def record_missing(key: str, group: list) -> None:
+            for kind, doc in group:
+                if kind == 'blob':
+                    report['missing_blobs'] += 1
+                    continue
+                report['missing_files'] += 1
+                if len(report['missing_examples']) < MAX_EXAMPLES:
+                    field = 'original_image_path' if kind == 'original' else 'image_path'
+                    report['missing_examples'].append(
+                        {'expense_id': str(doc['_id']), field: doc[field]}
+                    )
+        
+        references = StorageReconciler._references(upload_prefix)
+        reference = next(references, None)
+        last_referenced = None
+        
+        for stored in storage.list_keys():
+            if RESERVED_KEY_PATTERN.match(stored.key):
+                continue
+            report['files'] += 1
+            report['bytes'] += stored.size
+            
+            # References to keys before this one have no file
+            while reference is not None and reference[0] < stored.key:
+                record_missing(*reference)
+                reference = next(references, None)
+            
+            if reference is not None and reference[0] == stored.key:
+                report['referenced_files'] += 1
+                last_referenced = stored.key
+                if all(kind == 'blob' for kind, _ in reference[1]):
+                    report['unreferenced_blobs'] += 1
+                for kind, doc in reference[1]:
+                    if kind != 'blob':
+                        user_usage = usage.setdefault(doc.get('user_id'), {'files': 0, 'bytes': 0})
+                        user_usage['files'] += 1
+                        user_usage['bytes'] += stored.size
+                reference = next(references, None)
+                continue
+            
+            # Previews sort directly after their original
+            preview = PREVIEW_KEY_PATTERN.match(stored.key)
+            if preview and preview.group(1) == last_referenced:
+                continue
+            if stored.modified > min_modified:
+                continue
+            
+            report['orphans'] += 1
+            report['orphan_bytes'] += stored.size
+            if len(report['orphan_examples']) < MAX_EXAMPLES:
+                report['orphan_examples'].append(stored.key)
+            if not dry_run:
+                quarantine(stored.key)
+        
+        while reference is not None:
+            record_missing(*reference)
+            reference = next(references, None)
+        
+        # Fewer files in total than the ratio sample
+        if pending_orphans:
+            quarantine()
+        
+        if not dry_run:
+            StorageReconciler._write_usage(usage, started_at)
+        
+        logger.info(
+            f"Storage reconcile: {report['files']} files ({report['bytes']} bytes), "
+            f"{report['orphans']} orphaned, {report['quarantined']} quarantined, "
+            f"{report['missing_files']} expenses missing their file"
+        )
+        return report
+    
+    @staticmethod
+    def _write_usage(usage: Dict[Any, Dict[str, int]], started_at: datetime) -> None:
+        collection = mongodb.get_collection(STORAGE_USAGE_COLLECTION)
+        operations = [
+            ReplaceOne(
+                {'_id': user_id},
+                {
+                    '_id': user_id,
+                    'files': totals['files'],
+                    'bytes': totals['bytes'],
+                    'updated_at': started_at
+                },
+                upsert=True
+            )
+            for user_id, totals in usage.items()
+            if user_id is not None
+        ]
+        for start in range(0, len(operations), USAGE_BATCH_SIZE):
+            collection.bulk_write(operations[start:start + USAGE_BATCH_SIZE], ordered=False)
+        # Users without any stored receipt anymore
+        collection.delete_many({'updated_at': {'$lt': started_at}})
+    
+    @staticmethod
+    def purge_quarantine(older_than_days: float = 7, dry_run: bool = False) -> int:
+        """
+        Delete quarantined files older than older_than_days.
+        
+        Returns:
+            Number of files deleted
+        """
+        storage = get_storage()
+        cutoff = (datetime.utcnow() - timedelta(days=older_than_days)).strftime('%Y%m%d')
+        
+        deleted = 0
+        for stored in storage.list_keys(QUARANTINE_PREFIX):
+            day = stored.key[len(QUARANTINE_PREFIX):].split('/', 1)[0]
+            # Keys are listed in day order
+            if day >= cutoff:
+                break
+            if not dry_run:
+                storage.delete(stored.key)
+            deleted += 1
+        
+        logger.info(
+            f"Storage quarantine: {deleted} file(s) older than {older_than_days} days deleted"
+        )
+        return deleted
+    
+    @staticmethod
+    def get_usage(top: int = 20) -> list:
+        """Users with the most receipt storage, from the last reconcile run."""
+        collection = mongodb.get_collection(STORAGE_USAGE_COLLECTION)
+        rows = list(collection.find().sort('bytes', -1).limit(top))
+        
+        users = {
+            user['_id']: user.get('email')
+            for user in mongodb.get_collection('users').find(
+                {'_id': {'$in': [row['_id'] for row in rows]}}, {'email': 1}
+            )
+        }
+        return [
+            {
+                'user_id': str(row['_id']),
+                'email': users.get(row['_id']),
+                'files': row['files'],
+                'bytes': row['bytes'],
+                'updated_at': row['updated_at'].isoformat()
+            }
+            for row in rows
+        ]
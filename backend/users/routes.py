@@ -53,7 +53,21 @@ def change_password():
 @require_role('HR')
 def get_all_users():
     try:
-        result = UserService.get_all_users()
+        # Without page or per_page every user is returned, as the HR Users
+        # page expects
+        page, per_page = 1, None
+        try:
+            if 'page' in request.args or 'per_page' in request.args:
+                page = max(int(request.args.get('page', 1)), 1)
+                per_page = min(max(int(request.args.get('per_page', 100)), 1), 500)
+        except ValueError:
+            return error_response("page and per_page must be integers", 400)
+        
+        sort = request.args.get('sort', 'created_at')
+        order = 1 if request.args.get('order', 'desc').lower() == 'asc' else -1
+        search = request.args.get('search')
+        
+        result = UserService.get_all_users(page, per_page, sort, order, search)
         return result
     except Exception as e:
         logger.error(f"Get all users route error: {str(e)}", exc_info=True)
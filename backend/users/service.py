@@ -1,13 +1,26 @@
 from extensions.mongodb import mongodb
+from users.stats import UserStatsService
 from utils.password import hash_password, verify_password
 from utils.responses import success_response, error_response
+from expenses.models import ExpenseModel
 from bson import ObjectId
 from datetime import datetime
 from typing import Optional, Dict
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+STATISTIC_FIELDS = [
+    'total_expenses', 'pending_expenses', 'approved_expenses', 'rejected_expenses', 'total_amount'
+]
+
+DIRECTORY_SORT_FIELDS = {
+    'created_at': 'created_at',
+    'email': 'email',
+    **{field: f'statistics.{field}' for field in STATISTIC_FIELDS}
+}
+
 class UserService:
     @staticmethod
     def get_user_profile(user_id: str) -> tuple:
@@ -18,11 +31,7 @@ class UserService:
             if not user:
                 return error_response("User not found", 404)
             
-            # Get user statistics
-            expenses_collection = mongodb.get_collection('expenses')
-            total_expenses = expenses_collection.count_documents({'user_id': ObjectId(user_id)})
-            pending_expenses = expenses_collection.count_documents({'user_id': ObjectId(user_id), 'status': 'pending'})
-            approved_expenses = expenses_collection.count_documents({'user_id': ObjectId(user_id), 'status': 'approved'})
+            stats = UserStatsService.get_stats(user['_id'])
             
             profile_data = {
                 'user_id': str(user['_id']),
@@ -30,9 +39,9 @@ class UserService:
                 'role': user.get('role', 'USER'),
                 'created_at': user.get('created_at', '').isoformat() if user.get('created_at') else '',
                 'statistics': {
-                    'total_expenses': total_expenses,
-                    'pending_expenses': pending_expenses,
-                    'approved_expenses': approved_expenses
+                    'total_expenses': stats['total_expenses'],
+                    'pending_expenses': stats['pending_expenses'],
+                    'approved_expenses': stats['approved_expenses']
                 }
             }
             
@@ -115,48 +124,97 @@ class UserService:
             return error_response("Failed to change password", 500)
     
     @staticmethod
-    def get_all_users() -> tuple:
+    def get_all_users(
+        page: int = 1,
+        per_page: Optional[int] = None,
+        sort: str = 'created_at',
+        order: int = -1,
+        search: Optional[str] = None
+    ) -> tuple:
         try:
+            if sort not in DIRECTORY_SORT_FIELDS:
+                return error_response(
+                    f"Invalid sort field. Must be one of: {', '.join(DIRECTORY_SORT_FIELDS)}", 400
+                )
+            
             users_collection = mongodb.get_collection('users')
-            expenses_collection = mongodb.get_collection('expenses')
             
-            users = list(users_collection.find({}, {'password_hash': 0}).sort('created_at', -1))
+            match = {}
+            if search:
+                # Anchored, case-sensitive prefix so the unique email index is used
+                match['email'] = {'$regex': f"^{re.escape(search.strip().lower())}"}
+            
+            join_stats = [
+                {'$lookup': {
+                    'from': 'user_stats',
+                    'localField': '_id',
+                    'foreignField': '_id',
+                    'as': 'stats'
+                }},
+                {'$set': {'stats': {'$arrayElemAt': ['$stats', 0]}}},
+                {'$set': {'statistics': {
+                    field: {'$ifNull': [f'$stats.{field}', 0]}
+                    for field in STATISTIC_FIELDS
+                }}},
+                {'$project': {'password_hash': 0, 'stats': 0}}
+            ]
+            sort_stage = {'$sort': {DIRECTORY_SORT_FIELDS[sort]: order, '_id': 1}}
+            
+            if per_page is None:
+                # Unpaginated: every user in one cursor, as before pagination
+                if sort in STATISTIC_FIELDS:
+                    pipeline = [{'$match': match}, *join_stats, sort_stage]
+                else:
+                    pipeline = [{'$match': match}, sort_stage, *join_stats]
+                users = list(users_collection.aggregate(pipeline))
+                total = len(users)
+            else:
+                page_stages = [{'$skip': (page - 1) * per_page}, {'$limit': per_page}]
+                if sort in STATISTIC_FIELDS:
+                    pipeline = [{'$match': match}, *join_stats, sort_stage]
+                    users_facet = page_stages
+                else:
+                    # Sorting on user fields: page first, join stats for one page only
+                    pipeline = [{'$match': match}, sort_stage]
+                    users_facet = page_stages + join_stats
+                
+                pipeline.append({'$facet': {
+                    'users': users_facet,
+                    'total': [{'$count': 'count'}]
+                }})
+                
+                result = next(users_collection.aggregate(pipeline), {})
+                users = result.get('users', [])
+                total = result['total'][0]['count'] if result.get('total') else 0
             
             users_data = []
             for user in users:
-                user_id = user['_id']
-                total_expenses = expenses_collection.count_documents({'user_id': user_id})
-                pending_expenses = expenses_collection.count_documents({'user_id': user_id, 'status': 'pending'})
-                approved_expenses = expenses_collection.count_documents({'user_id': user_id, 'status': 'approved'})
-                
-                # Calculate total approved amount
-                approved = list(expenses_collection.find({'user_id': user_id, 'status': 'approved'}))
-                total_amount = 0
-                for exp in approved:
-                    extracted = exp.get('extracted_data', {})
-                    amount = extracted.get('Bill Amount (INR)') or extracted.get('Bill Amount') or '0'
-                    try:
-                        amount_clean = str(amount).replace('₹', '').replace(',', '').replace('$', '').replace('€', '').strip()
-                        total_amount += float(amount_clean) if amount_clean else 0
-                    except:
-                        pass
-                
+                statistics = user['statistics']
                 users_data.append({
-                    'user_id': str(user_id),
+                    'user_id': str(user['_id']),
                     'email': user.get('email', ''),
                     'role': user.get('role', 'USER'),
                     'created_at': user.get('created_at', '').isoformat() if user.get('created_at') else '',
                     'statistics': {
-                        'total_expenses': total_expenses,
-                        'pending_expenses': pending_expenses,
-                        'approved_expenses': approved_expenses,
-                        'total_amount': total_amount
+                        'total_expenses': statistics['total_expenses'],
+                        'pending_expenses': statistics['pending_expenses'],
+                        'approved_expenses': statistics['approved_expenses'],
+                        'rejected_expenses': statistics['rejected_expenses'],
+                        'total_amount': ExpenseModel.decimal_to_float(statistics['total_amount'])
                     }
                 })
             
-            return success_response("Users retrieved successfully", {'users': users_data, 'count': len(users_data)})
+            return success_response(
+                "Users retrieved successfully",
+                {
+                    'users': users_data,
+                    'count': len(users_data),
+                    'total': total,
+                    'page': page if per_page is not None else None,
+                    'per_page': per_page
+                }
+            )
             
         except Exception as e:
             logger.error(f"Error getting all users: {str(e)}")
             return error_response("Failed to retrieve users", 500)
-
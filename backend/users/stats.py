@@ -0,0 +1,189 @@
+"""
+Incrementally maintained per-user expense statistics.
+"""
+from extensions.mongodb import mongodb
+from expenses.models import ExpenseModel
+from expenses.archive import ARCHIVE_COLLECTION
+from bson import ObjectId, Decimal128
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional, Dict, Any, List
+from pymongo import UpdateOne
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATUS_FIELDS = {
+    'pending': 'pending_expenses',
+    'approved': 'approved_expenses',
+    'rejected': 'rejected_expenses'
+}
+
+class UserStatsService:
+    """Keeps the user_stats collection in step with expense writes."""
+    
+    @staticmethod
+    def empty_stats() -> Dict[str, Any]:
+        return {
+            'total_expenses': 0,
+            'pending_expenses': 0,
+            'approved_expenses': 0,
+            'rejected_expenses': 0,
+            'total_amount': 0.0
+        }
+    
+    @staticmethod
+    def _amount(value: Any) -> Decimal:
+        if isinstance(value, Decimal128):
+            return value.to_decimal()
+        return Decimal('0')
+    
+    @staticmethod
+    def created_delta(status: str, amount: Any) -> Dict[str, Any]:
+        """Counter changes for a newly created expense."""
+        delta = {'total_expenses': 1, STATUS_FIELDS[status]: 1}
+        if status == 'approved':
+            delta['total_amount'] = UserStatsService._amount(amount)
+        return delta
+    
+    @staticmethod
+    def status_change_delta(old_status: str, new_status: str, amount: Any) -> Dict[str, Any]:
+        """Counter changes for an expense moving from old_status to new_status."""
+        if old_status == new_status:
+            return {}
+        
+        delta = {}
+        if old_status in STATUS_FIELDS:
+            delta[STATUS_FIELDS[old_status]] = -1
+        delta[STATUS_FIELDS[new_status]] = 1
+        
+        if old_status == 'approved':
+            delta['total_amount'] = -UserStatsService._amount(amount)
+        elif new_status == 'approved':
+            delta['total_amount'] = UserStatsService._amount(amount)
+        return delta
+    
+    @staticmethod
+    def merge_delta(
+        deltas: Dict[ObjectId, Dict[str, Any]],
+        user_id: ObjectId,
+        delta: Dict[str, Any]
+    ) -> None:
+        """Accumulate a delta for user_id into deltas in place."""
+        user_delta = deltas.setdefault(user_id, {})
+        for field, value in delta.items():
+            user_delta[field] = user_delta.get(field, 0) + value
+    
+    @staticmethod
+    def apply_deltas(deltas: Dict[ObjectId, Dict[str, Any]]) -> bool:
+        """
+        Apply accumulated counter changes with one atomic $inc per user.
+        
+        Returns:
+            True on success; failures are logged and left to rebuild()
+        """
+        operations = []
+        now = datetime.utcnow()
+        for user_id, delta in deltas.items():
+            inc = {
+                field: Decimal128(value) if isinstance(value, Decimal) else value
+                for field, value in delta.items()
+                if value
+            }
+            if inc:
+                operations.append(UpdateOne(
+                    {'_id': user_id},
+                    {'$inc': inc, '$set': {'updated_at': now}},
+                    upsert=True
+                ))
+        
+        if not operations:
+            return True
+        
+        try:
+            mongodb.get_collection('user_stats').bulk_write(operations, ordered=False)
+            return True
+        except Exception as e:
+            logger.error(f"Error updating user stats: {str(e)}")
+            return False
+    
+    @staticmethod
+    def record_created(user_id: ObjectId, status: str, amount: Any) -> bool:
+        return UserStatsService.apply_deltas(
+            {user_id: UserStatsService.created_delta(status, amount)}
+        )
+    
+    @staticmethod
+    def record_status_change(
+        user_id: ObjectId,
+        old_status: str,
+        new_status: str,
+        amount: Any
+    ) -> bool:
+        return UserStatsService.apply_deltas(
+            {user_id: UserStatsService.status_change_delta(old_status, new_status, amount)}
+        )
+    
+    @staticmethod
+    def format_stats(doc: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        stats = UserStatsService.empty_stats()
+        if doc:
+            for field in stats:
+                if field == 'total_amount':
+                    stats[field] = ExpenseModel.decimal_to_float(doc.get(field))
+                else:
+                    stats[field] = doc.get(field, 0)
+        return stats
+    
+    @staticmethod
+    def get_stats(user_id: ObjectId) -> Dict[str, Any]:
+        doc = mongodb.get_collection('user_stats').find_one({'_id': user_id})
+        return UserStatsService.format_stats(doc)
+    
+    @staticmethod
+    def rebuild(user_ids: Optional[List[ObjectId]] = None) -> int:
+        """
+        Recompute user_stats from live and archived expenses.
+        
+        Args:
+            user_ids: Restrict the rebuild to these users; all users if None
+            
+        Returns:
+            Number of user_stats documents written
+        """
+        started = datetime.utcnow()
+        match = {'user_id': {'$in': user_ids}} if user_ids is not None else {}
+        zero = Decimal128('0')
+        
+        def count_status(status):
+            return {'$sum': {'$cond': [{'$eq': ['$status', status]}, 1, 0]}}
+        
+        pipeline = [
+            {'$match': match},
+            {'$unionWith': {'coll': ARCHIVE_COLLECTION, 'pipeline': [{'$match': match}]}},
+            {'$group': {
+                '_id': '$user_id',
+                'total_expenses': {'$sum': 1},
+                'pending_expenses': count_status('pending'),
+                'approved_expenses': count_status('approved'),
+                'rejected_expenses': count_status('rejected'),
+                'total_amount': {'$sum': {'$cond': [
+                    {'$eq': ['$status', 'approved']},
+                    {'$ifNull': ['$amount_inr', zero]},
+                    zero
+                ]}}
+            }},
+            {'$set': {'updated_at': started}},
+            {'$merge': {'into': 'user_stats', 'whenMatched': 'replace', 'whenNotMatched': 'insert'}}
+        ]
+        mongodb.get_collection('expenses').aggregate(pipeline)
+        
+        user_stats = mongodb.get_collection('user_stats')
+        stale = {'updated_at': {'$lt': started}}
+        if user_ids is not None:
+            stale['_id'] = {'$in': user_ids}
+        user_stats.delete_many(stale)
+        
+        written = user_stats.count_documents({'updated_at': {'$gte': started}})
+        logger.info(f"User stats rebuilt: {written} users")
+        return written
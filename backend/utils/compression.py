@@ -0,0 +1,176 @@
+from flask import request
+import logging
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Receipt images, PDFs and xlsx/zip files are already compressed
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'text/csv',
+    'text/html',
+    'text/plain',
+    'text/css',
+    'application/javascript',
+    'text/javascript',
+    'image/svg+xml'
+}
+
+def parse_accept_encoding(header: str) -> dict:
+    """Map each coding in an Accept-Encoding header to its q-value."""
+    codings = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        codings[coding] = q
+    return codings
+
+def choose_encoding(header: str) -> str:
+    """Pick br or gzip from Accept-Encoding, preferring br on equal q-values."""
+    codings = parse_accept_encoding(header)
+    wildcard = codings.get('*', 0.0)
+    
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_q = None, 0.0
+    for coding in candidates:
+        q = codings.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+class _Compressor:
+    """Incremental gzip/brotli compressor with a common interface."""
+    
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            # wbits=31 writes a gzip header and trailer
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+    
+    def flush(self) -> bytes:
+        if self.encoding == 'br':
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+    
+    def finish(self) -> bytes:
+        return self._compressor.finish() if self.encoding == 'br' else self._compressor.flush()
+
+def compress_bytes(data: bytes, encoding: str, level: int) -> bytes:
+    compressor = _Compressor(encoding, level)
+    return compressor.compress(data) + compressor.finish()
+
+def _stream_compressed(chunks, encoding: str, level: int):
+    """
+    Compress a streamed body chunk by chunk.
+    
+    Each chunk is flushed so the client receives rows as they are generated.
+    """
+    compressor = _Compressor(encoding, level)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            if not chunk:
+                continue
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def _should_compress(response, min_size: int) -> bool:
+    if request.method == 'HEAD':
+        return False
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if response.direct_passthrough:
+        # send_file responses: receipts and other stored files
+        return False
+    if 'Content-Encoding' in response.headers:
+        return False
+    if 'no-transform' in response.headers.get('Cache-Control', ''):
+        return False
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return False
+    if not response.is_streamed and response.calculate_content_length() < min_size:
+        return False
+    return True
+
+def init_compression(app) -> None:
+    """
+    Compress responses negotiated through Accept-Encoding.
+    
+    Buffered bodies below COMPRESSION_MIN_SIZE are sent as-is; streamed bodies
+    are always compressed since their size is unknown up front.
+    """
+    if not app.config.get('COMPRESSION_ENABLED', True):
+        logger.info("Response compression disabled")
+        return
+    
+    min_size = app.config.get('COMPRESSION_MIN_SIZE', 1024)
+    levels = {
+        'gzip': app.config.get('COMPRESSION_GZIP_LEVEL', 6),
+        'br': app.config.get('COMPRESSION_BROTLI_LEVEL', 4)
+    }
+    
+    @app.after_request
+    def compress_response(response):
+        if response.mimetype in COMPRESSIBLE_MIMETYPES:
+            response.vary.add('Accept-Encoding')
+        
+        if not _should_compress(response, min_size):
+            return response
+        
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if not encoding:
+            return response
+        
+        if response.is_streamed:
+            response.response = _stream_compressed(response.response, encoding, levels[encoding])
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            started = time.perf_counter()
+            compressed = compress_bytes(body, encoding, levels[encoding])
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            
+            if len(compressed) >= len(body):
+                return response
+            
+            response.set_data(compressed)
+            logger.debug(
+                f"Compressed {request.path} with {encoding}: "
+                f"{len(body)} -> {len(compressed)} bytes in {elapsed_ms:.1f} ms"
+            )
+        
+        response.headers['Content-Encoding'] = encoding
+        response.direct_passthrough = False
+        return response
+    
+    logger.info(
+        f"Response compression enabled ({'br, ' if brotli else ''}gzip, min size {min_size} bytes)"
+    )
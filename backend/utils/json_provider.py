@@ -0,0 +1,70 @@
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+from bson import ObjectId, Decimal128
+from datetime import date, datetime
+from decimal import Decimal
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+def _bson_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class BSONJSONProvider(DefaultJSONProvider):
+    """Standard library provider that also encodes ObjectId, Decimal128 and ISO dates."""
+    
+    default = staticmethod(_bson_default)
+
+class OrjsonProvider(JSONProvider):
+    """
+    orjson-backed provider.
+    
+    datetimes are encoded natively in ISO format, matching BSONJSONProvider;
+    ObjectId and Decimal128 go through the same default hook.
+    """
+    
+    option = orjson.OPT_NON_STR_KEYS if orjson else 0
+    
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=_bson_default, option=self.option).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_bson_default, option=self.option),
+            mimetype='application/json'
+        )
+
+def init_json_provider(app) -> None:
+    """
+    Install the JSON provider selected by JSON_PROVIDER (auto, orjson or default).
+    
+    auto uses orjson when it is installed.
+    """
+    choice = app.config.get('JSON_PROVIDER', 'auto').lower()
+    
+    if choice == 'orjson' and orjson is None:
+        raise RuntimeError("JSON_PROVIDER is 'orjson' but orjson is not installed")
+    
+    if choice in ('auto', 'orjson') and orjson is not None:
+        app.json = OrjsonProvider(app)
+    else:
+        app.json = BSONJSONProvider(app)
+    
+    logger.info(f"JSON provider: {type(app.json).__name__}")
@@ -0,0 +1,143 @@
+"""
+Minimal streaming PDF writer.
+
+Objects are written to the output as soon as they are added and only their
+byte offsets are kept, so a document with thousands of pages is produced
+with memory for one page at a time. Supports what reports need: the
+standard Helvetica fonts, text and line content streams and JPEG images
+embedded as-is (DCTDecode).
+"""
+from typing import BinaryIO, Dict, List, Optional
+import zlib
+
+A4_WIDTH = 595
+A4_HEIGHT = 842
+
+# Average Helvetica glyph width as a fraction of the font size, for truncation
+HELVETICA_AVERAGE_WIDTH = 0.5
+
+def pdf_string(text) -> str:
+    """PDF literal string for text, in WinAnsi (latin-1) with other characters replaced."""
+    encoded = str(text).encode('latin-1', 'replace').decode('latin-1')
+    escaped = encoded.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    escaped = escaped.replace('\r', ' ').replace('\n', ' ')
+    return f"({escaped})"
+
+def fit_text(text, font_size: float, width: float) -> str:
+    """text truncated with '...' to roughly fit width points."""
+    text = str(text or '')
+    max_chars = int(width / (font_size * HELVETICA_AVERAGE_WIDTH))
+    if len(text) <= max_chars:
+        return text
+    return text[:max(max_chars - 3, 0)] + '...'
+
+class PdfStreamWriter:
+    """
+    Write a PDF incrementally to a binary file object, or for drain().
+    
+    Object ids can be reserved before the object is written, so pages can
+    point at a page tree that is only written by close().
+    """
+    
+    def __init__(self, output: Optional[BinaryIO] = None):
+        # Without an output, bytes are kept until drain() is called
+        self.output = output
+        self._pending: List[bytes] = []
+        self.position = 0
+        self.offsets: Dict[int, int] = {}
+        self.next_id = 1
+        self.page_ids: List[int] = []
+        self.pages_id = self.reserve()
+        self.fonts_id = self.reserve()
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self.add(
+            '<< /F1 << /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+            '/Encoding /WinAnsiEncoding >> '
+            '/F2 << /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold '
+            '/Encoding /WinAnsiEncoding >> >>',
+            self.fonts_id
+        )
+    
+    def _write(self, data: bytes) -> None:
+        if self.output is None:
+            self._pending.append(data)
+        else:
+            self.output.write(data)
+        self.position += len(data)
+    
+    def drain(self) -> bytes:
+        """Bytes written since the last drain(), when writing without an output."""
+        data = b''.join(self._pending)
+        self._pending = []
+        return data
+    
+    def reserve(self) -> int:
+        object_id = self.next_id
+        self.next_id += 1
+        return object_id
+    
+    def add(self, body: str, object_id: Optional[int] = None) -> int:
+        object_id = object_id or self.reserve()
+        self.offsets[object_id] = self.position
+        self._write(f"{object_id} 0 obj\n{body}\nendobj\n".encode('latin-1'))
+        return object_id
+    
+    def add_stream(self, dictionary: str, data: bytes, object_id: Optional[int] = None) -> int:
+        object_id = object_id or self.reserve()
+        self.offsets[object_id] = self.position
+        header = f"{object_id} 0 obj\n<< {dictionary} /Length {len(data)} >>\nstream\n"
+        self._write(header.encode('latin-1'))
+        self._write(data)
+        self._write(b"\nendstream\nendobj\n")
+        return object_id
+    
+    def add_jpeg(self, data: bytes, width: int, height: int, grayscale: bool = False) -> int:
+        """Image XObject for baseline JPEG data; returns its object id."""
+        color_space = '/DeviceGray' if grayscale else '/DeviceRGB'
+        return self.add_stream(
+            f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /DCTDecode",
+            data
+        )
+    
+    def add_page(self, content: str, images: Optional[Dict[str, int]] = None) -> int:
+        """
+        Page with a content stream and named image XObjects.
+        
+        Pages appear in page_ids order, which callers may rearrange before
+        close().
+        """
+        content_id = self.add_stream(
+            '/Filter /FlateDecode', zlib.compress(content.encode('latin-1'), 6)
+        )
+        xobjects = ''
+        if images:
+            names = ' '.join(f"/{name} {image_id} 0 R" for name, image_id in images.items())
+            xobjects = f" /XObject << {names} >>"
+        page_id = self.add(
+            f"<< /Type /Page /Parent {self.pages_id} 0 R /MediaBox [0 0 {A4_WIDTH} {A4_HEIGHT}] "
+            f"/Resources << /Font {self.fonts_id} 0 R{xobjects} >> /Contents {content_id} 0 R >>"
+        )
+        self.page_ids.append(page_id)
+        return page_id
+    
+    def close(self, title: str = '') -> None:
+        """Write the page tree, catalog, cross-reference table and trailer."""
+        kids = ' '.join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self.add(f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>", self.pages_id)
+        catalog_id = self.add(f"<< /Type /Catalog /Pages {self.pages_id} 0 R >>")
+        info_id = self.add(f"<< /Title {pdf_string(title)} >>")
+        
+        xref_position = self.position
+        lines = [f"xref\n0 {self.next_id}\n", "0000000000 65535 f \n"]
+        for object_id in range(1, self.next_id):
+            if object_id in self.offsets:
+                lines.append(f"{self.offsets[object_id]:010d} 00000 n \n")
+            else:
+                # Reserved but never written
+                lines.append("0000000000 65535 f \n")
+        self._write(''.join(lines).encode('latin-1'))
+        self._write(
+            f"trailer\n<< /Size {self.next_id} /Root {catalog_id} 0 R /Info {info_id} 0 R >>\n"
+            f"startxref\n{xref_position}\n%%EOF\n".encode('latin-1')
+        )
@@ -1,12 +1,13 @@
 /**
  * Expenses API endpoints
  */
+import { isAxiosError } from 'axios';
 import apiClient from '@/utils/axios';
 
 export interface Expense {
   expense_id: string;
   user_id: string;
-  image_path: string;
+  image_path?: string;
   extracted_data: {
     Date?: string;
     Time?: string;
@@ -19,9 +20,13 @@ export interface Expense {
   };
   status: 'pending' | 'approved' | 'rejected';
   hr_notes?: string | null;
+  version?: number;
   created_at: string;
   updated_at: string;
   user_email?: string; // For HR view
+  amount_inr?: number;
+  currency?: string | null;
+  category?: string;
 }
 
 export interface ExpensesResponse {
@@ -44,6 +49,37 @@ export interface UpdateStatusRequest {
   notes?: string;
 }
 
+export interface UploadSession {
+  upload_id: string;
+  filename: string;
+  size: number;
+  offset: number;
+  chunk_size: number;
+  expires_at: string;
+}
+
+// Files above this size are sent in chunks that can be retried and resumed
+export const RESUMABLE_UPLOAD_THRESHOLD = 5 * 1024 * 1024;
+export const RESUMABLE_MAX_FILE_SIZE = 100 * 1024 * 1024;
+const MAX_CHUNK_RETRIES = 5;
+const CHUNK_RETRY_BASE_DELAY_MS = 1000;
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Offset the server reported with an error response (409 mismatch, 400 bad chunk)
+const errorOffset = (error: unknown): number | undefined => {
+  if (!isAxiosError(error)) return undefined;
+  const offset = error.response?.data?.errors?.offset;
+  return typeof offset === 'number' ? offset : undefined;
+};
+
+const chunkChecksum = async (chunk: Blob): Promise<string | undefined> => {
+  // crypto.subtle is only available on secure origins
+  if (!window.crypto?.subtle) return undefined;
+  const digest = new Uint8Array(await window.crypto.subtle.digest('SHA-256', await chunk.arrayBuffer()));
+  return `sha256 ${btoa(String.fromCharCode(...digest))}`;
+};
+
 export const expensesApi = {
   upload: async (file: File): Promise<ExpenseResponse> => {
     const formData = new FormData();
@@ -61,12 +97,78 @@ export const expensesApi = {
     return response.data;
   },
 
+  uploadResumable: async (
+    file: File,
+    onProgress?: (uploaded: number, total: number) => void
+  ): Promise<ExpenseResponse> => {
+    const created = await apiClient.post<{ data: UploadSession }>('/expenses/uploads', {
+      filename: file.name,
+      size: file.size,
+    });
+    const { upload_id: uploadId, chunk_size: chunkSize } = created.data.data;
+
+    let offset = 0;
+    let failures = 0;
+    while (offset < file.size) {
+      const chunk = file.slice(offset, offset + chunkSize);
+      const headers: Record<string, string> = {
+        'Content-Type': 'application/octet-stream',
+        'Upload-Offset': String(offset),
+      };
+      const checksum = await chunkChecksum(chunk);
+      if (checksum) headers['Upload-Checksum'] = checksum;
+
+      try {
+        const response = await apiClient.put<{ data: { offset: number } }>(
+          `/expenses/uploads/${uploadId}`,
+          chunk,
+          { headers }
+        );
+        offset = response.data.data.offset;
+        failures = 0;
+        onProgress?.(offset, file.size);
+      } catch (error) {
+        failures += 1;
+        if (failures > MAX_CHUNK_RETRIES) throw error;
+        // Back off so a dropped connection has time to come back
+        await sleep(CHUNK_RETRY_BASE_DELAY_MS * 2 ** (failures - 1));
+
+        // Continue from what the server has actually stored
+        const reported = errorOffset(error);
+        if (reported !== undefined) {
+          offset = reported;
+          continue;
+        }
+        try {
+          const session = await apiClient.get<{ data: UploadSession }>(`/expenses/uploads/${uploadId}`);
+          offset = session.data.data.offset;
+        } catch (probeError) {
+          // Counted as another failure; the chunk is resent from the last known offset
+          failures += 1;
+          if (failures > MAX_CHUNK_RETRIES) throw probeError;
+        }
+      }
+    }
+
+    const response = await apiClient.post<ExpenseResponse>(
+      `/expenses/uploads/${uploadId}/complete`,
+      undefined,
+      { timeout: 120000 }
+    );
+    return response.data;
+  },
+
   getMyExpenses: async (status?: string): Promise<ExpensesResponse> => {
     const params = status ? { status } : {};
     const response = await apiClient.get<ExpensesResponse>('/expenses/my', { params });
     return response.data;
   },
 
+  getExpense: async (expenseId: string): Promise<ExpenseResponse> => {
+    const response = await apiClient.get<ExpenseResponse>(`/expenses/${expenseId}`);
+    return response.data;
+  },
+
   getAllExpenses: async (filters?: {
     user_id?: string;
     status?: string;
@@ -82,11 +184,12 @@ export const expensesApi = {
   updateStatus: async (
     expenseId: string,
     status: 'approved' | 'rejected' | 'pending',
-    notes?: string
+    notes?: string,
+    version?: number
   ): Promise<ExpenseResponse> => {
     const response = await apiClient.patch<ExpenseResponse>(
       `/hr/expenses/${expenseId}/status`,
-      { status, notes }
+      { status, notes, version }
     );
     return response.data;
   },
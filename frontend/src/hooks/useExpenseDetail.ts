@@ -0,0 +1,18 @@
+/**
+ * Full expense record for detail views
+ */
+import { useQuery } from '@tanstack/react-query';
+import { expensesApi, Expense } from '@/api/expenses.api';
+
+export const useExpenseDetail = (expense: Expense | null) => {
+  const { data } = useQuery({
+    queryKey: ['expense-detail', expense?.expense_id],
+    queryFn: () => expensesApi.getExpense(expense!.expense_id),
+    enabled: !!expense,
+  });
+
+  if (!expense || data?.data.expense_id !== expense.expense_id) {
+    return expense;
+  }
+  return { ...expense, ...data.data };
+};
@@ -10,10 +10,12 @@ import { Modal } from '@/components/ui/Modal';
 import { formatCurrency, formatDate } from '@/utils/formatters';
 import { Eye, CheckCircle, XCircle, MessageSquare, Clock } from 'lucide-react';
 import { useState } from 'react';
+import { useExpenseDetail } from '@/hooks/useExpenseDetail';
 import { useToastContext } from '@/components/ui/ToastProvider';
 
 export const HRExpenses = () => {
   const [selectedExpense, setSelectedExpense] = useState<any>(null);
+  const expenseDetail = useExpenseDetail(selectedExpense);
   const [notes, setNotes] = useState('');
   const [filters, setFilters] = useState({
     status: '',
@@ -29,8 +31,8 @@ export const HRExpenses = () => {
   });
 
   const updateStatusMutation = useMutation({
-    mutationFn: ({ expenseId, status, notes }: { expenseId: string; status: 'approved' | 'rejected' | 'pending'; notes?: string }) =>
-      expensesApi.updateStatus(expenseId, status, notes),
+    mutationFn: ({ expenseId, status, notes, version }: { expenseId: string; status: 'approved' | 'rejected' | 'pending'; notes?: string; version?: number }) =>
+      expensesApi.updateStatus(expenseId, status, notes, version),
     onSuccess: (data, variables) => {
       queryClient.invalidateQueries({ queryKey: ['hr-all-expenses'] });
       queryClient.invalidateQueries({ queryKey: ['user-expenses'] });
@@ -54,12 +56,17 @@ export const HRExpenses = () => {
   const expenses = data?.data.expenses || [];
 
   const handleStatusChange = (expenseId: string, status: 'approved' | 'rejected' | 'pending') => {
-    updateStatusMutation.mutate({ expenseId, status, notes: notes.trim() || undefined });
+    updateStatusMutation.mutate({
+      expenseId,
+      status,
+      notes: notes.trim() || undefined,
+      version: selectedExpense?.expense_id === expenseId ? selectedExpense.version : undefined,
+    });
   };
 
-  const getImageUrl = (imagePath: string) => {
+  const getImageUrl = (imagePath: string, size?: 'thumb' | 'medium') => {
     const path = imagePath.replace('uploads/expenses/', '');
-    return `${import.meta.env.VITE_API_BASE_URL || 'http://localhost:8001'}/files/${path}`;
+    return `${import.meta.env.VITE_API_BASE_URL || 'http://localhost:8001'}/files/${path}${size ? `?size=${size}` : ''}`;
   };
 
   return (
@@ -209,7 +216,7 @@ export const HRExpenses = () => {
               <div>
                 <h3 className="text-sm font-medium text-gray-500 mb-2">Bill Image</h3>
                 <img
-                  src={getImageUrl(selectedExpense.image_path)}
+                  src={expenseDetail?.image_path ? getImageUrl(expenseDetail.image_path, 'medium') : undefined}
                   alt="Bill"
                   className="w-full h-64 object-contain border border-gray-200 rounded-lg bg-gray-50"
                 />
@@ -266,7 +273,7 @@ export const HRExpenses = () => {
               <h3 className="text-sm font-medium text-gray-500 mb-2">Extracted Data</h3>
               <div className="bg-gray-50 rounded-lg p-4">
                 <pre className="text-xs text-gray-700 overflow-x-auto">
-                  {JSON.stringify(selectedExpense.extracted_data, null, 2)}
+                  {JSON.stringify(expenseDetail?.extracted_data, null, 2)}
                 </pre>
               </div>
             </div>
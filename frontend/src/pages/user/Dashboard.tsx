@@ -3,7 +3,12 @@
  */
 import { useQuery } from '@tanstack/react-query';
 import { PageWrapper } from '@/components/layout/PageWrapper';
-import { expensesApi } from '@/api/expenses.api';
+import {
+  expensesApi,
+  ExpenseResponse,
+  RESUMABLE_UPLOAD_THRESHOLD,
+  RESUMABLE_MAX_FILE_SIZE,
+} from '@/api/expenses.api';
 import { Button } from '@/components/ui/Button';
 import { Badge } from '@/components/ui/Badge';
 import { Modal } from '@/components/ui/Modal';
@@ -23,6 +28,7 @@ import {
   Eye,
 } from 'lucide-react';
 import { useState } from 'react';
+import { useExpenseDetail } from '@/hooks/useExpenseDetail';
 import { formatCurrency, formatDate } from '@/utils/formatters';
 import { useToastContext } from '@/components/ui/ToastProvider';
 import { useNavigate } from 'react-router-dom';
@@ -49,6 +55,7 @@ export const UserDashboard = () => {
   const [uploadProgress, setUploadProgress] = useState(0);
   const [isUploading, setIsUploading] = useState(false);
   const [selectedExpense, setSelectedExpense] = useState<any>(null);
+  const expenseDetail = useExpenseDetail(selectedExpense);
   const { showSuccess, showError } = useToastContext();
 
   const { data, isLoading, refetch } = useQuery({
@@ -151,9 +158,8 @@ export const UserDashboard = () => {
     let progressInterval: NodeJS.Timeout | null = null;
 
     try {
-      const maxSize = 10 * 1024 * 1024; // 10MB
-      if (selectedFile.size > maxSize) {
-        showError('File size exceeds 10MB limit. Please upload a smaller file.');
+      if (selectedFile.size > RESUMABLE_MAX_FILE_SIZE) {
+        showError('File size exceeds 100MB limit. Please upload a smaller file.');
         setIsUploading(false);
         return;
       }
@@ -167,20 +173,28 @@ export const UserDashboard = () => {
 
       showSuccess('Uploading bill image...');
       
-      progressInterval = setInterval(() => {
-        setUploadProgress((prev) => {
-          if (prev >= 85) {
-            if (progressInterval) clearInterval(progressInterval);
-            return 85;
-          }
-          return prev + 10;
+      let response: ExpenseResponse;
+      if (selectedFile.size > RESUMABLE_UPLOAD_THRESHOLD) {
+        // Large files go up in resumable chunks with real progress
+        response = await expensesApi.uploadResumable(selectedFile, (uploaded, total) => {
+          setUploadProgress(Math.round((uploaded / total) * 90));
         });
-      }, 300);
-
-      setUploadProgress(90);
-      showSuccess('Processing image and extracting bill data...');
-      
-      const response = await expensesApi.upload(selectedFile);
+      } else {
+        progressInterval = setInterval(() => {
+          setUploadProgress((prev) => {
+            if (prev >= 85) {
+              if (progressInterval) clearInterval(progressInterval);
+              return 85;
+            }
+            return prev + 10;
+          });
+        }, 300);
+
+        setUploadProgress(90);
+        showSuccess('Processing image and extracting bill data...');
+        
+        response = await expensesApi.upload(selectedFile);
+      }
       
       if (progressInterval) clearInterval(progressInterval);
       setUploadProgress(100);
@@ -216,7 +230,7 @@ export const UserDashboard = () => {
       } else if (error.message) {
         errorMessage = error.message;
       } else if (error.response?.status === 413) {
-        errorMessage = 'File is too large. Maximum size is 10MB.';
+        errorMessage = 'File is too large. Maximum size is 100MB.';
       } else if (error.response?.status === 400) {
         errorMessage = 'Invalid file or bill data could not be extracted. Please ensure the image is clear and contains readable text.';
       } else if (error.response?.status === 401) {
@@ -233,9 +247,9 @@ export const UserDashboard = () => {
     }
   };
 
-  const getImageUrl = (imagePath: string) => {
+  const getImageUrl = (imagePath: string, size?: 'thumb' | 'medium') => {
     const path = imagePath.replace('uploads/expenses/', '');
-    return `${import.meta.env.VITE_API_BASE_URL || 'http://localhost:8001'}/files/${path}`;
+    return `${import.meta.env.VITE_API_BASE_URL || 'http://localhost:8001'}/files/${path}${size ? `?size=${size}` : ''}`;
   };
 
   if (isLoading) {
@@ -709,7 +723,7 @@ export const UserDashboard = () => {
               <div>
                 <h3 className="text-sm font-medium text-gray-500 mb-2">Bill Image</h3>
                 <img
-                  src={getImageUrl(selectedExpense.image_path)}
+                  src={expenseDetail?.image_path ? getImageUrl(expenseDetail.image_path, 'medium') : undefined}
                   alt="Bill"
                   className="w-full h-64 object-contain border border-gray-200 rounded-lg bg-gray-50"
                 />
@@ -801,7 +815,7 @@ export const UserDashboard = () => {
               <h3 className="text-sm font-medium text-gray-500 mb-2">Extracted Data</h3>
               <div className="bg-gray-50 rounded-lg p-4">
                 <pre className="text-xs text-gray-700 overflow-x-auto">
-                  {JSON.stringify(selectedExpense.extracted_data, null, 2)}
+                  {JSON.stringify(expenseDetail?.extracted_data, null, 2)}
                 </pre>
               </div>
             </div>
@@ -9,9 +9,11 @@ import { Modal } from '@/components/ui/Modal';
 import { formatCurrency, formatDate, getStatusColor, getBillTypeColor } from '@/utils/formatters';
 import { Eye, Receipt, MessageSquare } from 'lucide-react';
 import { useState } from 'react';
+import { useExpenseDetail } from '@/hooks/useExpenseDetail';
 
 export const Expenses = () => {
   const [selectedExpense, setSelectedExpense] = useState<any>(null);
+  const expenseDetail = useExpenseDetail(selectedExpense);
   const [statusFilter, setStatusFilter] = useState<string>('');
 
   const { data, isLoading, refetch } = useQuery({
@@ -25,10 +27,10 @@ export const Expenses = () => {
     setSelectedExpense(expense);
   };
 
-  const getImageUrl = (imagePath: string) => {
+  const getImageUrl = (imagePath: string, size?: 'thumb' | 'medium') => {
     // Extract relative path
     const path = imagePath.replace('uploads/expenses/', '');
-    return `${import.meta.env.VITE_API_BASE_URL || 'http://localhost:8001'}/files/${path}`;
+    return `${import.meta.env.VITE_API_BASE_URL || 'http://localhost:8001'}/files/${path}${size ? `?size=${size}` : ''}`;
   };
 
   return (
@@ -172,7 +174,7 @@ export const Expenses = () => {
               <div>
                 <h3 className="text-sm font-medium text-gray-500 mb-2">Bill Image</h3>
                 <img
-                  src={getImageUrl(selectedExpense.image_path)}
+                  src={expenseDetail?.image_path ? getImageUrl(expenseDetail.image_path, 'medium') : undefined}
                   alt="Bill"
                   className="w-full h-64 object-contain border border-gray-200 rounded-lg bg-gray-50"
                 />
@@ -249,7 +251,7 @@ export const Expenses = () => {
               <h3 className="text-sm font-medium text-gray-500 mb-2">Extracted Data</h3>
               <div className="bg-gray-50 rounded-lg p-4">
                 <pre className="text-xs text-gray-700 overflow-x-auto">
-                  {JSON.stringify(selectedExpense.extracted_data, null, 2)}
+                  {JSON.stringify(expenseDetail?.extracted_data, null, 2)}
                 </pre>
               </div>
             </div>